@@ -1,20 +1,41 @@
-from flask import Flask, render_template, request, redirect, url_for, flash, send_file, jsonify, session
+from flask import Flask, render_template, request, redirect, url_for, flash, send_file, jsonify, session, abort, g
+from flask import before_render_template, template_rendered
 from werkzeug.utils import secure_filename
+import click
 from functools import wraps
 from PIL import Image, ImageDraw, ImageFont, ImageOps
+import io
+import json
 import os
+import time
+from datetime import datetime, timedelta
 from dotenv import load_dotenv
 from database import (
-    init_db, add_membre, get_membre, get_all_membres, update_carte_path,
+    init_db, ouvrir_transaction, fermer_transaction, transaction, add_membre, get_membre, get_all_membres, update_carte_path,
     search_membres, delete_membre, verify_admin, get_admin, get_stats,
-    get_membres_en_attente, get_membres_approuves, get_membres_refuses,
-    approuver_membre, refuser_membre, suspendre_membre, reactiver_membre,
-    get_membres_suspendus
+    get_membres_en_attente, get_membres_approuves, get_membres_refuses, reactiver_membre,
+    get_membres_suspendus, get_page_membres, TAILLE_PAGE,
+    fichier_reference, get_fichiers_membres, remplacer_fichiers_membre,
+    approuver_membres, refuser_membres, suspendre_membres,
+    enfiler_cartes, get_tache_carte, COLONNES_EXPORT, get_modifications
 )
-from card_generator import create_alumni_member_card
+from taches_cartes import demarrer_worker_integre, reconstruire_cartes
+from photos import EXTENSION_PHOTO, normaliser_photo
+from stockage import get_stockage, enregistrer, empreinte_cle
+from miniatures import (
+    TAILLES_MINIATURES, FORMATS, empreinte_source, format_accepte, obtenir_miniature, obtenir_format_carte
+)
+from card_generator import FORMATS_CARTE, DPI_IMPRESSION, DPI_DEFAUT
+from planches import PAPIERS, generer_planches
+from exports import zip_cartes_promotion, export_csv, export_xlsx
+from imports import TAILLE_LOT, importer_csv
+import metriques
+from metriques import observer
+import profilage
 from email_service import (
     init_mail, envoyer_email_inscription, envoyer_email_approbation,
-    envoyer_email_refus, envoyer_email_suspension, envoyer_notification_admin
+    envoyer_email_refus, envoyer_email_suspension, envoyer_notification_admin,
+    demarrer_expediteur_integre
 )
 
 # Charger les variables d'environnement
@@ -29,22 +50,171 @@ mail = init_mail(app)
 # Initialiser la base de données
 init_db()
 
-# Configuration
-UPLOAD_FOLDER = 'static/uploads'
-CARDS_FOLDER = 'cards'
-ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif'}
+# Configuration (photos et cartes: voir stockage.py)
+ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif', 'webp'}
 
-app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
-app.config['CARDS_FOLDER'] = CARDS_FOLDER
 app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max
 
-# Créer les dossiers s'ils n'existent pas
-os.makedirs(UPLOAD_FOLDER, exist_ok=True)
-os.makedirs(CARDS_FOLDER, exist_ok=True)
+# Laisser le proxy envoyer les fichiers du stockage local:
+# ENVOI_FICHIERS=x-sendfile (Apache, lighttpd) ou x-accel-redirect (nginx, location
+# interne X_ACCEL_PREFIXE servant STOCKAGE_RACINE)
+ENVOI_FICHIERS = os.getenv('ENVOI_FICHIERS', '')
+X_ACCEL_PREFIXE = os.getenv('X_ACCEL_PREFIXE', '/media-interne/')
+app.config['USE_X_SENDFILE'] = ENVOI_FICHIERS == 'x-sendfile'
+
+# Mesures des requêtes: enregistrées en premier, la fermeture (teardown) passe
+# donc en dernier et compte aussi le commit de la transaction de la requête
+@app.before_request
+def demarrer_mesure():
+    """Chronométrer la requête et rattacher ses requêtes SQL à sa route"""
+    g.debut_requete = time.perf_counter()
+    metriques.contexte.route = request.url_rule.rule if request.url_rule else 'inconnue'
+    profilage.debut_requete()
+
+@app.after_request
+def noter_code_reponse(response):
+    g.code_reponse = response.status_code
+    return response
+
+@app.teardown_request
+def terminer_mesure(exc):
+    """Durée de la requête par route, méthode et code (corps en flux non compris)"""
+    if 'debut_requete' in g:
+        duree = time.perf_counter() - g.debut_requete
+        code = g.get('code_reponse', 500)
+        observer('alubilles_http_requete_duree_secondes', duree,
+                 route=metriques.contexte.route, methode=request.method, code=code)
+        profilage.fin_requete(metriques.contexte.route, request.method, code, duree)
+    metriques.contexte.route = None
+
+# Étape « template » des requêtes profilées
+@before_render_template.connect_via(app)
+def debut_template(sender, template, context, **extra):
+    g.debut_template = profilage.ouvrir_etape()
+
+@template_rendered.connect_via(app)
+def fin_template(sender, template, context, **extra):
+    profilage.fermer_etape('template', g.pop('debut_template', None))
+
+def taille_fichier(fichier):
+    """Taille d'un fichier reçu, sans le lire"""
+    fichier.stream.seek(0, os.SEEK_END)
+    taille = fichier.stream.tell()
+    fichier.stream.seek(0)
+    return taille
+
+@app.before_request
+def demarrer_workers():
+    """
+    Mode intégré (optionnel): rendre les cartes et envoyer les emails dans ce processus
+
+    Par défaut, ce sont les processus dédiés du Procfile (worker, mailer)
+    qui s'en chargent. CARTES_WORKER_INTEGRE=1 / EMAILS_EXPEDITEUR_INTEGRE=1
+    pour un déploiement à un seul processus web (développement): sinon chaque
+    worker gunicorn aurait son pool de rendu et son expéditeur SMTP.
+    """
+    if os.getenv('CARTES_WORKER_INTEGRE', '0') == '1':
+        demarrer_worker_integre()
+    if os.getenv('EMAILS_EXPEDITEUR_INTEGRE', '0') == '1':
+        demarrer_expediteur_integre(app)
+
+# Endpoints qui découpent eux-mêmes leurs transactions (import par lots)
+ENDPOINTS_SANS_TRANSACTION = {'static', 'admin_import'}
+
+@app.before_request
+def ouvrir_transaction_requete():
+    """Toutes les requêtes SQL d'une requête HTTP partagent une connexion et une transaction"""
+    if request.endpoint in ENDPOINTS_SANS_TRANSACTION:
+        return
+    # Transaction différée: les fonctions qui écrivent prennent le verrou
+    # d'écriture (transaction(immediate=True)) au moment d'écrire seulement
+    ouvrir_transaction()
+
+@app.teardown_request
+def fermer_transaction_requete(exc):
+    """Valider la transaction de la requête (ou l'annuler en cas d'exception)"""
+    fermer_transaction(exc)
+
+def envoyer_fichier(cle, mimetype='image/png', **options):
+    """
+    Envoyer un fichier du stockage avec validation HTTP
+
+    ETag = sha256 du contenu, Last-Modified = date du fichier: If-None-Match et
+    If-Modified-Since donnent un 304, Range un 206. Avec ENVOI_FICHIERS, seuls
+    les en-têtes partent de Python et le proxy envoie les octets.
+    """
+    stockage = get_stockage()
+    chemin = stockage.chemin_local(cle)
+    etag = empreinte_source(cle)
+
+    if chemin and ENVOI_FICHIERS == 'x-accel-redirect' and empreinte_cle(cle):
+        reponse = app.response_class(mimetype=mimetype)
+        reponse.set_etag(etag)
+        reponse.last_modified = os.path.getmtime(chemin)
+        if options.get('as_attachment'):
+            reponse.headers.set('Content-Disposition', 'attachment', filename=options.get('download_name'))
+        reponse = reponse.make_conditional(request)
+        if reponse.status_code == 200:
+            # nginx sert le fichier (et les Range) depuis sa location interne
+            reponse.headers['X-Accel-Redirect'] = X_ACCEL_PREFIXE + cle
+    elif chemin:
+        reponse = send_file(os.path.abspath(chemin), mimetype=mimetype, etag=etag, conditional=True, **options)
+    else:
+        reponse = send_file(stockage.ouvrir(cle), mimetype=mimetype, etag=etag, conditional=True, **options)
+
+    return entetes_telechargement(reponse)
+
+def entetes_telechargement(reponse):
+    """Annoncer la reprise de téléchargement; revalidation à chaque ouverture (no-cache), jamais en cache partagé"""
+    reponse.accept_ranges = 'bytes'
+    reponse.cache_control.no_cache = True
+    reponse.cache_control.private = True
+    return reponse
+
+def format_carte_demande():
+    """
+    Format de carte demandé: ?format=png|webp|pdf, sinon négocié sur Accept
+
+    Une navigation (Accept contient text/html) reçoit toujours le PNG: les
+    navigateurs y annoncent image/webp sans que l'utilisateur l'ait choisi.
+    Retourne None pour un format inconnu.
+    """
+    if 'format' in request.args:
+        fmt = request.args['format'].lower()
+        return fmt if fmt in FORMATS_CARTE else None
+    if request.accept_mimetypes.accept_html:
+        return 'png'
+    types = {mimetype: fmt for fmt, (mimetype, _) in FORMATS_CARTE.items()}
+    return types[request.accept_mimetypes.best_match(list(types), default='image/png')]
 
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
+def page_demandee(liste, taille=TAILLE_PAGE):
+    """Page keyset demandée via ?apres=, ?avant= et ?taille= (ValueError si curseur invalide)"""
+    return get_page_membres(
+        liste,
+        apres=request.args.get('apres'),
+        avant=request.args.get('avant'),
+        taille=request.args.get('taille', taille, type=int)
+    )
+
+def page_admin(liste, taille=TAILLE_PAGE):
+    """Page pour une vue admin: un curseur invalide ramène à la première page"""
+    try:
+        return page_demandee(liste, taille)
+    except ValueError:
+        flash('Lien de pagination invalide', 'error')
+        return get_page_membres(liste, taille=taille)
+
+def ids_selectionnes():
+    """IDs des membres cochés dans un formulaire d'action groupée"""
+    return [int(i) for i in request.form.getlist('membre_ids') if i.isdigit()]
+
+def statut_inchange(membre_id, message):
+    """Message d'une action sans effet: membre inconnu, ou `message` s'il est dans un autre statut"""
+    return 'Membre non trouvé' if get_membre(membre_id) is None else message
+
 # Décorateur pour protéger les routes admin
 def admin_required(f):
     @wraps(f)
@@ -93,23 +263,31 @@ def inscription():
         if 'photo' in request.files:
             file = request.files['photo']
             if file and file.filename and allowed_file(file.filename):
-                filename = secure_filename(f"{nom}_{prenom}_{file.filename}")
-                photo_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-                file.save(photo_path)
-
-        # Ajouter le membre à la base de données (statut en_attente)
-        membre_id, numero_membre = add_membre(
-            nom, prenom, date_naissance, genre, promotion, programme,
-            email, telephone, adresse, photo_path
-        )
-
-        # Envoyer un email de confirmation au membre
-        if email:
-            envoyer_email_inscription(email, nom, prenom, numero_membre)
-
-        # Envoyer une notification à l'admin
-        admin_email = os.getenv('ADMIN_EMAIL', 'admin@alubilles.org')
-        envoyer_notification_admin(admin_email, nom, prenom, numero_membre)
+                observer('alubilles_upload_octets', taille_fichier(file), type='photo')
+                # Vérifiée, redressée et réduite (photos.py), puis stockée par contenu
+                try:
+                    photo_path = enregistrer(normaliser_photo(file.stream), EXTENSION_PHOTO)
+                except ValueError as e:
+                    flash(f'Photo refusée: {e}', 'error')
+                    return redirect(url_for('index'))
+
+        # Inscription et emails ensemble: une erreur (rattrapée plus bas)
+        # annule le bloc entier, la transaction de la requête ne valide rien
+        with transaction(immediate=True):
+            # Ajouter le membre à la base de données (statut en_attente)
+            membre_id, numero_membre = add_membre(
+                nom=nom, prenom=prenom, date_naissance=date_naissance, promotion=promotion,
+                programme=programme, genre=genre, email=email, telephone=telephone,
+                adresse=adresse, photo_path=photo_path
+            )
+
+            # Envoyer un email de confirmation au membre
+            if email:
+                envoyer_email_inscription(email, nom, prenom, numero_membre)
+
+            # Envoyer une notification à l'admin
+            admin_email = os.getenv('ADMIN_EMAIL', 'admin@alubilles.org')
+            envoyer_notification_admin(admin_email, nom, prenom, numero_membre)
 
         flash(f'Inscription envoyée! Votre numéro de dossier: {numero_membre}. Vous recevrez un email de confirmation.', 'success')
         return redirect(url_for('inscription_confirmee', membre_id=membre_id))
@@ -146,7 +324,8 @@ def verifier_statut():
             if not membre:
                 flash('Numéro de dossier non trouvé', 'error')
 
-    return render_template('verifier_statut.html', membre=membre)
+    tache = get_tache_carte(membre['id']) if membre and not membre['carte_path'] else None
+    return render_template('verifier_statut.html', membre=membre, tache=tache)
 
 @app.route('/telecharger-carte/<int:membre_id>')
 def telecharger_carte(membre_id):
@@ -161,14 +340,98 @@ def telecharger_carte(membre_id):
         return redirect(url_for('verifier_statut'))
 
     if not membre['carte_path']:
-        flash('Carte non encore générée', 'error')
+        tache = get_tache_carte(membre_id)
+        if tache and tache['statut'] in ('queued', 'running'):
+            flash('Votre carte est en cours de génération. Réessayez dans quelques instants.', 'warning')
+        elif tache and tache['statut'] == 'failed':
+            flash('La génération de votre carte a échoué. Veuillez contacter l\'administration.', 'error')
+        else:
+            flash('Carte non encore générée', 'error')
         return redirect(url_for('verifier_statut'))
 
-    return send_file(
-        membre['carte_path'],
-        as_attachment=True,
-        download_name=f"carte_membre_{membre['numero_membre']}.png"
-    )
+    fmt = format_carte_demande()
+    if fmt is None:
+        flash('Format de carte inconnu', 'error')
+        return redirect(url_for('verifier_statut'))
+    mimetype, extension = FORMATS_CARTE[fmt]
+    nom_fichier = f"carte_membre_{membre['numero_membre']}{extension}"
+
+    if fmt == 'png':
+        reponse = envoyer_fichier(membre['carte_path'], as_attachment=True, download_name=nom_fichier)
+    else:
+        # WebP et PDF: convertis une fois depuis le PNG de référence puis gardés en cache
+        dpi = request.args.get('dpi', DPI_DEFAUT, type=int)
+        if dpi not in DPI_IMPRESSION:
+            dpi = DPI_DEFAUT
+        derive = obtenir_format_carte(membre['carte_path'], fmt, dpi)
+        if derive is None:
+            flash('Carte non encore générée', 'error')
+            return redirect(url_for('verifier_statut'))
+        chemin, empreinte = derive
+        reponse = entetes_telechargement(send_file(
+            os.path.abspath(chemin), mimetype=mimetype, as_attachment=True, download_name=nom_fichier,
+            etag=f"{empreinte}-{fmt}-{dpi}" if fmt == 'pdf' else f"{empreinte}-{fmt}", conditional=True
+        ))
+
+    if 'format' not in request.args:
+        reponse.vary.add('Accept')
+    return reponse
+
+# ==================== ROUTES MÉDIAS ====================
+
+DUREE_CACHE_IMMUABLE = 365 * 24 * 3600
+
+@app.template_global()
+def url_miniature(membre, taille, source='photo'):
+    """URL de la miniature de la photo (ou de la carte) d'un membre, versionnée par le contenu du fichier"""
+    chemin = membre['photo_path'] if source == 'photo' else membre['carte_path']
+    empreinte = empreinte_source(chemin) if chemin else None
+    endpoint = 'miniature_photo' if source == 'photo' else 'miniature_carte'
+    if empreinte is None:
+        return url_for(endpoint, taille=taille, membre_id=membre['id'])
+    return url_for(endpoint, taille=taille, membre_id=membre['id'], v=empreinte[:16])
+
+def servir_miniature(source, taille):
+    """Réponse d'une miniature: ETag fort, immuable si l'URL porte la bonne version"""
+    if taille not in TAILLES_MINIATURES or not source:
+        abort(404)
+
+    fmt = format_accepte(request.headers.get('Accept'))
+    resultat = obtenir_miniature(source, taille, fmt)
+    if resultat is None:
+        abort(404)
+    chemin, empreinte = resultat
+
+    reponse = send_file(os.path.abspath(chemin), mimetype=FORMATS[fmt][1],
+                        etag=f"{empreinte[:32]}-{taille}-{fmt}", conditional=True)
+    reponse.vary.add('Accept')
+    if request.args.get('v') == empreinte[:16]:
+        # L'URL change avec le contenu de la source: le navigateur n'a jamais à revalider
+        reponse.cache_control.no_cache = None
+        reponse.cache_control.max_age = DUREE_CACHE_IMMUABLE
+        reponse.cache_control.immutable = True
+    else:
+        reponse.cache_control.no_cache = True
+    # Données personnelles: pas de cache partagé (proxy, CDN)
+    reponse.cache_control.private = True
+    return reponse
+
+@app.route('/media/thumb/<int:taille>/<int:membre_id>')
+@admin_required
+def miniature_photo(taille, membre_id):
+    """Miniature de la photo d'un membre (pages admin)"""
+    membre = get_membre(membre_id)
+    if not membre:
+        abort(404)
+    return servir_miniature(membre['photo_path'], taille)
+
+@app.route('/media/thumb/<int:taille>/<int:membre_id>/carte')
+def miniature_carte(taille, membre_id):
+    """Aperçu de la carte d'un membre approuvé (mêmes règles que le téléchargement)"""
+    membre = get_membre(membre_id)
+    if not membre or membre['statut'] != 'approuve':
+        abort(404)
+    return servir_miniature(membre['carte_path'], taille)
 
 # ==================== ROUTES ADMIN ====================
 
@@ -204,67 +467,105 @@ def admin_logout():
 def admin_dashboard():
     """Tableau de bord admin"""
     stats = get_stats()
-    inscriptions_en_attente = get_membres_en_attente()
-    return render_template('admin/dashboard.html', stats=stats, inscriptions=inscriptions_en_attente)
+    inscriptions_en_attente = get_page_membres('en_attente', taille=5)['membres']
+    return render_template('admin/dashboard.html', stats=stats, inscriptions=inscriptions_en_attente,
+                           colonnes_export=COLONNES_EXPORT)
 
 @app.route('/admin/inscriptions')
 @admin_required
 def admin_inscriptions():
     """Liste des inscriptions en attente"""
     stats = get_stats()
-    inscriptions = get_membres_en_attente()
-    return render_template('admin/inscriptions.html',stats=stats, inscriptions=inscriptions)
+    page = page_admin('en_attente')
+    return render_template('admin/inscriptions.html',stats=stats, inscriptions=page['membres'], page=page)
 
 @app.route('/admin/approuver/<int:membre_id>', methods=['POST'])
 @admin_required
 def admin_approuver(membre_id):
     """Approuver une inscription"""
-    membre = get_membre(membre_id)
-    if not membre:
-        flash('Membre non trouvé', 'error')
+    # Seule une inscription encore en attente est approuvée; la ligne renvoyée
+    # par la mise à jour sert à la carte, à l'email et au message
+    membres = approuver_membres([membre_id])
+    if not membres:
+        flash(statut_inchange(membre_id, "Cette inscription n'est plus en attente"), 'error')
         return redirect(url_for('admin_inscriptions'))
+    membre = membres[0]
 
-    # Approuver le membre
-    approuver_membre(membre_id)
-
-    # Chemins pour la génération de la carte
-    template_path = 'static/images/Carte_membre_base.png'
-    carte_filename = f"carte_{membre['numero_membre']}.png"
-    output_path = os.path.join(app.config['CARDS_FOLDER'], carte_filename)
-
-    # Préparer les données pour la carte
-    membre_data = {
-        'numero_membre': membre['numero_membre'],
-        'nom': membre['nom'],
-        'prenom': membre['prenom'],
-        'email': membre['email'],
-        'telephone': membre['telephone'],
-        'photo_path': membre['photo_path']
-    }
-
-    # Générer la carte
-    create_alumni_member_card(membre_data, template_path, output_path)
-    update_carte_path(membre_id, output_path)
+    # Mettre la carte en file (rendue par le worker de cartes)
+    enfiler_cartes([membre['id']])
 
     # Envoyer un email d'approbation
     if membre['email']:
         envoyer_email_approbation(membre['email'], membre['nom'], membre['prenom'], membre['numero_membre'])
 
-    flash(f'✓ Inscription de {membre["prenom"]} {membre["nom"]} approuvée! Email envoyé.', 'success')
+    flash(f'✓ Inscription de {membre["prenom"]} {membre["nom"]} approuvée! Email envoyé, carte en cours de génération.', 'success')
+    return redirect(url_for('admin_inscriptions'))
+
+@app.route('/admin/approuver-lot', methods=['POST'])
+@admin_required
+def admin_approuver_lot():
+    """Approuver toutes les inscriptions sélectionnées"""
+    ids = ids_selectionnes()
+    if not ids:
+        flash('Aucune inscription sélectionnée', 'error')
+        return redirect(url_for('admin_inscriptions'))
+
+    # Cartes et emails pour les seuls membres passés au statut approuvé
+    membres = approuver_membres(ids)
+    enfiler_cartes(membre['id'] for membre in membres)
+    for membre in membres:
+        if membre['email']:
+            envoyer_email_approbation(membre['email'], membre['nom'], membre['prenom'], membre['numero_membre'])
+
+    flash(f'✓ {len(membres)} inscription(s) approuvée(s). Cartes et emails en cours de traitement.', 'success')
     return redirect(url_for('admin_inscriptions'))
 
+@app.route('/admin/refuser-lot', methods=['POST'])
+@admin_required
+def admin_refuser_lot():
+    """Refuser toutes les inscriptions sélectionnées"""
+    ids = ids_selectionnes()
+    if not ids:
+        flash('Aucune inscription sélectionnée', 'error')
+        return redirect(url_for('admin_inscriptions'))
+
+    motif = request.form.get('motif', '')
+    membres = refuser_membres(ids, motif)
+    for membre in membres:
+        if membre['email']:
+            envoyer_email_refus(membre['email'], membre['nom'], membre['prenom'], motif)
+
+    flash(f'{len(membres)} inscription(s) refusée(s). Emails en cours d\'envoi.', 'warning')
+    return redirect(url_for('admin_inscriptions'))
+
+@app.route('/admin/suspendre-lot', methods=['POST'])
+@admin_required
+def admin_suspendre_lot():
+    """Suspendre tous les membres sélectionnés"""
+    ids = ids_selectionnes()
+    if not ids:
+        flash('Aucun membre sélectionné', 'error')
+        return redirect(url_for('admin_membres'))
+
+    motif = request.form.get('motif') or 'Défaut de paiement'
+    membres = suspendre_membres(ids, motif)
+    for membre in membres:
+        if membre['email']:
+            envoyer_email_suspension(membre['email'], membre['nom'], membre['prenom'], motif)
+
+    flash(f'{len(membres)} membre(s) suspendu(s). Emails en cours d\'envoi.', 'warning')
+    return redirect(url_for('admin_membres'))
 
 @app.route('/admin/refuser/<int:membre_id>', methods=['POST'])
 @admin_required
 def admin_refuser(membre_id):
     """Refuser une inscription"""
-    membre = get_membre(membre_id)
-    if not membre:
-        flash('Membre non trouvé', 'error')
-        return redirect(url_for('admin_inscriptions'))
-
     motif = request.form.get('motif', '')
-    refuser_membre(membre_id, motif)
+    membres = refuser_membres([membre_id], motif)
+    if not membres:
+        flash(statut_inchange(membre_id, "Cette inscription n'est plus en attente"), 'error')
+        return redirect(url_for('admin_inscriptions'))
+    membre = membres[0]
 
     # Envoyer un email de refus
     if membre['email']:
@@ -277,13 +578,12 @@ def admin_refuser(membre_id):
 @admin_required
 def admin_suspendre(membre_id):
     """Suspendre un membre"""
-    membre = get_membre(membre_id)
-    if not membre:
-        flash('Membre non trouvé', 'error')
-        return redirect(url_for('admin_membres'))
-
     motif = request.form.get('motif', 'Défaut de paiement')
-    suspendre_membre(membre_id, motif)
+    membres = suspendre_membres([membre_id], motif)
+    if not membres:
+        flash(statut_inchange(membre_id, "Ce membre n'est pas approuvé"), 'error')
+        return redirect(url_for('admin_membres'))
+    membre = membres[0]
 
     # Envoyer un email de suspension
     if membre['email']:
@@ -315,8 +615,8 @@ def admin_reactiver(membre_id):
 def admin_suspendus():
     """Liste des membres suspendus"""
     stats = get_stats()
-    membres = get_membres_suspendus()
-    return render_template('admin/suspendus.html',stats=stats, membres=membres)
+    page = page_admin('suspendu')
+    return render_template('admin/suspendus.html',stats=stats, membres=page['membres'], page=page)
 
 @app.route('/admin/membres')
 @admin_required
@@ -324,20 +624,137 @@ def admin_membres():
     """Liste de tous les membres approuvés"""
     stats = get_stats()
     query = request.args.get('search', '')
+    page = None
+    tronque = False
     if query:
-        membres = search_membres(query, 'approuve')
+        resultat = search_membres(query, 'approuve')
+        membres, tronque = resultat['membres'], resultat['tronque']
+    else:
+        page = page_admin('approuve')
+        membres = page['membres']
+
+    return render_template('admin/membres.html',stats=stats, membres=membres, search_query=query, page=page,
+                           tronque=tronque)
+
+@app.route('/admin/planches.pdf')
+@admin_required
+def admin_planches():
+    """Planches d'impression des cartes (PDF en flux): par promotion, dates d'approbation ou sélection"""
+    papier = request.args.get('papier', 'a4')
+    if papier not in PAPIERS:
+        papier = 'a4'
+    selection = {
+        'promotion': request.args.get('promotion', '').strip() or None,
+        'valide_du': request.args.get('valide_du') or None,
+        'valide_au': request.args.get('valide_au') or None,
+        'ids': [int(i) for i in request.args.getlist('membre_ids') if i.isdigit()] or None,
+    }
+    for borne in (selection['valide_du'], selection['valide_au']):
+        try:
+            if borne:
+                datetime.strptime(borne, '%Y-%m-%d')
+        except ValueError:
+            flash('Date invalide (format AAAA-MM-JJ)', 'error')
+            return redirect(url_for('admin_membres'))
+
+    nom_fichier = f"planches_cartes_{datetime.now():%Y%m%d_%H%M}.pdf"
+    return app.response_class(
+        metriques.flux_de_la_route(generer_planches(papier, **selection)),
+        mimetype='application/pdf',
+        headers={'Content-Disposition': f'attachment; filename={nom_fichier}'}
+    )
+
+@app.route('/admin/cartes-promotion.zip')
+@admin_required
+def admin_cartes_promotion():
+    """Archive ZIP (en flux) des cartes des membres approuvés d'une promotion"""
+    promotion = request.args.get('promotion', '').strip()
+    if not promotion:
+        flash('Indiquez une promotion', 'error')
+        return redirect(url_for('admin_membres'))
+
+    nom_fichier = secure_filename(f"cartes_promotion_{promotion}.zip")
+    return app.response_class(
+        metriques.flux_de_la_route(zip_cartes_promotion(promotion)),
+        mimetype='application/zip',
+        headers={'Content-Disposition': f'attachment; filename={nom_fichier}'}
+    )
+
+@app.route('/admin/import', methods=['POST'])
+@admin_required
+def admin_import():
+    """Importer un CSV de membres historiques (validé en entier avant toute insertion, sans emails)"""
+    fichier = request.files.get('fichier')
+    if not fichier or not fichier.filename:
+        flash('Aucun fichier sélectionné', 'error')
+        return redirect(url_for('admin_dashboard'))
+
+    observer('alubilles_upload_octets', taille_fichier(fichier), type='import_csv')
+    flux = io.TextIOWrapper(fichier.stream, encoding='utf-8-sig', newline='')
+    try:
+        rapport = importer_csv(flux, approuves=bool(request.form.get('approuves')),
+                               simulation=bool(request.form.get('simulation')))
+    except UnicodeDecodeError:
+        flash('Fichier illisible: enregistrez le CSV en UTF-8', 'error')
+        return redirect(url_for('admin_dashboard'))
+    except ValueError as e:
+        flash(str(e), 'error')
+        return redirect(url_for('admin_dashboard'))
+
+    if rapport['nb_erreurs']:
+        flash(f"{rapport['nb_erreurs']} ligne(s) invalide(s) sur {rapport['lignes']}: rien n'a été importé", 'error')
+        for numero, message in rapport['erreurs'][:10]:
+            flash(f"Ligne {numero}: {message}", 'error')
+    elif request.form.get('simulation'):
+        flash(f"{rapport['lignes']} ligne(s) valide(s), prêtes à importer", 'success')
     else:
-        membres = get_membres_approuves()
+        flash(f"{rapport['importes']} membre(s) importé(s)", 'success')
+    return redirect(url_for('admin_dashboard'))
+
+EXPORTS = {
+    'csv': (export_csv, 'text/csv; charset=utf-8'),
+    'xlsx': (export_xlsx, 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'),
+}
+
+@app.route('/admin/export.<any(csv, xlsx):fmt>')
+@admin_required
+def admin_export(fmt):
+    """Export du registre en CSV ou XLSX (en flux), avec filtres et choix des colonnes"""
+    colonnes = [c.strip() for valeur in request.args.getlist('colonnes') for c in valeur.split(',') if c.strip()]
+    colonnes = colonnes or list(COLONNES_EXPORT)
+    filtres = {
+        cle: request.args.get(cle, '').strip() or None
+        for cle in ('statut', 'promotion', 'programme', 'inscrit_du', 'inscrit_au')
+    }
+
+    # Vérifier avant d'envoyer les en-têtes: une erreur en cours de flux ne peut plus être signalée
+    inconnues = [c for c in colonnes if c not in COLONNES_EXPORT]
+    if inconnues:
+        flash(f"Colonnes inconnues: {', '.join(inconnues)}", 'error')
+        return redirect(url_for('admin_dashboard'))
+    for borne in (filtres['inscrit_du'], filtres['inscrit_au']):
+        try:
+            if borne:
+                datetime.strptime(borne, '%Y-%m-%d')
+        except ValueError:
+            flash('Date invalide (format AAAA-MM-JJ)', 'error')
+            return redirect(url_for('admin_dashboard'))
 
-    return render_template('admin/membres.html',stats=stats, membres=membres, search_query=query)
+    generateur, mimetype = EXPORTS[fmt]
+    nom_fichier = f"membres_{datetime.now():%Y%m%d_%H%M}.{fmt}"
+    return app.response_class(
+        metriques.flux_de_la_route(generateur(colonnes, **filtres)),
+        mimetype=mimetype,
+        headers={'Content-Disposition': f'attachment; filename={nom_fichier}'}
+    )
 
 @app.route('/admin/refuses')
 @admin_required
 def admin_refuses():
     """Liste des inscriptions refusées"""
     stats = get_stats()
-    membres = get_membres_refuses()
-    return render_template('admin/refuses.html',stats=stats, membres=membres)
+    page = page_admin('refuse')
+    return render_template('admin/refuses.html',stats=stats, membres=page['membres'], page=page)
 
 @app.route('/admin/membre/<int:membre_id>')
 @admin_required
@@ -357,17 +774,48 @@ def admin_supprimer(membre_id):
     """Supprimer un membre"""
     membre = get_membre(membre_id)
     if membre:
-        # Supprimer les fichiers associés
-        if membre['photo_path'] and os.path.exists(membre['photo_path']):
-            os.remove(membre['photo_path'])
-        if membre['carte_path'] and os.path.exists(membre['carte_path']):
-            os.remove(membre['carte_path'])
-
         delete_membre(membre_id)
+
+        # Supprimer les fichiers associés, sauf ceux partagés (contenu identique) avec un autre membre
+        for cle in (membre['photo_path'], membre['carte_path']):
+            if cle and not fichier_reference(cle):
+                get_stockage().supprimer(cle)
         flash('Membre supprimé avec succès', 'success')
 
     return redirect(url_for('admin_membres'))
 
+@app.route('/admin/profils')
+@admin_required
+def admin_profils():
+    """Requêtes profilées les plus lentes, avec le temps par étape (PROFILAGE=1)"""
+    return render_template('admin/profils.html', stats=get_stats(), profils=profilage.lister_profils(),
+                           actif=profilage.PROFILAGE, seuil=profilage.PROFILAGE_SEUIL_MS,
+                           taux=profilage.PROFILAGE_TAUX, etapes=profilage.ETAPES)
+
+@app.route('/admin/profils/<ident>.<any(speedscope, txt):fmt>')
+@admin_required
+def admin_profil(ident, fmt):
+    """Profil d'une requête: JSON speedscope, ou piles repliées (flamegraph.pl)"""
+    profil = profilage.lire_profil(ident)
+    if profil is None:
+        abort(404)
+    if fmt == 'txt':
+        return app.response_class(profilage.piles_repliees(profil), mimetype='text/plain')
+    return app.response_class(json.dumps(profil), mimetype='application/json', headers={
+        'Content-Disposition': f'attachment; filename=profil_{ident}.speedscope.json'
+    })
+
+@app.route('/admin/metrics')
+def admin_metrics():
+    """Métriques Prometheus de tous les processus (session admin, ou Basic auth d'un compte admin)"""
+    identifiants = request.authorization
+    if 'admin_id' not in session and not (
+            identifiants and identifiants.type == 'basic'
+            and verify_admin(identifiants.username, identifiants.password)):
+        return app.response_class('Authentification requise\n', 401,
+                                  {'WWW-Authenticate': 'Basic realm="metriques"'}, mimetype='text/plain')
+    return app.response_class(metriques.exposition(), mimetype='text/plain; version=0.0.4; charset=utf-8')
+
 @app.route('/api/stats')
 @admin_required
 def api_stats():
@@ -375,12 +823,131 @@ def api_stats():
     stats = get_stats()
     return jsonify(stats)
 
+@app.route('/api/membres')
+@admin_required
+def api_membres():
+    """API de liste paginée: ?liste=approuve&apres=<curseur>&taille=50"""
+    try:
+        page = page_demandee(request.args.get('liste', 'tous'))
+    except ValueError as e:
+        return jsonify({'erreur': str(e)}), 400
+
+    return jsonify({
+        'membres': [dict(membre) for membre in page['membres']],
+        'suivant': page['suivant'],
+        'precedent': page['precedent']
+    })
+
+@app.route('/api/membres/changes')
+@admin_required
+def api_membres_changes():
+    """Flux des modifications: ?since=<version>&taille=50, à rappeler avec 'version' tant que 'encore'"""
+    since = request.args.get('since', '0')
+    if not since.isdigit():
+        return jsonify({'erreur': 'since doit être un numéro de version'}), 400
+    taille = request.args.get('taille', str(TAILLE_PAGE))
+    if not taille.isdigit():
+        return jsonify({'erreur': 'taille doit être un entier'}), 400
+
+    page = get_modifications(int(since), int(taille))
+    return jsonify({
+        'modifications': [dict(membre) for membre in page['modifications']],
+        'suppressions': [dict(suppression) for suppression in page['suppressions']],
+        'version': page['version'],
+        'encore': page['encore']
+    })
+
+# ==================== COMMANDES CLI ====================
+
+@app.cli.group('cards')
+def cartes_cli():
+    """Gestion des cartes de membre"""
+
+@cartes_cli.command('rebuild')
+@click.option('--processus', type=int, default=None, help='Processus de rendu (défaut: nombre de cœurs)')
+@click.option('--force', is_flag=True, help='Re-rendre toutes les cartes, même inchangées')
+def cartes_rebuild(processus, force):
+    """Re-rendre les cartes des membres approuvés dont le contenu a changé"""
+    compteurs = reconstruire_cartes(processus, forcer=force)
+    click.echo(f"✓ {compteurs['rendues']} cartes rendues, {compteurs['inchangees']} inchangées, "
+               f"{compteurs['echecs']} échecs en {compteurs['duree']:.1f}s")
+
+@app.cli.group('membres')
+def membres_cli():
+    """Gestion du registre des membres"""
+
+@membres_cli.command('import')
+@click.argument('fichier', type=click.Path(exists=True, dir_okay=False))
+@click.option('--approuves', is_flag=True, help='Importer directement au statut approuvé')
+@click.option('--dry-run', is_flag=True, help='Valider sans importer')
+@click.option('--taille-lot', type=int, default=TAILLE_LOT, help='Lignes par transaction')
+def membres_import(fichier, approuves, dry_run, taille_lot):
+    """Importer des membres historiques depuis un CSV (aucun email envoyé)"""
+    debut = datetime.now()
+    with open(fichier, encoding='utf-8-sig', newline='') as flux:
+        try:
+            rapport = importer_csv(flux, approuves, simulation=dry_run, taille_lot=taille_lot)
+        except ValueError as e:
+            raise click.ClickException(str(e))
+
+    for numero, message in rapport['erreurs']:
+        click.echo(f"⚠ Ligne {numero}: {message}")
+    if rapport['nb_erreurs']:
+        raise click.ClickException(f"{rapport['nb_erreurs']} ligne(s) invalide(s) sur {rapport['lignes']}: "
+                                   "rien n'a été importé")
+    duree = (datetime.now() - debut).total_seconds()
+    if dry_run:
+        click.echo(f"✓ {rapport['lignes']} lignes valides")
+    else:
+        click.echo(f"✓ {rapport['importes']} membres importés en {duree:.1f}s")
+        if approuves:
+            click.echo("  Cartes à générer avec: flask cards rebuild")
+
+@app.cli.group('media')
+def media_cli():
+    """Gestion du stockage des photos et des cartes"""
+
+@media_cli.command('import-legacy')
+def media_import_legacy():
+    """Copier les anciens fichiers (static/uploads, cards) dans le stockage adressé par contenu"""
+    stockage = get_stockage()
+    importes = 0
+    for fichiers in get_fichiers_membres():
+        cles = []
+        for chemin in (fichiers['photo_path'], fichiers['carte_path']):
+            if chemin and empreinte_cle(chemin) is None and os.path.exists(chemin):
+                chemin = stockage.enregistrer(stockage.lire(chemin), os.path.splitext(chemin)[1].lower())
+                importes += 1
+            cles.append(chemin)
+        if cles != [fichiers['photo_path'], fichiers['carte_path']]:
+            remplacer_fichiers_membre(fichiers['id'], *cles)
+    click.echo(f"✓ {importes} fichiers importés (les originaux sont conservés)")
+
+@media_cli.command('gc')
+@click.option('--age-min', type=int, default=3600, help='Ignorer les fichiers plus récents (secondes)')
+@click.option('--dry-run', is_flag=True, help='Lister sans supprimer')
+def media_gc(age_min, dry_run):
+    """Supprimer les fichiers du stockage qui ne sont plus référencés par aucun membre"""
+    references = {cle for fichiers in get_fichiers_membres() for cle in fichiers[1:] if cle}
+    # Un fichier tout juste écrit peut appartenir à une inscription pas encore validée
+    limite = datetime.now() - timedelta(seconds=age_min)
+    stockage = get_stockage()
+    supprimes = 0
+    for cle, modifie_le in stockage.lister():
+        if cle not in references and modifie_le < limite:
+            if not dry_run:
+                stockage.supprimer(cle)
+            supprimes += 1
+    click.echo(f"✓ {supprimes} fichiers orphelins {'à supprimer' if dry_run else 'supprimés'}")
+
 if __name__ == '__main__':
     print("=" * 50)
     print("ALUBILLES - Système de Gestion des Membres")
     print("=" * 50)
     print("Base de données initialisée!")
     print("Admin par défaut: username='admin', password='admin123'")
+    print("Cartes et emails: python taches_cartes.py et python email_service.py")
+    print("  (ou CARTES_WORKER_INTEGRE=1 EMAILS_EXPEDITEUR_INTEGRE=1 pour les lancer ici)")
     print("=" * 50)
 
     # Lancer l'application
@@ -0,0 +1,295 @@
+#!/usr/bin/env python3
+"""
+Benchmark du rendu des cartes de membre selon la photo
+
+Rend des cartes (create_alumni_member_card) à partir d'un corpus de photos
+générées: petit JPEG, JPEG 12 Mpx de téléphone, grand PNG avec transparence,
+GIF, et la photo normalisée telle que photos.py la stocke à l'envoi.
+
+Pour chaque photo, dans un processus neuf (spawn, comme le pool de rendu):
+p50/p95 du temps de rendu, pic de RSS du processus et surcoût du rendu
+(pic après les rendus moins pic après le chargement du template et des
+polices), taille de la carte PNG. Puis débit en parallèle, de 1 à N
+processus rendant chacun --cartes-par-processus cartes.
+
+Les résultats sont écrits en JSON; avec --comparer, un p50 en hausse ou un
+débit en baisse de plus de --seuil par rapport à une exécution précédente
+est signalé et le script sort en erreur. --sans-cache vide le cache de
+card_generator (template, polices, masque) avant chaque rendu.
+
+Usage: python bench_cartes.py [--rendus 20] [--processus 4] [--cartes-par-processus 10]
+                              [--cas jpeg_12mpx ...] [--parallele jpeg_normalisee ...]
+                              [--sans-cache] [--sortie resultats.json]
+                              [--comparer reference.json] [--seuil 0.25]
+"""
+
+from contextlib import redirect_stdout
+from datetime import datetime
+import argparse
+import io
+import json
+import math
+import multiprocessing
+import os
+import platform
+import sys
+import tempfile
+import time
+
+try:
+    import resource
+except ImportError:  # Windows: pas de mesure de RSS
+    resource = None
+
+from PIL import Image, __version__ as version_pillow
+
+# Les métriques des rendus mesurés ne doivent pas se mêler à celles de l'application
+os.environ.setdefault('METRIQUES_DOSSIER', tempfile.mkdtemp(prefix='bench-metriques-'))
+
+import card_generator
+from photos import normaliser_photo
+from taches_cartes import TEMPLATE_PATH
+
+BENCH_DOSSIER = os.path.join('cache', 'bench')
+
+# nom -> (largeur, hauteur, format, mode)
+CORPUS = {
+    'jpeg_petit': (640, 480, 'JPEG', 'RGB'),
+    'jpeg_12mpx': (4000, 3000, 'JPEG', 'RGB'),
+    'png_alpha': (3000, 3000, 'PNG', 'RGBA'),
+    'gif': (800, 800, 'GIF', 'P'),
+}
+# La photo de 12 Mpx après normaliser_photo(): ce que lit le rendu depuis l'envoi
+CAS_NORMALISE = 'jpeg_normalisee'
+
+MEMBRE = {
+    'numero_membre': 'ALU-2024-0001',
+    'nom': 'Diallo',
+    'prenom': 'Thierno',
+    'email': 'membre@exemple.org',
+    'telephone': '000-000-0000',
+}
+
+
+# ==================== CORPUS ====================
+
+def photo_synthetique(largeur, hauteur, mode):
+    """Image de test: fractale et bruit (se compresse comme une vraie photo, ni trop ni trop peu)"""
+    fond = Image.effect_mandelbrot((largeur, hauteur), (-2, -1.5, 1, 1.5), 100).convert('RGB')
+    bruit = Image.effect_noise((largeur, hauteur), 40).convert('RGB')
+    photo = Image.blend(fond, bruit, 0.3)
+    if mode == 'RGBA':
+        # Disque opaque sur fond transparent, bord progressif
+        alpha = Image.radial_gradient('L').resize((largeur, hauteur)).point(lambda v: 255 - v)
+        photo.putalpha(alpha)
+    elif mode == 'P':
+        photo = photo.quantize(256)
+    return photo
+
+
+def generer_corpus(dossier):
+    """Écrire les photos du corpus dans `dossier`: nom du cas -> chemin"""
+    chemins = {}
+    for nom, (largeur, hauteur, fmt, mode) in CORPUS.items():
+        chemins[nom] = os.path.join(dossier, f'{nom}.{fmt.lower()}')
+        options = {'quality': 92} if fmt == 'JPEG' else {}
+        photo_synthetique(largeur, hauteur, mode).save(chemins[nom], fmt, **options)
+
+    chemins[CAS_NORMALISE] = os.path.join(dossier, f'{CAS_NORMALISE}.jpg')
+    with open(chemins['jpeg_12mpx'], 'rb') as source, open(chemins[CAS_NORMALISE], 'wb') as sortie:
+        sortie.write(normaliser_photo(source))
+    return chemins
+
+
+# ==================== MESURES (processus de rendu) ====================
+
+def rss_pic_kio():
+    """
+    Pic de RSS du processus courant (Kio)
+
+    VmHWM plutôt que ru_maxrss: sous Linux, ru_maxrss d'un processus lancé
+    par spawn part du pic de son parent (celui qui a généré le corpus).
+    """
+    try:
+        with open('/proc/self/status') as f:
+            for ligne in f:
+                if ligne.startswith('VmHWM:'):
+                    return int(ligne.split()[1])
+    except OSError:
+        pass
+    if resource is None:
+        return 0
+    # macOS: octets au lieu de Kio
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss // 1024 if sys.platform == 'darwin' else rss
+
+
+def rendre(photo_path, sortie, sans_cache=False):
+    if sans_cache:
+        card_generator.vider_cache()
+    with redirect_stdout(io.StringIO()):
+        card_generator.create_alumni_member_card({**MEMBRE, 'photo_path': photo_path}, TEMPLATE_PATH, sortie)
+
+
+def rendre_serie(photo_path, rendus, sans_cache, dossier):
+    """Rendus successifs d'une carte: durées (ms), RSS et taille de la carte"""
+    card_generator.charger_template(TEMPLATE_PATH)
+    card_generator.charger_polices()
+    rss_base = rss_pic_kio()
+
+    sortie = os.path.join(dossier, f'carte-{os.getpid()}.png')
+    durees = []
+    for _ in range(rendus):
+        debut = time.perf_counter()
+        rendre(photo_path, sortie, sans_cache)
+        durees.append((time.perf_counter() - debut) * 1000)
+
+    taille = os.path.getsize(sortie)
+    os.remove(sortie)
+    return durees, rss_base, rss_pic_kio(), taille
+
+
+def rendre_lot(photo_path, cartes, dossier, resultats):
+    """Processus du test de débit: un rendu d'échauffement, puis `cartes` rendus chronométrés"""
+    sortie = os.path.join(dossier, f'carte-{os.getpid()}.png')
+    rendre(photo_path, sortie)
+    debut = time.time()
+    for _ in range(cartes):
+        rendre(photo_path, sortie)
+    resultats.put((debut, time.time(), rss_pic_kio()))
+
+
+def centile(valeurs, p):
+    """Centile par rang le plus proche (valeurs triées)"""
+    return valeurs[max(0, math.ceil(p / 100 * len(valeurs)) - 1)]
+
+
+def mesurer_cas(contexte, photo_path, rendus, sans_cache, dossier):
+    """Série de rendus dans un processus neuf: son pic de RSS ne doit rien aux autres cas"""
+    with contexte.Pool(1) as pool:
+        durees, rss_base, rss_pic, taille = pool.apply(rendre_serie, (photo_path, rendus, sans_cache, dossier))
+    durees.sort()
+    with Image.open(photo_path) as photo:
+        dimensions = f'{photo.width}x{photo.height}'
+    return {
+        'photo': f'{dimensions} {os.path.splitext(photo_path)[1][1:]}',
+        'photo_octets': os.path.getsize(photo_path),
+        'rendus': len(durees),
+        'p50_ms': round(centile(durees, 50), 2),
+        'p95_ms': round(centile(durees, 95), 2),
+        'moyenne_ms': round(sum(durees) / len(durees), 2),
+        'rss_pic_kio': rss_pic,
+        'rss_rendu_kio': rss_pic - rss_base,
+        'carte_octets': taille,
+    }
+
+
+def mesurer_debit(contexte, photo_path, processus, cartes, dossier):
+    """Cartes par seconde avec `processus` processus en parallèle, et leur RSS cumulé"""
+    resultats = contexte.Queue()
+    rendeurs = [contexte.Process(target=rendre_lot, args=(photo_path, cartes, dossier, resultats))
+                for _ in range(processus)]
+    for rendeur in rendeurs:
+        rendeur.start()
+    mesures = [resultats.get() for _ in rendeurs]
+    for rendeur in rendeurs:
+        rendeur.join()
+
+    duree = max(fin for _, fin, _ in mesures) - min(debut for debut, _, _ in mesures)
+    return {
+        'cartes': cartes * processus,
+        'cartes_par_s': round(cartes * processus / duree, 2),
+        'rss_pic_total_kio': sum(rss for _, _, rss in mesures),
+    }
+
+
+# ==================== COMPARAISON ====================
+
+def comparer(resultats, reference, seuil):
+    """Rendus plus lents ou débits plus faibles de plus de `seuil` (fraction) que `reference`"""
+    regressions = []
+    for cas, mesure in resultats['rendus'].items():
+        ancien = reference.get('rendus', {}).get(cas)
+        if ancien and mesure['p50_ms'] > ancien['p50_ms'] * (1 + seuil):
+            regressions.append(f"rendu {cas}: p50 {ancien['p50_ms']:.1f} -> {mesure['p50_ms']:.1f} ms")
+    for cas, par_processus in resultats['parallele'].items():
+        for processus, mesure in par_processus.items():
+            ancien = reference.get('parallele', {}).get(cas, {}).get(processus)
+            if ancien and mesure['cartes_par_s'] * (1 + seuil) < ancien['cartes_par_s']:
+                regressions.append(f"débit {cas} à {processus} processus: "
+                                   f"{ancien['cartes_par_s']:.1f} -> {mesure['cartes_par_s']:.1f} cartes/s")
+    return regressions
+
+
+def main():
+    cas_possibles = [*CORPUS, CAS_NORMALISE]
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--rendus', type=int, default=20, help="rendus par photo (rendu unitaire)")
+    parser.add_argument('--processus', type=int, default=os.cpu_count() or 1,
+                        help="débit mesuré de 1 à ce nombre de processus")
+    parser.add_argument('--cartes-par-processus', type=int, default=10)
+    parser.add_argument('--cas', nargs='+', choices=cas_possibles, default=cas_possibles)
+    parser.add_argument('--parallele', nargs='*', choices=cas_possibles, default=[CAS_NORMALISE, 'jpeg_12mpx'],
+                        help="photos du test de débit (aucune: pas de test de débit)")
+    parser.add_argument('--sans-cache', action='store_true')
+    parser.add_argument('--sortie', help="fichier JSON des résultats (défaut: cache/bench/cartes-<date>.json)")
+    parser.add_argument('--comparer', help="résultats de référence (JSON d'une exécution précédente)")
+    parser.add_argument('--seuil', type=float, default=0.25, help="régression tolérée (0.25 = 25%%)")
+    args = parser.parse_args()
+
+    # spawn: processus neufs, comme le pool de rendu de taches_cartes.py
+    contexte = multiprocessing.get_context('spawn')
+    resultats = {
+        'date': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+        'python': platform.python_version(),
+        'pillow': version_pillow,
+        'machine': platform.platform(),
+        'coeurs': os.cpu_count(),
+        'sans_cache': args.sans_cache,
+        'rendus': {},
+        'parallele': {},
+    }
+
+    with tempfile.TemporaryDirectory() as dossier:
+        chemins = generer_corpus(dossier)
+
+        print("=" * 50)
+        print(f"Rendu unitaire ({args.rendus} cartes par photo)")
+        print("=" * 50)
+        for cas in args.cas:
+            r = resultats['rendus'][cas] = mesurer_cas(contexte, chemins[cas], args.rendus, args.sans_cache, dossier)
+            print(f"  {cas:<16} {r['photo']:<15} {r['photo_octets'] / 1024:>8.0f} Kio   "
+                  f"p50 {r['p50_ms']:>7.1f} ms   p95 {r['p95_ms']:>7.1f} ms   "
+                  f"RSS {r['rss_pic_kio'] / 1024:>5.0f} Mo (rendu +{r['rss_rendu_kio'] / 1024:.0f})   "
+                  f"carte {r['carte_octets'] / 1024:.0f} Kio")
+
+        for cas in args.parallele:
+            print("=" * 50)
+            print(f"Débit en parallèle: {cas} ({args.cartes_par_processus} cartes par processus)")
+            print("=" * 50)
+            par_processus = resultats['parallele'][cas] = {}
+            for processus in range(1, args.processus + 1):
+                r = par_processus[str(processus)] = mesurer_debit(
+                    contexte, chemins[cas], processus, args.cartes_par_processus, dossier)
+                print(f"  {processus:>2} processus: {r['cartes_par_s']:>7.1f} cartes/s   "
+                      f"RSS cumulé {r['rss_pic_total_kio'] / 1024:.0f} Mo")
+
+    sortie = args.sortie or os.path.join(BENCH_DOSSIER, f"cartes-{datetime.now():%Y%m%d-%H%M%S}.json")
+    os.makedirs(os.path.dirname(sortie) or '.', exist_ok=True)
+    with open(sortie, 'w') as f:
+        json.dump(resultats, f, indent=2)
+    print(f"✓ Résultats: {sortie}")
+
+    if args.comparer:
+        with open(args.comparer) as f:
+            regressions = comparer(resultats, json.load(f), args.seuil)
+        if regressions:
+            print(f"❌ {len(regressions)} régression(s) au-delà de {args.seuil * 100:.0f}%:")
+            for regression in regressions:
+                print(f"  {regression}")
+            sys.exit(1)
+        print(f"✅ Aucune régression au-delà de {args.seuil * 100:.0f}% par rapport à {args.comparer}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,299 @@
+#!/usr/bin/env python3
+"""
+Benchmark de la couche base de données (database.py)
+
+Génère des bases synthétiques déterministes (même graine -> mêmes membres)
+de 10 000, 100 000 et 1 000 000 de membres répartis sur tous les statuts,
+gardées dans cache/bench/ pour les exécutions suivantes. Chaque mesure se
+fait sur une copie de la base: les écritures ne modifient pas la base de
+référence et deux exécutions mesurent exactement la même chose.
+
+Pour chaque fonction: p50 et p95 du temps d'appel, pic de mémoire Python
+(tracemalloc, sur un appel séparé pour ne pas fausser les temps). Les
+résultats sont écrits en JSON; avec --comparer, toute fonction dont le p50
+dépasse celui du fichier de référence de plus de --seuil est signalée et le
+script sort en erreur.
+
+Usage: python bench_db.py [--tailles 10000 100000 1000000] [--graine 2024]
+                          [--repetitions 50] [--budget 10] [--cas get_stats ...]
+                          [--sortie resultats.json] [--comparer reference.json] [--seuil 0.25]
+"""
+
+from datetime import datetime, timedelta
+import argparse
+import json
+import math
+import os
+import platform
+import random
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+import tracemalloc
+
+# Les métriques des appels mesurés ne doivent pas se mêler à celles de l'application
+os.environ.setdefault('METRIQUES_DOSSIER', tempfile.mkdtemp(prefix='bench-metriques-'))
+
+import database
+
+BENCH_DOSSIER = os.path.join('cache', 'bench')
+TAILLE_LOT_GENERATION = 10_000
+TAILLE_LOT_STATUT = 100  # membres par appel des transitions en lot
+SEUIL_ABSOLU_MS = 0.1    # écart de p50 en dessous duquel on ne parle pas de régression
+
+PRENOMS = ('Thierno', 'Mamadou', 'Aissatou', 'Fatoumata', 'Ibrahima', 'Mariama', 'Alpha',
+           'Kadiatou', 'Ousmane', 'Hawa', 'Boubacar', 'Djenabou', 'Sekou', 'Aminata',
+           'Lamine', 'Nene', 'Moussa', 'Binta', 'Abdoulaye', 'Oumou')
+NOMS = ('Diallo', 'Barry', 'Bah', 'Sow', 'Camara', 'Conde', 'Keita', 'Toure', 'Sylla',
+        'Balde', 'Cisse', 'Kouyate', 'Soumah', 'Traore', 'Doumbouya', 'Kaba', 'Fofana',
+        'Kante', 'Sangare', 'Bangoura')
+PROGRAMMES = ('Sciences', 'Lettres', 'Economie', 'Droit', 'Medecine', 'Informatique',
+              'Genie civil', 'Agronomie')
+
+# Répartition des statuts: en_attente tiré au sort, puis parmi les approuvés
+# id % 8 == 3 -> refusé, id % 8 == 5 -> suspendu
+PART_EN_ATTENTE = 0.2
+
+
+# ==================== GÉNÉRATION ====================
+
+def generer_membres(nombre, graine):
+    """Tuples (dans l'ordre de COLONNES_IMPORT) et statut, toujours les mêmes pour une graine"""
+    rng = random.Random(graine)
+    origine = datetime(2010, 1, 1)
+    for i in range(nombre):
+        prenom, nom = rng.choice(PRENOMS), rng.choice(NOMS)
+        promotion = rng.randint(1990, 2024)
+        inscription = origine + timedelta(seconds=rng.randrange(15 * 365 * 86400))
+        naissance = datetime(promotion - 22, 1, 1) + timedelta(days=rng.randrange(3 * 365))
+        yield (
+            nom, prenom, naissance.strftime('%Y-%m-%d'), rng.choice('MF'), str(promotion),
+            rng.choice(PROGRAMMES), f'{prenom}.{nom}.{i}@exemple.org'.lower(),
+            f'6{rng.randrange(10 ** 8):08d}', f'Quartier {rng.randrange(1, 500)}, Conakry',
+            inscription.strftime('%Y-%m-%d %H:%M:%S'),
+        ), rng.random() < PART_EN_ATTENTE
+
+
+def base_reference(nombre, graine):
+    """Chemin de la base synthétique de `nombre` membres (générée au premier appel)"""
+    chemin = os.path.join(BENCH_DOSSIER, f'membres-{nombre}-{graine}.db')
+    if os.path.exists(chemin):
+        return chemin
+
+    os.makedirs(BENCH_DOSSIER, exist_ok=True)
+    temporaire = chemin + '.tmp'
+    for suffixe in ('', '-wal', '-shm'):
+        if os.path.exists(temporaire + suffixe):
+            os.remove(temporaire + suffixe)
+
+    print(f"Génération de {nombre} membres (graine {graine})...")
+    debut = time.perf_counter()
+    database.DATABASE_PATH = temporaire
+    database.init_db()
+
+    lots = {False: [], True: []}
+    for membre, en_attente in generer_membres(nombre, graine):
+        lot = lots[en_attente]
+        lot.append(membre)
+        if len(lot) == TAILLE_LOT_GENERATION:
+            database.inserer_membres_lot(lot, approuves=not en_attente)
+            lot.clear()
+    for en_attente, lot in lots.items():
+        if lot:
+            database.inserer_membres_lot(lot, approuves=not en_attente)
+
+    with database.transaction(immediate=True) as conn:
+        conn.execute("""UPDATE membres SET statut = 'refuse', motif_refus = 'Dossier incomplet'
+                        WHERE statut = 'approuve' AND id % 8 = 3""")
+        conn.execute("""UPDATE membres SET statut = 'suspendu', motif_refus = 'Cotisation impayée'
+                        WHERE statut = 'approuve' AND id % 8 = 5""")
+
+    conn = database.get_db_connection()
+    conn.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+    database.fermer_connexion()
+    os.replace(temporaire, chemin)
+    print(f"✓ {nombre} membres générés en {time.perf_counter() - debut:.0f} s: {chemin}")
+    return chemin
+
+
+# ==================== MESURES ====================
+
+def centile(valeurs, p):
+    """Centile par rang le plus proche (valeurs triées)"""
+    return valeurs[max(0, math.ceil(p / 100 * len(valeurs)) - 1)]
+
+
+def ids_statut(statut, rng):
+    """Identifiants des membres d'un statut, dans un ordre déterministe mélangé"""
+    conn = database.get_db_connection()
+    ids = [ligne[0] for ligne in conn.execute('SELECT id FROM membres WHERE statut = ? ORDER BY id', (statut,))]
+    conn.close()
+    rng.shuffle(ids)
+    return ids
+
+
+def preparer_cas(graine):
+    """
+    Cas mesurés: nom -> fonction sans argument
+
+    Les transitions unitaires agissent chaque fois sur un membre différent,
+    dans le bon statut; les transitions en lot, sur TAILLE_LOT_STATUT membres
+    tirés parmi tous (sinon elles épuiseraient les membres en attente), dont
+    seuls ceux du statut de départ changent, comme une sélection mélangée.
+    """
+    rng = random.Random(graine)
+    en_attente = ids_statut('en_attente', rng)
+    approuves = ids_statut('approuve', rng)
+    suspendus = ids_statut('suspendu', rng)
+    refuses = ids_statut('refuse', rng)
+    tous = en_attente + approuves + suspendus + refuses
+    conn = database.get_db_connection()
+    version = conn.execute('SELECT MAX(row_version) FROM membres').fetchone()[0]
+    conn.close()
+    nouveaux = generer_membres(10 ** 9, graine + 1)
+    recherches = [nom[:3].lower() for nom in NOMS] + [prenom.lower() for prenom in PRENOMS]
+
+    def inscrire():
+        nom, prenom, naissance, genre, promotion, programme, email, telephone, adresse, _ = next(nouveaux)[0]
+        return database.add_membre(nom, prenom, naissance, promotion, programme, genre,
+                                   email, telephone, adresse, None)
+
+    return {
+        'get_stats': database.get_stats,
+        'get_membre': lambda: database.get_membre(rng.choice(tous)),
+        'search_membres': lambda: database.search_membres(rng.choice(recherches)),
+        'search_membres_statut': lambda: database.search_membres(rng.choice(recherches), statut='approuve'),
+        'get_page_membres': lambda: database.get_page_membres(rng.choice(list(database.LISTES_PAGINEES))),
+        'get_modifications': lambda: database.get_modifications(rng.randrange(version)),
+        'get_membres_en_attente': database.get_membres_en_attente,
+        'get_membres_approuves': database.get_membres_approuves,
+        'get_membres_refuses': database.get_membres_refuses,
+        'get_membres_suspendus': database.get_membres_suspendus,
+        'get_all_membres': database.get_all_membres,
+        'add_membre': inscrire,
+        'inserer_membres_lot': lambda: database.inserer_membres_lot(
+            [next(nouveaux)[0] for _ in range(TAILLE_LOT_STATUT)]),
+        'approuver_membre': lambda: database.approuver_membre(en_attente.pop()),
+        'refuser_membre': lambda: database.refuser_membre(en_attente.pop(), 'Benchmark'),
+        'suspendre_membre': lambda: database.suspendre_membre(approuves.pop(), 'Benchmark'),
+        'reactiver_membre': lambda: database.reactiver_membre(suspendus.pop()),
+        'approuver_membres': lambda: database.approuver_membres(rng.sample(tous, TAILLE_LOT_STATUT)),
+        'refuser_membres': lambda: database.refuser_membres(rng.sample(tous, TAILLE_LOT_STATUT), 'Benchmark'),
+        'suspendre_membres': lambda: database.suspendre_membres(rng.sample(tous, TAILLE_LOT_STATUT), 'Benchmark'),
+        'delete_membre': lambda: database.delete_membre(refuses.pop()),
+    }
+
+
+def mesurer(fonction, repetitions, budget):
+    """Temps (ms) de `repetitions` appels (au moins 3, arrêt après `budget` secondes) et pic mémoire (Kio)"""
+    fonction()  # échauffement: cache de pages, requêtes préparées
+    durees = []
+    fin = time.perf_counter() + budget
+    while len(durees) < repetitions and (len(durees) < 3 or time.perf_counter() < fin):
+        debut = time.perf_counter()
+        fonction()
+        durees.append((time.perf_counter() - debut) * 1000)
+
+    tracemalloc.start()
+    fonction()
+    memoire = tracemalloc.get_traced_memory()[1] / 1024
+    tracemalloc.stop()
+
+    durees.sort()
+    return {
+        'appels': len(durees),
+        'p50_ms': round(centile(durees, 50), 4),
+        'p95_ms': round(centile(durees, 95), 4),
+        'moyenne_ms': round(sum(durees) / len(durees), 4),
+        'memoire_kio': round(memoire, 1),
+    }
+
+
+def mesurer_taille(nombre, args, dossier):
+    """Mesurer tous les cas sur une copie de la base de `nombre` membres"""
+    reference = base_reference(nombre, args.graine)
+    copie = os.path.join(dossier, f'membres-{nombre}.db')
+    shutil.copyfile(reference, copie)
+    database.DATABASE_PATH = copie
+
+    resultats = {}
+    for nom, fonction in preparer_cas(args.graine).items():
+        if args.cas and nom not in args.cas:
+            continue
+        resultats[nom] = mesurer(fonction, args.repetitions, args.budget)
+        r = resultats[nom]
+        print(f"  {nom:<24} p50 {r['p50_ms']:>10.3f} ms   p95 {r['p95_ms']:>10.3f} ms   "
+              f"{r['memoire_kio']:>10.0f} Kio   ({r['appels']} appels)")
+
+    database.fermer_connexion()
+    for suffixe in ('', '-wal', '-shm'):
+        if os.path.exists(copie + suffixe):
+            os.remove(copie + suffixe)
+    return resultats
+
+
+# ==================== COMPARAISON ====================
+
+def comparer(resultats, reference, seuil):
+    """Régressions de p50 au-delà de `seuil` (fraction) par rapport à `reference`"""
+    regressions = []
+    for taille, cas in resultats['tailles'].items():
+        for nom, mesure in cas.items():
+            ancien = reference.get('tailles', {}).get(taille, {}).get(nom)
+            if not ancien:
+                continue
+            avant, apres = ancien['p50_ms'], mesure['p50_ms']
+            if apres > avant * (1 + seuil) and apres - avant > SEUIL_ABSOLU_MS:
+                regressions.append(f"{nom} à {taille} membres: p50 {avant:.3f} -> {apres:.3f} ms "
+                                   f"(+{(apres / avant - 1) * 100:.0f}%)")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--tailles', type=int, nargs='+', default=[10_000, 100_000, 1_000_000])
+    parser.add_argument('--graine', type=int, default=2024)
+    parser.add_argument('--repetitions', type=int, default=50)
+    parser.add_argument('--budget', type=float, default=10, help="secondes au plus par cas")
+    parser.add_argument('--cas', nargs='+', help="ne mesurer que ces fonctions")
+    parser.add_argument('--sortie', help="fichier JSON des résultats (défaut: cache/bench/db-<date>.json)")
+    parser.add_argument('--comparer', help="résultats de référence (JSON d'une exécution précédente)")
+    parser.add_argument('--seuil', type=float, default=0.25, help="régression tolérée sur le p50 (0.25 = +25%%)")
+    args = parser.parse_args()
+
+    resultats = {
+        'date': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+        'python': platform.python_version(),
+        'sqlite': sqlite3.sqlite_version,
+        'machine': platform.platform(),
+        'graine': args.graine,
+        'tailles': {},
+    }
+    with tempfile.TemporaryDirectory() as dossier:
+        for nombre in args.tailles:
+            print("=" * 50)
+            print(f"{nombre} membres")
+            print("=" * 50)
+            resultats['tailles'][str(nombre)] = mesurer_taille(nombre, args, dossier)
+
+    sortie = args.sortie or os.path.join(BENCH_DOSSIER, f"db-{datetime.now():%Y%m%d-%H%M%S}.json")
+    os.makedirs(os.path.dirname(sortie) or '.', exist_ok=True)
+    with open(sortie, 'w') as f:
+        json.dump(resultats, f, indent=2)
+    print(f"✓ Résultats: {sortie}")
+
+    if args.comparer:
+        with open(args.comparer) as f:
+            regressions = comparer(resultats, json.load(f), args.seuil)
+        if regressions:
+            print(f"❌ {len(regressions)} régression(s) au-delà de {args.seuil * 100:.0f}%:")
+            for regression in regressions:
+                print(f"  {regression}")
+            sys.exit(1)
+        print(f"✅ Aucune régression au-delà de {args.seuil * 100:.0f}% par rapport à {args.comparer}")
+
+
+if __name__ == '__main__':
+    main()
@@ -1,67 +1,180 @@
+from functools import lru_cache
 from PIL import Image, ImageDraw, ImageFont, ImageOps
+import hashlib
+import io
 import os
+import threading
+import time
+
+from metriques import observer
+from profilage import etape
+from stockage import get_stockage
+
+# À incrémenter à chaque changement de mise en page dans create_alumni_member_card()
+VERSION_MISE_EN_PAGE = 1
+
+# Format physique d'une carte CR80 (85,6 x 54 mm): le template de 1011 px
+# de large correspond à 300 DPI
+CARTE_LARGEUR_MM = 85.6
+CARTE_HAUTEUR_MM = 54.0
+DPI_IMPRESSION = (150, 300, 600)
+DPI_DEFAUT = 300
+
+# Formats de sortie: type MIME et extension
+FORMATS_CARTE = {
+    'png': ('image/png', '.png'),
+    'webp': ('image/webp', '.webp'),
+    'pdf': ('application/pdf', '.pdf'),
+}
+
+# Position et taille du cercle de la photo
+CIRCLE_X = 238  # Centre X du cercle
+CIRCLE_Y = 250  # Centre Y du cercle
+CIRCLE_RADIUS = 180  # Rayon du cercle
+PHOTO_SIZE = CIRCLE_RADIUS * 2  # Diamètre
+
+# Polices essayées dans l'ordre: (valeurs, titres)
+POLICES = [
+    ("/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf", "/usr/share/fonts/truetype/dejavu/DejaVuSans-Bold.ttf"),
+    ("arial.ttf", "arialbd.ttf"),  # Alternative Windows
+]
+
+
+# ==================== CONTEXTE DE RENDU ====================
+# Template décodé, polices et masque chargés une fois par processus:
+# chaque rendu ne paie plus qu'une copie de l'image de base.
+
+_templates = {}  # chemin -> (mtime, image décodée)
+_verrou_templates = threading.Lock()
+
+
+def charger_template(template_path):
+    """Copie du template décodé, relu seulement si le fichier a changé (mtime)"""
+    mtime = os.stat(template_path).st_mtime_ns
+    with _verrou_templates:
+        en_cache = _templates.get(template_path)
+        if en_cache is None or en_cache[0] != mtime:
+            with Image.open(template_path) as image:
+                image.load()
+                en_cache = (mtime, image.copy())
+            _templates[template_path] = en_cache
+    return en_cache[1].copy()
+
+
+@lru_cache(maxsize=8)
+def _hash_template(template_path, mtime):
+    """sha256 du fichier template (mis en cache par mtime)"""
+    with open(template_path, 'rb') as f:
+        return hashlib.file_digest(f, 'sha256').hexdigest()
+
+
+def version_template(template_path):
+    """Version du rendu: mise en page + contenu du template"""
+    mtime = os.stat(template_path).st_mtime_ns
+    return f"{VERSION_MISE_EN_PAGE}:{_hash_template(template_path, mtime)}"
+
+
+@lru_cache(maxsize=1)
+def charger_polices():
+    """Polices (valeurs, titres), avec repli sur la police par défaut de Pillow"""
+    for valeur, titre in POLICES:
+        try:
+            return ImageFont.truetype(valeur, 22), ImageFont.truetype(titre, 24)
+        except OSError:
+            continue
+    return ImageFont.load_default(), ImageFont.load_default()
+
+
+@lru_cache(maxsize=1)
+def masque_cercle():
+    """Masque circulaire de la photo (PHOTO_SIZE x PHOTO_SIZE)"""
+    mask = Image.new('L', (PHOTO_SIZE, PHOTO_SIZE), 0)
+    ImageDraw.Draw(mask).ellipse((0, 0, PHOTO_SIZE, PHOTO_SIZE), fill=255)
+    return mask
+
+
+@etape('rendu')
+def encoder_carte(card, fmt='png', dpi=DPI_DEFAUT):
+    """
+    Encoder une carte rendue
 
-def create_alumni_member_card(membre_data, template_path, output_path):
+    png: sans perte (optimize et la palette ne gagnent rien, ou abîment la photo)
+    webp: sans perte, environ deux fois plus léger que le PNG
+    pdf: une page à la taille réelle de la carte, rééchantillonnée à `dpi`
+    """
+    tampon = io.BytesIO()
+    if fmt == 'png':
+        card.save(tampon, 'PNG')
+    elif fmt == 'webp':
+        card.save(tampon, 'WEBP', lossless=True, quality=80, method=4)
+    elif fmt == 'pdf':
+        taille = (round(CARTE_LARGEUR_MM / 25.4 * dpi), round(CARTE_HAUTEUR_MM / 25.4 * dpi))
+        page = card.convert('RGB')
+        if page.size != taille:
+            page = page.resize(taille, Image.Resampling.LANCZOS)
+        page.save(tampon, 'PDF', resolution=dpi, quality=95)
+    else:
+        raise ValueError(f"Format de carte inconnu: {fmt}")
+    return tampon.getvalue()
+
+
+def vider_cache():
+    """Oublier template, polices et masque (benchmarks, changement de polices)"""
+    with _verrou_templates:
+        _templates.clear()
+    _hash_template.cache_clear()
+    charger_polices.cache_clear()
+    masque_cercle.cache_clear()
+
+
+@etape('rendu')
+def create_alumni_member_card(membre_data, template_path, output_path=None):
     """
     Ajouter les informations du membre sur le template de carte existant
 
     Args:
-        membre_data: dict avec les infos du membre
+        membre_data: dict avec les infos du membre (photo_path: clé du stockage)
         template_path: chemin vers l'image template
-        output_path: chemin où sauvegarder la carte
+        output_path: chemin où sauvegarder la carte; sans chemin, la carte
+            est confiée au stockage
+
+    Returns:
+        str: output_path, ou la clé de la carte dans le stockage
     """
+    debut = time.perf_counter()
 
-    # Charger l'image template
-    card = Image.open(template_path)
+    # Copie du template en cache
+    card = charger_template(template_path)
     draw = ImageDraw.Draw(card)
 
     # Couleur du texte
     text_dark = '#333333'
 
-    # Charger les polices
-    try:
-        # Police pour les valeurs (nom, email, etc.)
-        font_value = ImageFont.truetype("/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf", 22)
+    # Polices en cache
+    font_value, font_bold = charger_polices()
 
-        # Police en gras pour les titres
-        font_bold = ImageFont.truetype("/usr/share/fonts/truetype/dejavu/DejaVuSans-Bold.ttf", 24)
-    except Exception:
-        try:
-            # Alternative Windows
-            font_value = ImageFont.truetype("arial.ttf", 22)
-            font_bold = ImageFont.truetype("arialbd.ttf", 24)
-        except:
-            font_value = ImageFont.load_default()
-            font_bold = ImageFont.load_default()
-
-        # ===== AJOUTER LA PHOTO DU MEMBRE DANS LE CERCLE =====
+    # ===== AJOUTER LA PHOTO DU MEMBRE DANS LE CERCLE =====
     photo_path = membre_data.get('photo_path')
-    if photo_path and os.path.exists(photo_path):
+    stockage = get_stockage()
+    if photo_path and stockage.existe(photo_path):
         try:
-            # Position et taille du cercle
-            circle_x = 238  # Centre X du cercle
-            circle_y = 250  # Centre Y du cercle
-            circle_radius = 180  # Rayon du cercle
-            photo_size = circle_radius * 2  # Diamètre
-
             # Charger et redimensionner la photo
-            photo = Image.open(photo_path)
-            photo = photo.convert('RGB')
+            with stockage.ouvrir(photo_path) as f:
+                photo = Image.open(f)
+                photo = photo.convert('RGB')
 
             # Redimensionner pour remplir le cercle (crop au centre)
-            photo = ImageOps.fit(photo, (photo_size, photo_size), Image.Resampling.LANCZOS)
+            photo = ImageOps.fit(photo, (PHOTO_SIZE, PHOTO_SIZE), Image.Resampling.LANCZOS)
 
-            # Créer un masque circulaire
-            mask = Image.new('L', (photo_size, photo_size), 0)
-            mask_draw = ImageDraw.Draw(mask)
-            mask_draw.ellipse((0, 0, photo_size, photo_size), fill=255)
+            # Masque circulaire en cache
+            mask = masque_cercle()
 
             # Appliquer le masque à la photo
             photo.putalpha(mask)
 
             # Position de collage (coin supérieur gauche de la photo)
-            paste_x = circle_x - circle_radius
-            paste_y = circle_y - circle_radius
+            paste_x = CIRCLE_X - CIRCLE_RADIUS
+            paste_y = CIRCLE_Y - CIRCLE_RADIUS
 
             # Coller la photo sur la carte
             card.paste(photo, (paste_x, paste_y), mask)
@@ -76,27 +189,28 @@ def create_alumni_member_card(membre_data, template_path, output_path):
 
     # Ajouter le Nom
     draw.text((info_x, info_y_start),
-              f"{membre_data.get('prenom', '')} {membre_data.get('nom', '')}".strip() or 'N/A',
+              f"{membre_data.get('prenom') or ''} {membre_data.get('nom') or ''}".strip() or 'N/A',
               fill=text_dark,
               font=font_bold,
               anchor='lm')
 
     # Ajouter le No ID
     draw.text((info_x, info_y_start + line_height),
-              membre_data.get('numero_membre', 'N/A'),
+              membre_data.get('numero_membre') or 'N/A',
               fill=text_dark,
               font=font_bold,
               anchor='lm')
 
     # Ajouter le Cellulaire
     draw.text((info_x, info_y_start + line_height * 2),
-              membre_data.get('telephone', 'N/A'),
+              membre_data.get('telephone') or 'N/A',
               fill=text_dark,
               font=font_bold,
               anchor='lm')
 
     # Ajouter le Courriel
-    email = membre_data.get('email', 'N/A')
+    # Champs vides ou NULL (membres importés): N/A
+    email = membre_data.get('email') or 'N/A'
     if len(email) > 35:
         email = email[:32] + "..."
     draw.text((info_x, info_y_start + line_height * 3),
@@ -105,11 +219,18 @@ def create_alumni_member_card(membre_data, template_path, output_path):
               font=font_bold,
               anchor='lm')
 
-    # Sauvegarder la carte
-    card.save(output_path, 'PNG', quality=95)
-    print(f"✓ Carte de membre créée: {output_path}")
-
-    return output_path
+    # Sauvegarder la carte (PNG de référence; WebP et PDF en sont dérivés)
+    if output_path:
+        with open(output_path, 'wb') as f:
+            f.write(encoder_carte(card))
+        observer('alubilles_carte_rendu_duree_secondes', time.perf_counter() - debut)
+        print(f"✓ Carte de membre créée: {output_path}")
+        return output_path
+
+    cle = stockage.enregistrer(encoder_carte(card), '.png')
+    observer('alubilles_carte_rendu_duree_secondes', time.perf_counter() - debut)
+    print(f"✓ Carte de membre créée: {cle}")
+    return cle
 
 
 # Exemple d'utilisation
@@ -0,0 +1,31 @@
+"""
+Configuration commune des tests (python -m pytest)
+
+Avant tout import de app (qui initialise la base au chargement): base,
+métriques et stockage dans un dossier temporaire, jamais ceux de l'application.
+"""
+
+import os
+import tempfile
+
+import pytest
+
+_dossier = tempfile.mkdtemp(prefix='alubilles-tests-')
+os.environ.setdefault('METRIQUES_DOSSIER', os.path.join(_dossier, 'metriques'))
+
+import database
+import stockage
+
+database.DATABASE_PATH = os.path.join(_dossier, 'app.db')
+
+RACINE = os.path.dirname(os.path.abspath(__file__))
+
+
+@pytest.fixture
+def base(tmp_path, monkeypatch):
+    """Base migrée et stockage propres à chaque test"""
+    monkeypatch.setattr(database, 'DATABASE_PATH', str(tmp_path / 'test.db'))
+    monkeypatch.setattr(stockage, '_stockage', stockage.StockageLocal(str(tmp_path / 'media')))
+    database.init_db()
+    yield
+    database.fermer_connexion()
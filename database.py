@@ -1,21 +1,234 @@
 import sqlite3
+import base64
+from contextlib import contextmanager
 from datetime import datetime
 import hashlib
+import json
 import os
+import re
+import threading
+import time
+
+from metriques import observer_sql
+from profilage import compter_etape
 
 DATABASE_PATH = 'alubilles.db'
 
-def get_db_connection():
-    """Créer une connexion à la base de données"""
-    conn = sqlite3.connect(DATABASE_PATH)
+# Réglages appliqués une seule fois à chaque connexion
+SQLITE_BUSY_TIMEOUT_MS = 5000
+SQLITE_CACHE_KIB = 16 * 1024          # ~16 Mo de cache de pages
+SQLITE_MMAP_SIZE = 128 * 1024 * 1024  # 128 Mo mappés en mémoire
+
+_local = threading.local()
+
+
+def _mesurer(debut, requetes=1):
+    """Temps SQL depuis `debut`: métriques et étape db de la requête profilée"""
+    duree = time.perf_counter() - debut
+    observer_sql(duree, requetes)
+    compter_etape('db', duree)
+
+
+class CurseurMesure(sqlite3.Cursor):
+    """Curseur dont les exécutions et les lectures sont chronométrées (metriques.py, profilage.py)"""
+
+    def execute(self, sql, parametres=()):
+        debut = time.perf_counter()
+        try:
+            return super().execute(sql, parametres)
+        finally:
+            _mesurer(debut)
+
+    def executemany(self, sql, sequence):
+        debut = time.perf_counter()
+        try:
+            return super().executemany(sql, sequence)
+        finally:
+            _mesurer(debut)
+
+    def fetchone(self):
+        debut = time.perf_counter()
+        try:
+            return super().fetchone()
+        finally:
+            _mesurer(debut, requetes=0)
+
+    def fetchmany(self, size=None):
+        debut = time.perf_counter()
+        try:
+            return super().fetchmany(self.arraysize if size is None else size)
+        finally:
+            _mesurer(debut, requetes=0)
+
+    def fetchall(self):
+        debut = time.perf_counter()
+        try:
+            return super().fetchall()
+        finally:
+            _mesurer(debut, requetes=0)
+
+
+class ConnexionPartagee(sqlite3.Connection):
+    """
+    Connexion longue durée réutilisée par tous les appels d'un même thread.
+
+    close() ne ferme pas réellement la connexion: elle annule seulement ce qui
+    n'a pas été validé. Pendant une transaction ouverte par transaction() (ou
+    par la portée d'une requête Flask), commit() et close() ne font rien: la
+    validation a lieu une seule fois, à la fin de la transaction.
+    """
+    profondeur = 0
+    ecriture = False   # la transaction en cours détient le verrou d'écriture
+    changements = 0    # total_changes au début de la transaction en cours
+
+    # conn.execute() ne passe pas par cursor(): on le redirige pour le mesurer
+    def cursor(self, factory=CurseurMesure):
+        return super().cursor(factory)
+
+    def execute(self, sql, parametres=()):
+        return self.cursor().execute(sql, parametres)
+
+    def executemany(self, sql, sequence):
+        return self.cursor().executemany(sql, sequence)
+
+    def commit(self):
+        if self.profondeur == 0:
+            debut = time.perf_counter()
+            try:
+                super().commit()
+            finally:
+                _mesurer(debut)
+
+    def close(self):
+        if self.profondeur == 0 and self.in_transaction:
+            self.rollback()
+
+    def fermer(self):
+        """Fermer réellement la connexion"""
+        super().close()
+
+
+def _configurer_connexion(conn):
+    """Appliquer les PRAGMA de performance à une nouvelle connexion"""
     conn.row_factory = sqlite3.Row
+    conn.execute(f'PRAGMA busy_timeout = {SQLITE_BUSY_TIMEOUT_MS}')
+    conn.execute('PRAGMA journal_mode = WAL')
+    conn.execute('PRAGMA synchronous = NORMAL')
+    conn.execute(f'PRAGMA cache_size = -{SQLITE_CACHE_KIB}')
+    conn.execute(f'PRAGMA mmap_size = {SQLITE_MMAP_SIZE}')
+    conn.execute('PRAGMA temp_store = MEMORY')
+
+
+def get_db_connection():
+    """
+    Récupérer la connexion du thread courant (créée et configurée au premier appel)
+
+    La connexion est recréée si le processus a changé (fork d'un worker gunicorn)
+    ou si DATABASE_PATH a été modifié.
+    """
+    cle = (os.getpid(), DATABASE_PATH)
+    conn = getattr(_local, 'conn', None)
+    if conn is None or _local.cle != cle:
+        conn = sqlite3.connect(DATABASE_PATH, timeout=SQLITE_BUSY_TIMEOUT_MS / 1000,
+                               factory=ConnexionPartagee)
+        _configurer_connexion(conn)
+        _local.conn = conn
+        _local.cle = cle
     return conn
 
+
+def fermer_connexion():
+    """Fermer la connexion du thread courant (arrêt d'un worker, tests)"""
+    conn = getattr(_local, 'conn', None)
+    if conn is not None:
+        conn.fermer()
+        _local.conn = None
+
+
+def ouvrir_transaction(immediate=False):
+    """
+    Démarrer (ou rejoindre) une transaction partagée par tous les appels du thread
+
+    immediate=True prend le verrou d'écriture dès le début, ce qui évite les
+    erreurs SQLITE_BUSY lors du passage lecture -> écriture sous WAL. Dans
+    une transaction différée (celle d'une requête HTTP), c'est le premier
+    bloc immediate=True qui prend le verrou: il n'est pas tenu pendant le
+    traitement des photos ni le rendu des templates.
+    """
+    conn = get_db_connection()
+    if conn.profondeur == 0:
+        if conn.in_transaction:
+            # Écriture hors transaction() jamais validée: la signaler avant de l'annuler
+            print("⚠ Transaction implicite non validée annulée (écriture sans transaction() ni commit())")
+            conn.rollback()
+        conn.execute('BEGIN IMMEDIATE' if immediate else 'BEGIN')
+        conn.ecriture = immediate
+        conn.changements = conn.total_changes
+    else:
+        if immediate and not conn.ecriture:
+            _prendre_verrou_ecriture(conn)
+        # Transaction imbriquée: un savepoint permet de n'annuler que ce bloc
+        conn.execute(f'SAVEPOINT niveau_{conn.profondeur}')
+    conn.profondeur += 1
+    return conn
+
+
+def _prendre_verrou_ecriture(conn):
+    """
+    Passer la transaction différée en cours en écriture
+
+    Sous WAL, écrire depuis une transaction dont l'instantané a été dépassé
+    par un autre écrivain échoue aussitôt (SQLITE_BUSY, sans attente). Tant
+    qu'elle n'a rien écrit, la transaction est validée (sans effet) et
+    reprise en BEGIN IMMEDIATE, savepoints compris; si elle a déjà écrit,
+    elle détient déjà le verrou.
+    """
+    if conn.total_changes == conn.changements:
+        conn.execute('COMMIT')
+        conn.execute('BEGIN IMMEDIATE')
+        for niveau in range(1, conn.profondeur):
+            conn.execute(f'SAVEPOINT niveau_{niveau}')
+    conn.ecriture = True
+
+
+def fermer_transaction(erreur=None):
+    """Terminer la transaction ouverte par ouvrir_transaction(): commit, ou rollback si erreur"""
+    conn = getattr(_local, 'conn', None)
+    if conn is None or conn.profondeur == 0:
+        return
+    conn.profondeur -= 1
+    if conn.profondeur > 0:
+        savepoint = f'niveau_{conn.profondeur}'
+        if erreur is not None:
+            conn.execute(f'ROLLBACK TO {savepoint}')
+        conn.execute(f'RELEASE {savepoint}')
+    elif conn.in_transaction:
+        if erreur is None:
+            conn.commit()
+        else:
+            conn.rollback()
+
+
+@contextmanager
+def transaction(immediate=False):
+    """Exécuter un bloc dans une seule transaction (imbricable)"""
+    conn = ouvrir_transaction(immediate)
+    try:
+        yield conn
+    except BaseException as e:
+        fermer_transaction(e)
+        raise
+    else:
+        fermer_transaction()
+
 def init_db():
     """Initialiser la base de données avec les tables nécessaires"""
-    conn = get_db_connection()
-    cursor = conn.cursor()
+    # Verrou d'écriture: plusieurs workers gunicorn démarrent en même temps
+    with transaction(immediate=True) as conn:
+        _init_db(conn.cursor())
 
+def _init_db(cursor):
+    """Créer les tables de base, migrer le schéma et créer l'admin par défaut"""
     # Table des membres avec statut d'inscription
     cursor.execute('''
         CREATE TABLE IF NOT EXISTS membres (
@@ -53,6 +266,9 @@ def init_db():
         )
     ''')
 
+    # Index, compteurs, etc.: appliquer les migrations en attente
+    appliquer_migrations(cursor)
+
     # Créer un admin par défaut s'il n'existe pas
     cursor.execute('SELECT COUNT(*) FROM admins')
     if cursor.fetchone()[0] == 0:
@@ -63,8 +279,424 @@ def init_db():
         ''', ('admin', default_password, 'Administrateur', 'admin@alubilles.org',
               datetime.now().strftime('%Y-%m-%d %H:%M:%S')))
 
-    conn.commit()
+# Colonnes de membres_stats et statut correspondant dans membres
+COMPTEURS_STATUT = {
+    'en_attente': 'en_attente',
+    'approuves': 'approuve',
+    'refuses': 'refuse',
+    'suspendus': 'suspendu',
+}
+
+def _delta_compteurs(ligne, signe):
+    """Clause SET qui ajoute (+) ou retire (-) la ligne NEW/OLD des compteurs"""
+    sets = [f'total = total {signe} 1']
+    for colonne, statut in COMPTEURS_STATUT.items():
+        sets.append(f"{colonne} = {colonne} {signe} ({ligne}.statut IS '{statut}')")
+    return ', '.join(sets)
+
+def _creer_compteurs_statut(cursor):
+    """Créer la table membres_stats (une seule ligne, id = 1) et ses triggers"""
+    cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'membres_stats'")
+    existait = cursor.fetchone() is not None
+
+    colonnes = ', '.join(f'{c} INTEGER NOT NULL DEFAULT 0' for c in COMPTEURS_STATUT)
+    cursor.execute(f'''
+        CREATE TABLE IF NOT EXISTS membres_stats (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            total INTEGER NOT NULL DEFAULT 0,
+            {colonnes}
+        )
+    ''')
+
+    cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS membres_stats_insert AFTER INSERT ON membres
+        BEGIN
+            UPDATE membres_stats SET {_delta_compteurs('NEW', '+')} WHERE id = 1;
+        END
+    ''')
+    cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS membres_stats_delete AFTER DELETE ON membres
+        BEGIN
+            UPDATE membres_stats SET {_delta_compteurs('OLD', '-')} WHERE id = 1;
+        END
+    ''')
+    cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS membres_stats_update AFTER UPDATE OF statut ON membres
+        WHEN OLD.statut IS NOT NEW.statut
+        BEGIN
+            UPDATE membres_stats SET {_delta_compteurs('OLD', '-')} WHERE id = 1;
+            UPDATE membres_stats SET {_delta_compteurs('NEW', '+')} WHERE id = 1;
+        END
+    ''')
+
+    if not existait:
+        _recalculer_compteurs(cursor)
+
+def _recalculer_compteurs(cursor):
+    """Recompter tous les statuts en un seul passage GROUP BY statut"""
+    cursor.execute('SELECT statut, COUNT(*) FROM membres GROUP BY statut')
+    comptes = dict(cursor.fetchall())
+
+    valeurs = {c: comptes.get(s, 0) for c, s in COMPTEURS_STATUT.items()}
+    valeurs['total'] = sum(comptes.values())
+    colonnes = ', '.join(valeurs)
+    marques = ', '.join('?' for _ in valeurs)
+    cursor.execute(f'INSERT OR REPLACE INTO membres_stats (id, {colonnes}) VALUES (1, {marques})',
+                   tuple(valeurs.values()))
+
+def rebuild_stats():
+    """Reconstruire les compteurs de membres_stats (réparer une dérive éventuelle)"""
+    # Verrou d'écriture dès le début: le recomptage et l'écriture voient le même état
+    with transaction(immediate=True) as conn:
+        _recalculer_compteurs(conn.cursor())
+
+# ==================== MIGRATIONS ====================
+
+def _migration_index_listes(cursor):
+    """Index composites pour les listes admin: WHERE statut = ? ORDER BY date_..."""
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_membres_statut_inscription ON membres (statut, date_inscription)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_membres_statut_validation ON membres (statut, date_validation)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_membres_date_inscription ON membres (date_inscription)')
+
+def _migration_index_recherche(cursor):
+    """Index pour la recherche (tri nom, prénom) et les recherches par email"""
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_membres_statut_nom ON membres (statut, nom, prenom)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_membres_nom_prenom ON membres (nom, prenom)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_membres_email ON membres (email)')
+
+# Colonnes indexées en texte intégral et leur poids dans le classement bm25
+COLONNES_RECHERCHE = {
+    'nom': 10.0,
+    'prenom': 10.0,
+    'numero_membre': 5.0,
+    'email': 2.0,
+    'promotion': 1.0,
+    'programme': 1.0,
+}
+
+def _migration_recherche_fts(cursor):
+    """Index FTS5 (sans accents, préfixes) sur membres, synchronisé par triggers"""
+    colonnes = ', '.join(COLONNES_RECHERCHE)
+    nouvelles = ', '.join(f'NEW.{c}' for c in COLONNES_RECHERCHE)
+    anciennes = ', '.join(f'OLD.{c}' for c in COLONNES_RECHERCHE)
+
+    cursor.execute(f'''
+        CREATE VIRTUAL TABLE IF NOT EXISTS membres_fts USING fts5(
+            {colonnes},
+            content='membres', content_rowid='id',
+            tokenize='unicode61 remove_diacritics 2',
+            prefix='2 3'
+        )
+    ''')
+    cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS membres_fts_insert AFTER INSERT ON membres
+        BEGIN
+            INSERT INTO membres_fts (rowid, {colonnes}) VALUES (NEW.id, {nouvelles});
+        END
+    ''')
+    cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS membres_fts_delete AFTER DELETE ON membres
+        BEGIN
+            INSERT INTO membres_fts (membres_fts, rowid, {colonnes}) VALUES ('delete', OLD.id, {anciennes});
+        END
+    ''')
+    cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS membres_fts_update AFTER UPDATE OF {colonnes} ON membres
+        BEGIN
+            INSERT INTO membres_fts (membres_fts, rowid, {colonnes}) VALUES ('delete', OLD.id, {anciennes});
+            INSERT INTO membres_fts (rowid, {colonnes}) VALUES (NEW.id, {nouvelles});
+        END
+    ''')
+
+    # Classement par défaut (colonne rank) pondéré, puis indexation de l'existant
+    poids = ', '.join(str(p) for p in COLONNES_RECHERCHE.values())
+    cursor.execute("INSERT INTO membres_fts (membres_fts, rank) VALUES ('rank', ?)", (f'bm25({poids})',))
+    cursor.execute("INSERT INTO membres_fts (membres_fts) VALUES ('rebuild')")
+
+def _migration_sequences_numeros(cursor):
+    """
+    Séquence par année pour les numéros ALU-ANNÉE-NNNN, initialisée depuis l'existant
+
+    Chaque année part du plus grand numéro connu: celui des membres présents,
+    celui des suppressions déjà journalisées (membres_supprimes) et celui déjà
+    enregistré dans la séquence; un numéro déjà attribué n'est jamais
+    redistribué. Les membres supprimés avant toute journalisation ne laissent
+    aucune trace: si le plus grand numéro d'une année a été supprimé ainsi,
+    il peut être réattribué.
+    """
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS sequences_numeros (
+            annee INTEGER PRIMARY KEY,
+            dernier INTEGER NOT NULL
+        )
+    ''')
+    sources = ['membres']
+    cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'membres_supprimes'")
+    if cursor.fetchone() is not None:
+        sources.append('membres_supprimes')
+    for source in sources:
+        cursor.execute(f'''
+            INSERT INTO sequences_numeros (annee, dernier)
+            SELECT CAST(substr(numero_membre, 5, 4) AS INTEGER),
+                   MAX(CAST(substr(numero_membre, 10) AS INTEGER))
+            FROM {source}
+            WHERE numero_membre GLOB 'ALU-[0-9][0-9][0-9][0-9]-[0-9]*'
+            GROUP BY 1
+            ON CONFLICT (annee) DO UPDATE SET dernier = MAX(dernier, excluded.dernier)
+        ''')
+
+def _migration_taches_cartes(cursor):
+    """File persistante des rendus de cartes (queued / running / done / failed)"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS taches_cartes (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            membre_id INTEGER NOT NULL,
+            statut TEXT NOT NULL DEFAULT 'queued',
+            tentatives INTEGER NOT NULL DEFAULT 0,
+            disponible_le REAL NOT NULL,
+            reclamee_par TEXT,
+            bail_expire REAL,
+            erreur TEXT,
+            date_creation TEXT NOT NULL,
+            date_fin TEXT
+        )
+    ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_taches_cartes_file ON taches_cartes (statut, disponible_le)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_taches_cartes_membre ON taches_cartes (membre_id)')
+
+def _migration_email_outbox(cursor):
+    """Boîte d'envoi des emails, écrite dans la transaction de la requête"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS email_outbox (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            type TEXT NOT NULL,
+            destinataire TEXT NOT NULL,
+            sujet TEXT NOT NULL,
+            html TEXT NOT NULL,
+            statut TEXT NOT NULL DEFAULT 'queued',
+            tentatives INTEGER NOT NULL DEFAULT 0,
+            disponible_le REAL NOT NULL,
+            reclamee_par TEXT,
+            bail_expire REAL,
+            erreur TEXT,
+            date_creation TEXT NOT NULL,
+            date_fin TEXT
+        )
+    ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_email_outbox_file ON email_outbox (statut, disponible_le)')
+
+def _migration_empreinte_cartes(cursor):
+    """Empreinte du contenu de la carte rendue (reconstruction incrémentale)"""
+    cursor.execute('PRAGMA table_info(membres)')
+    if 'carte_empreinte' not in {colonne['name'] for colonne in cursor.fetchall()}:
+        cursor.execute('ALTER TABLE membres ADD COLUMN carte_empreinte TEXT')
+    # (statut) est ordonné par rowid: parcours des approuvés par id sans tri
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_membres_statut ON membres (statut)')
+
+def _migration_index_promotion(cursor):
+    """Membres d'une promotion par statut (exports), dans l'ordre des id"""
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_membres_statut_promotion ON membres (statut, promotion)')
+
+def _migration_journal_modifications(cursor):
+    """Version de ligne (row_version, updated_at) et pierres tombales, tenues par triggers"""
+    cursor.execute('PRAGMA table_info(membres)')
+    existantes = {colonne['name'] for colonne in cursor.fetchall()}
+    if 'row_version' not in existantes:
+        cursor.execute('ALTER TABLE membres ADD COLUMN row_version INTEGER')
+    if 'updated_at' not in existantes:
+        cursor.execute('ALTER TABLE membres ADD COLUMN updated_at TEXT')
+
+    # Compteur global: toutes les écritures passent par le verrou d'écriture de
+    # SQLite, une version validée n'est donc jamais visible avant une plus petite
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS version_registre (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            derniere INTEGER NOT NULL
+        )
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS membres_supprimes (
+            row_version INTEGER PRIMARY KEY,
+            membre_id INTEGER NOT NULL,
+            numero_membre TEXT,
+            supprime_le TEXT NOT NULL
+        )
+    ''')
+
+    # Lignes existantes: versionnées dans l'ordre des id, avant la pose des triggers
+    cursor.execute('''
+        UPDATE membres SET row_version = id, updated_at = COALESCE(date_validation, date_inscription)
+        WHERE row_version IS NULL
+    ''')
+    cursor.execute('INSERT OR IGNORE INTO version_registre (id, derniere) SELECT 1, COALESCE(MAX(id), 0) FROM membres')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_membres_row_version ON membres (row_version)')
+
+    nouvelle_version = '''
+        UPDATE version_registre SET derniere = derniere + 1 WHERE id = 1;
+        UPDATE membres SET row_version = (SELECT derniere FROM version_registre WHERE id = 1),
+                           updated_at = datetime('now', 'localtime')
+        WHERE id = NEW.id;
+    '''
+    cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS membres_version_insert AFTER INSERT ON membres
+        BEGIN {nouvelle_version} END
+    ''')
+    # La mise à jour faite par le trigger change row_version: elle ne se redéclenche pas
+    cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS membres_version_update AFTER UPDATE ON membres
+        WHEN NEW.row_version IS OLD.row_version
+        BEGIN {nouvelle_version} END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS membres_version_delete AFTER DELETE ON membres
+        BEGIN
+            UPDATE version_registre SET derniere = derniere + 1 WHERE id = 1;
+            INSERT INTO membres_supprimes (row_version, membre_id, numero_membre, supprime_le)
+            VALUES ((SELECT derniere FROM version_registre WHERE id = 1), OLD.id, OLD.numero_membre,
+                    datetime('now', 'localtime'));
+        END
+    ''')
+
+def _migration_champs_inscription(cursor):
+    """
+    Remettre la promotion des inscriptions en ligne à sa place
+
+    L'inscription passait ses champs à add_membre() dans le désordre:
+    promotion recevait le genre (vide, le champ n'était pas envoyé),
+    programme l'année de promotion, et le programme, passé comme genre,
+    n'était pas enregistré. Les lignes dans cet état (promotion vide,
+    programme = une année) retrouvent leur promotion; le programme perdu
+    reste vide.
+    """
+    cursor.execute('''
+        UPDATE membres
+        SET promotion = programme, programme = ''
+        WHERE COALESCE(promotion, '') = '' AND programme GLOB '[12][0-9][0-9][0-9]'
+    ''')
+
+# Étapes ordonnées et idempotentes: (version, description, fonction(cursor))
+MIGRATIONS = [
+    (1, 'Index des listes par statut', _migration_index_listes),
+    (2, 'Index de recherche', _migration_index_recherche),
+    (3, 'Compteurs membres_stats', _creer_compteurs_statut),
+    (4, 'Recherche plein texte FTS5', _migration_recherche_fts),
+    (5, 'Séquences des numéros de membre', _migration_sequences_numeros),
+    (6, 'File des rendus de cartes', _migration_taches_cartes),
+    (7, "Boîte d'envoi des emails", _migration_email_outbox),
+    (8, 'Empreinte des cartes rendues', _migration_empreinte_cartes),
+    (9, 'Index des promotions', _migration_index_promotion),
+    (10, 'Journal des modifications', _migration_journal_modifications),
+    (11, 'Champs des inscriptions en ligne', _migration_champs_inscription),
+    # Bases déjà en version 5: recaler les séquences sur les suppressions journalisées
+    (12, 'Recalage des séquences de numéros', _migration_sequences_numeros),
+]
+
+def get_schema_version(cursor):
+    """Version de schéma actuelle (0 si aucune migration appliquée)"""
+    cursor.execute('SELECT COALESCE(MAX(version), 0) FROM schema_version')
+    return cursor.fetchone()[0]
+
+def appliquer_migrations(cursor):
+    """Appliquer dans l'ordre les migrations plus récentes que la version du schéma"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS schema_version (
+            version INTEGER PRIMARY KEY,
+            description TEXT NOT NULL,
+            date_application TEXT NOT NULL
+        )
+    ''')
+
+    version = get_schema_version(cursor)
+    for numero, description, migration in MIGRATIONS:
+        if numero <= version:
+            continue
+        migration(cursor)
+        cursor.execute('INSERT INTO schema_version (version, description, date_application) VALUES (?, ?, ?)',
+                       (numero, description, datetime.now().strftime('%Y-%m-%d %H:%M:%S')))
+        print(f"✓ Migration {numero} appliquée: {description}")
+
+# ==================== REQUÊTES DES LISTES ====================
+
+# Requêtes chaudes des pages admin (contrôlées par verifier_plans_requetes)
+REQUETES_LISTES = {
+    'en_attente': "SELECT * FROM membres WHERE statut = 'en_attente' ORDER BY date_inscription ASC",
+    'approuves': "SELECT * FROM membres WHERE statut = 'approuve' ORDER BY date_validation DESC",
+    'refuses': "SELECT * FROM membres WHERE statut = 'refuse' ORDER BY date_validation DESC",
+    'suspendus': "SELECT * FROM membres WHERE statut = 'suspendu' ORDER BY date_validation DESC",
+    'tous': 'SELECT * FROM membres ORDER BY date_inscription DESC',
+    # Parcours par lots de la clé primaire (reconstruction des cartes)
+    'cartes_approuves': "SELECT * FROM membres WHERE statut = 'approuve' AND id > ? ORDER BY id LIMIT ?",
+    'cartes_promotion': """SELECT id, numero_membre, nom, prenom, carte_path FROM membres
+                           WHERE statut = 'approuve' AND promotion = ? ORDER BY id""",
+    # Flux des modifications (synchronisation incrémentale)
+    'modifications': 'SELECT * FROM membres WHERE row_version > ? ORDER BY row_version LIMIT ?',
+    'suppressions': 'SELECT * FROM membres_supprimes WHERE row_version > ? ORDER BY row_version LIMIT ?',
+    'recherche': '''SELECT m.* FROM membres_fts
+                    JOIN membres m ON m.id = membres_fts.rowid
+                    WHERE membres_fts MATCH ? AND m.statut = ?
+                    ORDER BY membres_fts.rank
+                    LIMIT ?''',
+    'recherche_tous': '''SELECT m.* FROM membres_fts
+                         JOIN membres m ON m.id = membres_fts.rowid
+                         WHERE membres_fts MATCH ?
+                         ORDER BY membres_fts.rank
+                         LIMIT ?''',
+}
+
+# Listes paginées par curseur: nom -> (filtre WHERE, colonne de tri, sens)
+# Le tri se fait sur (colonne, id) pour que le curseur soit unique.
+LISTES_PAGINEES = {
+    'en_attente': ("statut = 'en_attente'", 'date_inscription', 'ASC'),
+    'approuve': ("statut = 'approuve'", 'date_validation', 'DESC'),
+    'refuse': ("statut = 'refuse'", 'date_validation', 'DESC'),
+    'suspendu': ("statut = 'suspendu'", 'date_validation', 'DESC'),
+    'tous': (None, 'date_inscription', 'DESC'),
+}
+TAILLE_PAGE = 50
+TAILLE_PAGE_MAX = 200
+
+def _sql_page(liste, curseur, en_arriere):
+    """Requête keyset d'une page: prédicat de recherche (colonne, id) </> (?, ?) + LIMIT"""
+    filtre, colonne, sens = LISTES_PAGINEES[liste]
+    # En arrière, on parcourt l'index dans l'autre sens puis on inverse la page
+    if en_arriere:
+        sens = 'DESC' if sens == 'ASC' else 'ASC'
+
+    conditions = [filtre] if filtre else []
+    if curseur:
+        operateur = '>' if sens == 'ASC' else '<'
+        conditions.append(f'({colonne}, id) {operateur} (?, ?)')
+
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ''
+    return f'SELECT * FROM membres {where} ORDER BY {colonne} {sens}, id {sens} LIMIT ?'
+
+for _liste in LISTES_PAGINEES:
+    REQUETES_LISTES[f'page_{_liste}'] = _sql_page(_liste, True, False)
+    REQUETES_LISTES[f'page_{_liste}_precedente'] = _sql_page(_liste, True, True)
+
+def verifier_plans_requetes():
+    """
+    Vérifier avec EXPLAIN QUERY PLAN qu'aucune requête de liste ne parcourt
+    toute la table ni ne trie dans un B-tree temporaire.
+
+    Lève RuntimeError en listant les requêtes fautives.
+    """
+    conn = get_db_connection()
+    cursor = conn.cursor()
+
+    problemes = []
+    for nom, sql in REQUETES_LISTES.items():
+        parametres = (None,) * sql.count('?')
+        cursor.execute(f'EXPLAIN QUERY PLAN {sql}', parametres)
+        for ligne in cursor.fetchall():
+            detail = ligne['detail']
+            parcours_table = detail.startswith('SCAN') and 'USING' not in detail and 'VIRTUAL TABLE' not in detail
+            if parcours_table or 'TEMP B-TREE' in detail:
+                problemes.append(f'{nom}: {detail}')
+
     conn.close()
+    if problemes:
+        raise RuntimeError('Plans de requête sans index:\n  ' + '\n  '.join(problemes))
 
 def hash_password(password):
     """Hasher un mot de passe"""
@@ -98,125 +730,457 @@ def get_admin(admin_id):
     return admin
 
 def generate_member_number():
-    """Générer un numéro de membre unique"""
-    conn = get_db_connection()
-    cursor = conn.cursor()
+    """
+    Générer un numéro de membre unique (ALU-ANNÉE-NNNN)
 
-    # Compter le nombre de membres existants
-    cursor.execute('SELECT COUNT(*) FROM membres')
-    count = cursor.fetchone()[0]
-    conn.close()
-
-    # Format: ALU-ANNÉE-NUMÉRO (ex: ALU-2024-0001)
+    Le compteur de l'année est incrémenté dans la transaction en cours: appelé
+    depuis add_membre(), le numéro n'est consommé que si l'insertion est validée,
+    ce qui garantit des numéros sans doublon ni trou, même entre workers.
+    """
     year = datetime.now().year
-    numero = f"ALU-{year}-{count + 1:04d}"
+    with transaction(immediate=True) as conn:
+        cursor = conn.cursor()
+        cursor.execute('''
+            INSERT INTO sequences_numeros (annee, dernier) VALUES (?, 1)
+            ON CONFLICT (annee) DO UPDATE SET dernier = dernier + 1
+            RETURNING dernier
+        ''', (year,))
+        dernier = cursor.fetchone()[0]
 
-    return numero
+    # Format: ALU-ANNÉE-NUMÉRO (ex: ALU-2024-0001)
+    return f"ALU-{year}-{dernier:04d}"
 
 def add_membre(nom, prenom, date_naissance, promotion, programme, genre, email, telephone, adresse, photo_path):
     """Ajouter un nouveau membre à la base de données (statut en_attente par défaut)"""
-    conn = get_db_connection()
-    cursor = conn.cursor()
+    # Numéro et insertion dans la même transaction (verrou d'écriture pris d'emblée)
+    with transaction(immediate=True) as conn:
+        cursor = conn.cursor()
 
-    numero_membre = generate_member_number()
-    date_inscription = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        numero_membre = generate_member_number()
+        date_inscription = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
 
-    cursor.execute('''
-        INSERT INTO membres (numero_membre, nom, prenom, date_naissance, promotion,
-                           programme, email, telephone, adresse, photo_path, date_inscription, statut)
-        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, 'en_attente')
-    ''', (numero_membre, nom, prenom, date_naissance, promotion,
-          programme, email, telephone, adresse, photo_path, date_inscription))
-
-    membre_id = cursor.lastrowid
-    conn.commit()
-    conn.close()
+        cursor.execute('''
+            INSERT INTO membres (numero_membre, nom, prenom, date_naissance, promotion,
+                               programme, genre, email, telephone, adresse, photo_path, date_inscription, statut)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, 'en_attente')
+        ''', (numero_membre, nom, prenom, date_naissance, promotion,
+              programme, genre, email, telephone, adresse, photo_path, date_inscription))
+
+        membre_id = cursor.lastrowid
 
     return membre_id, numero_membre
 
 def approuver_membre(membre_id):
     """Approuver l'inscription d'un membre"""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-
     date_validation = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-    cursor.execute('''
-        UPDATE membres
-        SET statut = 'approuve', date_validation = ?, motif_refus = NULL
-        WHERE id = ?
-    ''', (date_validation, membre_id))
-
-    conn.commit()
-    conn.close()
+    with transaction(immediate=True) as conn:
+        conn.execute('''
+            UPDATE membres
+            SET statut = 'approuve', date_validation = ?, motif_refus = NULL
+            WHERE id = ?
+        ''', (date_validation, membre_id))
 
 def refuser_membre(membre_id, motif=''):
     """Refuser l'inscription d'un membre"""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-
     date_validation = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-    cursor.execute('''
-        UPDATE membres
-        SET statut = 'refuse', date_validation = ?, motif_refus = ?
-        WHERE id = ?
-    ''', (date_validation, motif, membre_id))
-
-    conn.commit()
-    conn.close()
+    with transaction(immediate=True) as conn:
+        conn.execute('''
+            UPDATE membres
+            SET statut = 'refuse', date_validation = ?, motif_refus = ?
+            WHERE id = ?
+        ''', (date_validation, motif, membre_id))
 
 def suspendre_membre(membre_id, motif=''):
     """Suspendre un membre (généralement pour défaut de paiement)"""
+    date_suspension = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    with transaction(immediate=True) as conn:
+        conn.execute('''
+            UPDATE membres
+            SET statut = 'suspendu', date_validation = ?, motif_refus = ?
+            WHERE id = ?
+        ''', (date_suspension, motif, membre_id))
+
+def _changer_statut_lot(membre_ids, affectation, valeurs, statut_depart):
+    """
+    Passer plusieurs membres du statut `statut_depart` à un autre en une
+    requête (une transaction) et renvoyer les lignes réellement modifiées
+
+    Les ids inconnus ou dans un autre statut sont ignorés: seuls les membres
+    renvoyés reçoivent ensuite carte et email.
+    """
+    ids = list(dict.fromkeys(int(i) for i in membre_ids))
+    if not ids:
+        return []
+
+    with transaction(immediate=True) as conn:
+        cursor = conn.cursor()
+        cursor.execute(f'''
+            UPDATE membres
+            SET {affectation}
+            WHERE id IN (SELECT value FROM json_each(?)) AND statut = ?
+            RETURNING *
+        ''', (*valeurs, json.dumps(ids), statut_depart))
+        return sorted(cursor.fetchall(), key=lambda membre: membre['id'])
+
+def approuver_membres(membre_ids):
+    """Approuver plusieurs inscriptions en attente en une seule transaction"""
+    date_validation = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    return _changer_statut_lot(membre_ids, "statut = 'approuve', date_validation = ?, motif_refus = NULL",
+                               (date_validation,), 'en_attente')
+
+def refuser_membres(membre_ids, motif=''):
+    """Refuser plusieurs inscriptions en attente en une seule transaction"""
+    date_validation = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    return _changer_statut_lot(membre_ids, "statut = 'refuse', date_validation = ?, motif_refus = ?",
+                               (date_validation, motif), 'en_attente')
+
+def suspendre_membres(membre_ids, motif=''):
+    """Suspendre plusieurs membres approuvés en une seule transaction"""
+    date_suspension = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    return _changer_statut_lot(membre_ids, "statut = 'suspendu', date_validation = ?, motif_refus = ?",
+                               (date_suspension, motif), 'approuve')
+
+def reactiver_membre(membre_id):
+    """Réactiver un membre suspendu"""
+    with transaction(immediate=True) as conn:
+        conn.execute('''
+            UPDATE membres
+            SET statut = 'approuve', motif_refus = NULL
+            WHERE id = ?
+        ''', (membre_id,))
+
+def get_membres_suspendus():
+    """Récupérer les membres suspendus"""
     conn = get_db_connection()
     cursor = conn.cursor()
 
-    date_suspension = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-    cursor.execute('''
-        UPDATE membres
-        SET statut = 'suspendu', date_validation = ?, motif_refus = ?
-        WHERE id = ?
-    ''', (date_suspension, motif, membre_id))
+    cursor.execute(REQUETES_LISTES['suspendus'])
+    membres = cursor.fetchall()
 
-    conn.commit()
     conn.close()
+    return membres
 
-def reactiver_membre(membre_id):
-    """Réactiver un membre suspendu"""
+def update_carte_path(membre_id, carte_path, carte_empreinte=None):
+    """Mettre à jour le chemin (et l'empreinte) de la carte de membre"""
+    with transaction(immediate=True) as conn:
+        conn.execute('UPDATE membres SET carte_path = ?, carte_empreinte = ? WHERE id = ?',
+                     (carte_path, carte_empreinte, membre_id))
+
+def fichier_reference(cle):
+    """Un membre utilise-t-il encore ce fichier (photo ou carte)?"""
     conn = get_db_connection()
     cursor = conn.cursor()
 
-    cursor.execute('''
-        UPDATE membres
-        SET statut = 'approuve', motif_refus = NULL
-        WHERE id = ?
-    ''', (membre_id,))
+    cursor.execute('SELECT 1 FROM membres WHERE photo_path = ? OR carte_path = ? LIMIT 1', (cle, cle))
+    ligne = cursor.fetchone()
 
-    conn.commit()
     conn.close()
+    return ligne is not None
 
-def get_membres_suspendus():
-    """Récupérer les membres suspendus"""
+def get_fichiers_membres():
+    """(id, photo_path, carte_path) de tous les membres qui ont au moins un fichier"""
     conn = get_db_connection()
     cursor = conn.cursor()
 
-    cursor.execute('''
-        SELECT * FROM membres
-        WHERE statut = 'suspendu'
-        ORDER BY date_validation DESC
-    ''')
-    membres = cursor.fetchall()
+    cursor.execute('SELECT id, photo_path, carte_path FROM membres WHERE photo_path IS NOT NULL OR carte_path IS NOT NULL')
+    fichiers = cursor.fetchall()
 
     conn.close()
-    return membres
+    return fichiers
+
+def remplacer_fichiers_membre(membre_id, photo_path, carte_path):
+    """Remplacer les références de fichiers d'un membre (l'empreinte de carte est conservée)"""
+    with transaction(immediate=True) as conn:
+        conn.execute('UPDATE membres SET photo_path = ?, carte_path = ? WHERE id = ?',
+                     (photo_path, carte_path, membre_id))
+
+def enregistrer_cartes(cartes):
+    """Enregistrer un lot de cartes rendues: [(membre_id, carte_path, carte_empreinte), ...]"""
+    with transaction(immediate=True) as conn:
+        conn.executemany('UPDATE membres SET carte_path = ?, carte_empreinte = ? WHERE id = ?',
+                         [(chemin, empreinte, membre_id) for membre_id, chemin, empreinte in cartes])
+
+def iter_membres_approuves(taille_lot=500, promotion=None, valide_du=None, valide_au=None, ids=None):
+    """
+    Parcourir les membres approuvés par lots de clé primaire, sans garder de curseur ouvert
+
+    Args:
+        promotion: ne garder qu'une promotion
+        valide_du, valide_au: dates d'approbation 'AAAA-MM-JJ' (bornes incluses)
+        ids: liste explicite d'IDs de membres
+    """
+    sql, valeurs = REQUETES_LISTES['cartes_approuves'], []
+    filtres = []
+    if promotion:
+        filtres.append('promotion = ?')
+        valeurs.append(promotion)
+    if valide_du:
+        filtres.append('date_validation >= ?')
+        valeurs.append(valide_du)
+    if valide_au:
+        filtres.append("date_validation < date(?, '+1 day')")
+        valeurs.append(valide_au)
+    if ids is not None:
+        filtres.append('id IN (SELECT value FROM json_each(?))')
+        valeurs.append(json.dumps(list(ids)))
+    if filtres:
+        sql = sql.replace(' ORDER BY', f" AND {' AND '.join(filtres)} ORDER BY")
 
-def update_carte_path(membre_id, carte_path):
-    """Mettre à jour le chemin de la carte de membre"""
+    conn = get_db_connection()
+    dernier_id = 0
+    while True:
+        lot = conn.execute(sql, (dernier_id, *valeurs, taille_lot)).fetchall()
+        if not lot:
+            return
+        yield from lot
+        dernier_id = lot[-1]['id']
+
+def iter_cartes_promotion(promotion):
+    """Cartes des membres approuvés d'une promotion, lues au fil d'une seule requête indexée"""
+    conn = get_db_connection()
+    cursor = conn.execute(REQUETES_LISTES['cartes_promotion'], (promotion,))
+    while True:
+        lot = cursor.fetchmany(200)
+        if not lot:
+            return
+        yield from lot
+
+# Colonnes exportables du registre, dans l'ordre par défaut des exports
+COLONNES_EXPORT = [
+    'numero_membre', 'nom', 'prenom', 'date_naissance', 'genre', 'promotion', 'programme',
+    'email', 'telephone', 'adresse', 'statut', 'date_inscription', 'date_validation', 'motif_refus',
+]
+
+def iter_export_membres(colonnes=None, statut=None, promotion=None, programme=None,
+                        inscrit_du=None, inscrit_au=None, taille_lot=1000):
+    """
+    Lignes du registre pour un export, lues par lots sur un seul curseur
+
+    Args:
+        colonnes: projection (sous-ensemble de COLONNES_EXPORT, défaut: toutes)
+        statut, promotion, programme: filtres d'égalité
+        inscrit_du, inscrit_au: dates d'inscription 'AAAA-MM-JJ' (bornes incluses)
+
+    Raises:
+        ValueError: colonne inconnue
+    """
+    colonnes = colonnes or COLONNES_EXPORT
+    inconnues = [colonne for colonne in colonnes if colonne not in COLONNES_EXPORT]
+    if inconnues:
+        raise ValueError(f"Colonnes inconnues: {', '.join(inconnues)}")
+
+    filtres, valeurs = [], []
+    for colonne, valeur in (('statut', statut), ('promotion', promotion), ('programme', programme)):
+        if valeur:
+            filtres.append(f'{colonne} = ?')
+            valeurs.append(valeur)
+    if inscrit_du:
+        filtres.append('date_inscription >= ?')
+        valeurs.append(inscrit_du)
+    if inscrit_au:
+        filtres.append("date_inscription < date(?, '+1 day')")
+        valeurs.append(inscrit_au)
+    where = f"WHERE {' AND '.join(filtres)}" if filtres else ''
+
+    conn = get_db_connection()
+    cursor = conn.execute(f"SELECT {', '.join(colonnes)} FROM membres {where} ORDER BY id", valeurs)
+    while True:
+        lot = cursor.fetchmany(taille_lot)
+        if not lot:
+            return
+        yield from lot
+
+# Colonnes fournies par un import (dans l'ordre des tuples de inserer_membres_lot)
+COLONNES_IMPORT = ('nom', 'prenom', 'date_naissance', 'genre', 'promotion', 'programme',
+                   'email', 'telephone', 'adresse', 'date_inscription')
+
+def inserer_membres_lot(membres, approuves=False):
+    """
+    Insérer un lot de membres importés: un executemany dans une transaction
+
+    Les numéros sont alloués en bloc, un seul incrément de séquence par année
+    d'inscription présente dans le lot (ALU-ANNÉE-NNNN de l'année d'inscription).
+
+    Args:
+        membres: tuples dans l'ordre de COLONNES_IMPORT (date_inscription
+            'AAAA-MM-JJ HH:MM:SS', ou None pour maintenant)
+        approuves: insérer directement au statut approuve (validés le jour de
+            leur inscription)
+
+    Returns:
+        int: nombre de membres insérés
+    """
+    maintenant = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    membres = [membre[:-1] + (membre[-1] or maintenant,) for membre in membres]
+
+    par_annee = {}
+    for membre in membres:
+        annee = int(membre[-1][:4])
+        par_annee[annee] = par_annee.get(annee, 0) + 1
+
+    with transaction(immediate=True) as conn:
+        numeros = {}
+        for annee, nombre in par_annee.items():
+            dernier = conn.execute('''
+                INSERT INTO sequences_numeros (annee, dernier) VALUES (?, ?)
+                ON CONFLICT (annee) DO UPDATE SET dernier = dernier + excluded.dernier
+                RETURNING dernier
+            ''', (annee, nombre)).fetchone()[0]
+            numeros[annee] = iter(range(dernier - nombre + 1, dernier + 1))
+
+        statut = 'approuve' if approuves else 'en_attente'
+        conn.executemany(f'''
+            INSERT INTO membres (numero_membre, {', '.join(COLONNES_IMPORT)}, statut, date_validation)
+            VALUES (?, {', '.join('?' * len(COLONNES_IMPORT))}, ?, ?)
+        ''', (
+            (f"ALU-{membre[-1][:4]}-{next(numeros[int(membre[-1][:4])]):04d}", *membre,
+             statut, membre[-1] if approuves else None)
+            for membre in membres
+        ))
+
+    return len(membres)
+
+# ==================== FILE DES RENDUS DE CARTES ====================
+
+TACHES_MAX_TENTATIVES = 5
+TACHES_DELAI_REESSAI = 10  # secondes, doublé à chaque échec
+
+def enfiler_cartes(membre_ids):
+    """
+    Mettre en file le rendu de la carte de plusieurs membres
+
+    Appelée dans la transaction de la requête: si celle-ci est annulée, les
+    tâches le sont aussi. Un membre déjà en file n'est pas ajouté deux fois.
+    """
+    ids = list(dict.fromkeys(int(i) for i in membre_ids))
+    maintenant = datetime.now()
+
+    with transaction(immediate=True) as conn:
+        cursor = conn.cursor()
+        cursor.executemany('''
+            INSERT INTO taches_cartes (membre_id, statut, disponible_le, date_creation)
+            SELECT ?, 'queued', ?, ?
+            WHERE NOT EXISTS (
+                SELECT 1 FROM taches_cartes
+                WHERE membre_id = ? AND statut IN ('queued', 'running')
+            )
+        ''', [(membre_id, maintenant.timestamp(), maintenant.strftime('%Y-%m-%d %H:%M:%S'), membre_id)
+              for membre_id in ids])
+
+def _reclamer(table, colonnes, worker, nombre, duree_bail, max_tentatives):
+    """
+    Réclamer atomiquement jusqu'à `nombre` éléments d'une file pour un worker
+
+    Un élément 'running' dont le bail a expiré (worker arrêté en plein travail)
+    est de nouveau réclamable: rien ne reste bloqué après un crash.
+    """
+    maintenant = time.time()
+    with transaction(immediate=True) as conn:
+        cursor = conn.cursor()
+        # Éléments abandonnés trop souvent (travail qui fait planter le worker): abandon définitif
+        cursor.execute(f'''
+            UPDATE {table}
+            SET statut = 'failed', erreur = 'Bail expiré trop de fois', date_fin = ?
+            WHERE statut = 'running' AND bail_expire < ? AND tentatives >= ?
+        ''', (datetime.now().strftime('%Y-%m-%d %H:%M:%S'), maintenant, max_tentatives))
+        cursor.execute(f'''
+            UPDATE {table}
+            SET statut = 'running', reclamee_par = ?, bail_expire = ?, tentatives = tentatives + 1
+            WHERE id IN (
+                SELECT id FROM {table}
+                WHERE (statut = 'queued' AND disponible_le <= ?)
+                   OR (statut = 'running' AND bail_expire < ?)
+                ORDER BY id
+                LIMIT ?
+            )
+            RETURNING {colonnes}
+        ''', (worker, maintenant + duree_bail, maintenant, maintenant, nombre))
+        return cursor.fetchall()
+
+def _echouer(table, element_id, worker, erreur, max_tentatives, delai):
+    """Remettre un élément en file avec un délai doublé à chaque essai, ou le marquer 'failed'"""
+    with transaction(immediate=True) as conn:
+        cursor = conn.cursor()
+        cursor.execute(f'''
+            UPDATE {table}
+            SET statut = CASE WHEN tentatives >= ? THEN 'failed' ELSE 'queued' END,
+                disponible_le = ? + ? * (1 << (tentatives - 1)),
+                erreur = ?, bail_expire = NULL,
+                date_fin = CASE WHEN tentatives >= ? THEN ? ELSE NULL END
+            WHERE id = ? AND reclamee_par = ? AND statut = 'running'
+        ''', (max_tentatives, time.time(), delai, str(erreur),
+              max_tentatives, datetime.now().strftime('%Y-%m-%d %H:%M:%S'), element_id, worker))
+
+def reclamer_taches_cartes(worker, nombre, duree_bail):
+    """Réclamer des tâches de rendu de carte (voir _reclamer)"""
+    return _reclamer('taches_cartes', 'id, membre_id, tentatives',
+                     worker, nombre, duree_bail, TACHES_MAX_TENTATIVES)
+
+def terminer_tache_carte(tache_id, worker, carte_path, carte_empreinte=None):
+    """Marquer une tâche terminée et enregistrer la carte (si le worker détient encore le bail)"""
+    with transaction(immediate=True) as conn:
+        cursor = conn.cursor()
+        cursor.execute('''
+            UPDATE taches_cartes
+            SET statut = 'done', date_fin = ?, erreur = NULL, bail_expire = NULL
+            WHERE id = ? AND reclamee_par = ? AND statut = 'running'
+            RETURNING membre_id
+        ''', (datetime.now().strftime('%Y-%m-%d %H:%M:%S'), tache_id, worker))
+        ligne = cursor.fetchone()
+        if ligne is None:
+            return False
+        update_carte_path(ligne['membre_id'], carte_path, carte_empreinte)
+        return True
+
+def echouer_tache_carte(tache_id, worker, erreur):
+    """Remettre une tâche en file avec un délai croissant, ou la marquer 'failed' après trop d'essais"""
+    _echouer('taches_cartes', tache_id, worker, erreur, TACHES_MAX_TENTATIVES, TACHES_DELAI_REESSAI)
+
+def get_tache_carte(membre_id):
+    """Dernière tâche de rendu de la carte d'un membre (ou None)"""
     conn = get_db_connection()
     cursor = conn.cursor()
 
-    cursor.execute('UPDATE membres SET carte_path = ? WHERE id = ?', (carte_path, membre_id))
+    cursor.execute('SELECT * FROM taches_cartes WHERE membre_id = ? ORDER BY id DESC LIMIT 1', (membre_id,))
+    tache = cursor.fetchone()
 
-    conn.commit()
     conn.close()
+    return tache
+
+# ==================== BOÎTE D'ENVOI DES EMAILS ====================
+
+EMAILS_MAX_TENTATIVES = 6
+EMAILS_DELAI_REESSAI = 30  # secondes, doublé à chaque échec
+
+def enfiler_email(type_email, destinataire, sujet, html):
+    """Ajouter un email à la boîte d'envoi (dans la transaction en cours)"""
+    maintenant = datetime.now()
+    with transaction(immediate=True) as conn:
+        cursor = conn.cursor()
+        cursor.execute('''
+            INSERT INTO email_outbox (type, destinataire, sujet, html, disponible_le, date_creation)
+            VALUES (?, ?, ?, ?, ?, ?)
+        ''', (type_email, destinataire, sujet, html,
+              maintenant.timestamp(), maintenant.strftime('%Y-%m-%d %H:%M:%S')))
+        return cursor.lastrowid
+
+def reclamer_emails(worker, nombre, duree_bail):
+    """Réclamer un lot d'emails à envoyer (voir _reclamer)"""
+    return _reclamer('email_outbox', 'id, type, destinataire, sujet, html, tentatives',
+                     worker, nombre, duree_bail, EMAILS_MAX_TENTATIVES)
+
+def marquer_email_envoye(email_id, worker):
+    """Enregistrer la remise d'un email au serveur SMTP"""
+    with transaction(immediate=True) as conn:
+        conn.execute('''
+            UPDATE email_outbox
+            SET statut = 'done', date_fin = ?, erreur = NULL, bail_expire = NULL
+            WHERE id = ? AND reclamee_par = ? AND statut = 'running'
+        ''', (datetime.now().strftime('%Y-%m-%d %H:%M:%S'), email_id, worker))
+
+def echouer_email(email_id, worker, erreur):
+    """Reprogrammer un email avec un délai exponentiel, ou le marquer 'failed' après trop d'essais"""
+    _echouer('email_outbox', email_id, worker, erreur, EMAILS_MAX_TENTATIVES, EMAILS_DELAI_REESSAI)
 
 def get_membre(membre_id):
     """Récupérer un membre par son ID"""
@@ -234,11 +1198,7 @@ def get_membres_en_attente():
     conn = get_db_connection()
     cursor = conn.cursor()
 
-    cursor.execute('''
-        SELECT * FROM membres
-        WHERE statut = 'en_attente'
-        ORDER BY date_inscription ASC
-    ''')
+    cursor.execute(REQUETES_LISTES['en_attente'])
     membres = cursor.fetchall()
 
     conn.close()
@@ -249,11 +1209,7 @@ def get_membres_approuves():
     conn = get_db_connection()
     cursor = conn.cursor()
 
-    cursor.execute('''
-        SELECT * FROM membres
-        WHERE statut = 'approuve'
-        ORDER BY date_validation DESC
-    ''')
+    cursor.execute(REQUETES_LISTES['approuves'])
     membres = cursor.fetchall()
 
     conn.close()
@@ -264,11 +1220,7 @@ def get_membres_refuses():
     conn = get_db_connection()
     cursor = conn.cursor()
 
-    cursor.execute('''
-        SELECT * FROM membres
-        WHERE statut = 'refuse'
-        ORDER BY date_validation DESC
-    ''')
+    cursor.execute(REQUETES_LISTES['refuses'])
     membres = cursor.fetchall()
 
     conn.close()
@@ -279,67 +1231,168 @@ def get_all_membres():
     conn = get_db_connection()
     cursor = conn.cursor()
 
-    cursor.execute('SELECT * FROM membres ORDER BY date_inscription DESC')
+    cursor.execute(REQUETES_LISTES['tous'])
     membres = cursor.fetchall()
 
     conn.close()
     return membres
 
-def search_membres(query, statut=None):
-    """Rechercher des membres par nom, prénom ou numéro"""
+def encoder_curseur(membre, liste):
+    """Curseur opaque (base64) contenant la clé de tri (colonne, id) d'une ligne"""
+    colonne = LISTES_PAGINEES[liste][1]
+    brut = json.dumps([membre[colonne], membre['id']], separators=(',', ':'))
+    return base64.urlsafe_b64encode(brut.encode()).decode().rstrip('=')
+
+def decoder_curseur(curseur):
+    """Décoder un curseur en (valeur, id); ValueError s'il est invalide"""
+    try:
+        brut = base64.urlsafe_b64decode(curseur + '=' * (-len(curseur) % 4))
+        cle = json.loads(brut)
+    except (TypeError, ValueError) as e:
+        raise ValueError(f'Curseur invalide: {curseur!r}') from e
+    # [valeur de la colonne de tri (date en texte, NULL possible), id entier SQLite]
+    if not (isinstance(cle, list) and len(cle) == 2
+            and (cle[0] is None or isinstance(cle[0], str))
+            and type(cle[1]) is int and -2 ** 63 <= cle[1] < 2 ** 63):
+        raise ValueError(f'Curseur invalide: {curseur!r}')
+    return cle[0], cle[1]
+
+def get_page_membres(liste, apres=None, avant=None, taille=TAILLE_PAGE):
+    """
+    Récupérer une page d'une liste de membres par pagination keyset
+
+    Args:
+        liste: clé de LISTES_PAGINEES ('en_attente', 'approuve', ..., 'tous')
+        apres: curseur de la dernière ligne de la page précédente (page suivante)
+        avant: curseur de la première ligne de la page suivante (page précédente)
+        taille: nombre de lignes par page (borné à TAILLE_PAGE_MAX)
+
+    Returns:
+        dict avec 'membres', 'suivant' et 'precedent' (curseurs ou None)
+
+    Le coût d'une page ne dépend pas de sa position: on cherche directement
+    dans l'index à partir de la clé du curseur, sans OFFSET.
+    """
+    if liste not in LISTES_PAGINEES:
+        raise ValueError(f'Liste inconnue: {liste}')
+    taille = max(1, min(int(taille), TAILLE_PAGE_MAX))
+    en_arriere = bool(avant) and not apres
+    curseur = decoder_curseur(avant if en_arriere else apres) if (apres or avant) else None
+
     conn = get_db_connection()
     cursor = conn.cursor()
 
-    if statut:
-        cursor.execute('''
-            SELECT * FROM membres
-            WHERE (nom LIKE ? OR prenom LIKE ? OR numero_membre LIKE ?)
-            AND statut = ?
-            ORDER BY nom, prenom
-        ''', (f'%{query}%', f'%{query}%', f'%{query}%', statut))
-    else:
-        cursor.execute('''
-            SELECT * FROM membres
-            WHERE nom LIKE ? OR prenom LIKE ? OR numero_membre LIKE ?
-            ORDER BY nom, prenom
-        ''', (f'%{query}%', f'%{query}%', f'%{query}%'))
-
+    parametres = (*curseur, taille + 1) if curseur else (taille + 1,)
+    cursor.execute(_sql_page(liste, curseur is not None, en_arriere), parametres)
     membres = cursor.fetchall()
+
     conn.close()
 
-    return membres
+    # Une ligne de plus que demandé indique qu'il reste des lignes dans ce sens
+    encore = len(membres) > taille
+    membres = membres[:taille]
+    if en_arriere:
+        membres.reverse()
 
-def delete_membre(membre_id):
-    """Supprimer un membre"""
+    if en_arriere:
+        a_suivant, a_precedent = True, encore
+    else:
+        a_suivant, a_precedent = encore, curseur is not None
+
+    return {
+        'membres': membres,
+        'suivant': encoder_curseur(membres[-1], liste) if membres and a_suivant else None,
+        'precedent': encoder_curseur(membres[0], liste) if membres and a_precedent else None,
+    }
+
+def get_modifications(depuis=0, taille=TAILLE_PAGE):
+    """
+    Membres modifiés et supprimés après la version `depuis`, dans l'ordre des versions
+
+    Returns:
+        dict avec 'modifications' (lignes de membres), 'suppressions' (pierres
+        tombales), 'version' (à repasser comme `depuis` pour la page suivante)
+        et 'encore' (il reste des changements après cette page)
+
+    Chaque source est lue dans son index row_version à partir de `depuis`:
+    le coût est proportionnel au nombre de changements, pas à la taille du registre.
+    """
+    taille = max(1, min(int(taille), TAILLE_PAGE_MAX))
     conn = get_db_connection()
     cursor = conn.cursor()
 
-    cursor.execute('DELETE FROM membres WHERE id = ?', (membre_id,))
+    # Une ligne de plus par source, puis fusion par version
+    cursor.execute(REQUETES_LISTES['modifications'], (depuis, taille + 1))
+    changements = [('modifications', ligne) for ligne in cursor.fetchall()]
+    cursor.execute(REQUETES_LISTES['suppressions'], (depuis, taille + 1))
+    changements += [('suppressions', ligne) for ligne in cursor.fetchall()]
 
-    conn.commit()
     conn.close()
 
-def get_stats():
-    """Obtenir les statistiques des membres"""
+    changements.sort(key=lambda changement: changement[1]['row_version'])
+    page = {'modifications': [], 'suppressions': [], 'version': depuis, 'encore': len(changements) > taille}
+    for source, ligne in changements[:taille]:
+        page[source].append(ligne)
+        page['version'] = ligne['row_version']
+    return page
+
+def expression_recherche(query):
+    """
+    Transformer une saisie libre en requête FTS5: chaque mot devient un
+    préfixe ("dia"*), tous les mots doivent correspondre.
+    """
+    mots = re.findall(r'\w+', query)
+    return ' '.join(f'"{mot}"*' for mot in mots)
+
+def search_membres(query, statut=None, limite=TAILLE_PAGE_MAX):
+    """
+    Rechercher des membres (nom, prénom, numéro, email, promotion, programme) classés par pertinence
+
+    Seuls les `limite` plus pertinents sont renvoyés; une ligne de plus est
+    lue pour savoir si d'autres correspondent.
+
+    Returns:
+        dict: {'membres': [...], 'tronque': True si des résultats ont été omis}
+    """
+    expression = expression_recherche(query)
+    if not expression:
+        return {'membres': [], 'tronque': False}
+
     conn = get_db_connection()
     cursor = conn.cursor()
 
-    stats = {}
+    if statut:
+        cursor.execute(REQUETES_LISTES['recherche'], (expression, statut, limite + 1))
+    else:
+        cursor.execute(REQUETES_LISTES['recherche_tous'], (expression, limite + 1))
 
-    cursor.execute('SELECT COUNT(*) FROM membres')
-    stats['total'] = cursor.fetchone()[0]
+    membres = cursor.fetchall()
+    conn.close()
 
-    cursor.execute('SELECT COUNT(*) FROM membres WHERE statut = "en_attente"')
-    stats['en_attente'] = cursor.fetchone()[0]
+    return {'membres': membres[:limite], 'tronque': len(membres) > limite}
 
-    cursor.execute('SELECT COUNT(*) FROM membres WHERE statut = "approuve"')
-    stats['approuves'] = cursor.fetchone()[0]
+def delete_membre(membre_id):
+    """Supprimer un membre"""
+    with transaction(immediate=True) as conn:
+        conn.execute('DELETE FROM membres WHERE id = ?', (membre_id,))
 
-    cursor.execute('SELECT COUNT(*) FROM membres WHERE statut = "refuse"')
-    stats['refuses'] = cursor.fetchone()[0]
+def get_stats():
+    """Obtenir les statistiques des membres (lecture de la ligne de compteurs)"""
+    conn = get_db_connection()
+    cursor = conn.cursor()
 
-    cursor.execute('SELECT COUNT(*) FROM membres WHERE statut = "suspendu"')
-    stats['suspendus'] = cursor.fetchone()[0]
+    cursor.execute(f"SELECT total, {', '.join(COMPTEURS_STATUT)} FROM membres_stats WHERE id = 1")
+    ligne = cursor.fetchone()
 
     conn.close()
-    return stats
\ No newline at end of file
+    if ligne is None:
+        return dict.fromkeys(['total', *COMPTEURS_STATUT], 0)
+    return dict(ligne)
+
+if __name__ == '__main__':
+    # python database.py: migrer la base puis contrôler les plans de requête
+    init_db()
+    with transaction() as conn:
+        print(f"Version du schéma: {get_schema_version(conn.cursor())}")
+    verifier_plans_requetes()
+    print("✓ Toutes les requêtes de liste utilisent un index")
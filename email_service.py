@@ -1,9 +1,24 @@
 from flask_mail import Mail, Message
 from flask import render_template_string
 import os
+import smtplib
+import socket
+import threading
+import time
+import uuid
+
+from metriques import incrementer, observer
+from profilage import etape
+from database import enfiler_email, reclamer_emails, marquer_email_envoye, echouer_email
 
 mail = Mail()
 
+EMAILS_PAR_LOT = 50          # emails envoyés par session SMTP
+INTERVALLE_SCRUTATION = 2.0  # secondes entre deux passages sur la boîte d'envoi
+DUREE_BAIL = 120             # au-delà, un lot 'running' est considéré abandonné
+
+_expediteur_integre = None
+
 
 def init_mail(app):
     """Initialiser Flask-Mail avec l'application"""
@@ -18,6 +33,89 @@ def init_mail(app):
     return mail
 
 
+def mettre_en_file(type_email, msg):
+    """Écrire le message dans la boîte d'envoi (transaction de la requête) au lieu de l'envoyer"""
+    return enfiler_email(type_email, ', '.join(msg.recipients), msg.subject, msg.html)
+
+
+def expedier_lot(worker, nombre=EMAILS_PAR_LOT):
+    """
+    Envoyer un lot d'emails de la boîte d'envoi sur une seule session SMTP
+
+    Chaque email est marqué envoyé ('done') ou reprogrammé avec un délai
+    exponentiel. Si la connexion échoue, tout le lot restant est reprogrammé.
+    Doit être appelée dans un contexte d'application. Renvoie le nombre
+    d'emails réclamés.
+    """
+    emails = reclamer_emails(worker, nombre, DUREE_BAIL)
+    if not emails:
+        return 0
+
+    traites = set()
+    try:
+        with mail.connect() as connexion:
+            for email in emails:
+                msg = Message(
+                    subject=email['sujet'],
+                    recipients=[d.strip() for d in email['destinataire'].split(',')],
+                    html=email['html']
+                )
+                debut = time.perf_counter()
+                try:
+                    connexion.send(msg)
+                except smtplib.SMTPServerDisconnected:
+                    observer('alubilles_smtp_envoi_duree_secondes', time.perf_counter() - debut,
+                             resultat='deconnexion')
+                    raise
+                except Exception as e:
+                    observer('alubilles_smtp_envoi_duree_secondes', time.perf_counter() - debut, resultat='echec')
+                    print(f"Erreur envoi email {email['type']} #{email['id']}: {e}")
+                    echouer_email(email['id'], worker, e)
+                else:
+                    observer('alubilles_smtp_envoi_duree_secondes', time.perf_counter() - debut, resultat='envoye')
+                    marquer_email_envoye(email['id'], worker)
+                traites.add(email['id'])
+    except Exception as e:
+        if not traites:
+            incrementer('alubilles_smtp_connexion_echecs_total')
+        print(f"Erreur connexion SMTP: {e}")
+        for email in emails:
+            if email['id'] not in traites:
+                echouer_email(email['id'], worker, e)
+
+    return len(emails)
+
+
+def executer_expediteur(app, arret=None):
+    """Vider la boîte d'envoi en continu (jusqu'à ce que `arret` soit levé)"""
+    arret = arret or threading.Event()
+    worker = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+    with app.app_context():
+        while not arret.is_set():
+            try:
+                reclames = expedier_lot(worker)
+            except Exception as e:
+                print(f"Erreur expéditeur d'emails: {e}")
+                reclames = 0
+            if reclames < EMAILS_PAR_LOT:
+                arret.wait(INTERVALLE_SCRUTATION)
+
+
+def demarrer_expediteur_integre(app):
+    """Démarrer (une fois par processus) l'expéditeur dans un thread d'arrière-plan (EMAILS_EXPEDITEUR_INTEGRE=1)"""
+    global _expediteur_integre
+    if _expediteur_integre is not None and _expediteur_integre.is_alive():
+        return _expediteur_integre
+
+    _expediteur_integre = threading.Thread(
+        target=executer_expediteur, args=(app,), name='expediteur-emails', daemon=True
+    )
+    _expediteur_integre.start()
+    return _expediteur_integre
+
+
+@etape('mail')
 def envoyer_email_inscription(membre_email, membre_nom, membre_prenom, numero_membre):
     """Envoyer un email de confirmation d'inscription au membre"""
     try:
@@ -71,13 +169,14 @@ def envoyer_email_inscription(membre_email, membre_nom, membre_prenom, numero_me
         </html>
         """
 
-        mail.send(msg)
+        mettre_en_file('inscription', msg)
         return True
     except Exception as e:
         print(f"Erreur envoi email inscription: {e}")
         return False
 
 
+@etape('mail')
 def envoyer_email_approbation(membre_email, membre_nom, membre_prenom, numero_membre):
     """Envoyer un email d'approbation au membre"""
     try:
@@ -141,13 +240,14 @@ def envoyer_email_approbation(membre_email, membre_nom, membre_prenom, numero_me
         </html>
         """
 
-        mail.send(msg)
+        mettre_en_file('approbation', msg)
         return True
     except Exception as e:
         print(f"Erreur envoi email approbation: {e}")
         return False
 
 
+@etape('mail')
 def envoyer_email_refus(membre_email, membre_nom, membre_prenom, motif=''):
     """Envoyer un email de refus au membre"""
     try:
@@ -195,13 +295,14 @@ def envoyer_email_refus(membre_email, membre_nom, membre_prenom, motif=''):
         </html>
         """
 
-        mail.send(msg)
+        mettre_en_file('refus', msg)
         return True
     except Exception as e:
         print(f"Erreur envoi email refus: {e}")
         return False
 
 
+@etape('mail')
 def envoyer_email_suspension(membre_email, membre_nom, membre_prenom, motif=''):
     """Envoyer un email de suspension au membre"""
     try:
@@ -262,13 +363,14 @@ def envoyer_email_suspension(membre_email, membre_nom, membre_prenom, motif=''):
         </html>
         """
 
-        mail.send(msg)
+        mettre_en_file('suspension', msg)
         return True
     except Exception as e:
         print(f"Erreur envoi email suspension: {e}")
         return False
 
 
+@etape('mail')
 def envoyer_notification_admin(admin_email, membre_nom, membre_prenom, numero_membre):
     """Envoyer une notification à l'admin lors d'une nouvelle inscription"""
     try:
@@ -318,8 +420,26 @@ def envoyer_notification_admin(admin_email, membre_nom, membre_prenom, numero_me
         </html>
         """
 
-        mail.send(msg)
+        mettre_en_file('notification_admin', msg)
         return True
     except Exception as e:
         print(f"Erreur envoi notification admin: {e}")
-        return False
\ No newline at end of file
+        return False
+
+
+if __name__ == '__main__':
+    # Expéditeur dédié: python email_service.py (Procfile: mailer)
+    from flask import Flask
+    from dotenv import load_dotenv
+    from database import init_db
+
+    load_dotenv()
+    app = Flask(__name__)
+    init_mail(app)
+    init_db()
+
+    print(f"✓ Expéditeur d'emails démarré (pid {os.getpid()})")
+    try:
+        executer_expediteur(app)
+    except KeyboardInterrupt:
+        print("Arrêt de l'expéditeur")
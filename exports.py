@@ -0,0 +1,186 @@
+"""
+Exports en flux pour l'administration
+
+Les archives (ZIP des cartes) et les exports du registre (CSV, XLSX) sont
+produits morceau par morceau pour une réponse HTTP en flux: ni fichier
+temporaire, ni document complet en mémoire.
+"""
+
+from datetime import datetime
+from xml.sax.saxutils import escape
+import csv
+import io
+import re
+import zipfile
+
+from werkzeug.utils import secure_filename
+
+from database import iter_cartes_promotion, iter_export_membres
+from stockage import get_stockage
+
+LIGNES_PAR_MORCEAU = 500
+
+# Caractères de contrôle interdits en XML 1.0
+CARACTERES_INTERDITS_XML = re.compile('[\x00-\x08\x0b\x0c\x0e-\x1f]')
+
+
+class TamponFlux:
+    """
+    Fichier en écriture seule vidé à chaque lecture
+
+    zipfile écrit dans un fichier non positionnable en ajoutant des
+    descripteurs de données après chaque entrée: il suffit de récupérer les
+    octets écrits au fur et à mesure.
+    """
+
+    def __init__(self):
+        self.morceaux = []
+
+    def write(self, donnees):
+        self.morceaux.append(bytes(donnees))
+        return len(donnees)
+
+    def flush(self):
+        pass
+
+    def vider(self):
+        donnees = b''.join(self.morceaux)
+        self.morceaux.clear()
+        return donnees
+
+
+def zip_cartes_promotion(promotion):
+    """
+    Archive ZIP des cartes d'une promotion, générée morceau par morceau
+
+    Les PNG, déjà compressés, sont stockés sans recompression (ZIP_STORED).
+    Les membres sans carte sont listés dans cartes_manquantes.txt.
+    """
+    tampon = TamponFlux()
+    stockage = get_stockage()
+    manquantes = []
+    date = datetime.now().timetuple()[:6]
+
+    with zipfile.ZipFile(tampon, 'w', compression=zipfile.ZIP_STORED) as archive:
+        for membre in iter_cartes_promotion(promotion):
+            if not membre['carte_path'] or not stockage.existe(membre['carte_path']):
+                manquantes.append(f"{membre['numero_membre']} {membre['prenom']} {membre['nom']}")
+                continue
+            nom = secure_filename(f"{membre['numero_membre']}_{membre['nom']}_{membre['prenom']}.png")
+            archive.writestr(zipfile.ZipInfo(nom, date), stockage.lire(membre['carte_path']))
+            yield tampon.vider()
+
+        if manquantes:
+            archive.writestr(zipfile.ZipInfo('cartes_manquantes.txt', date), '\n'.join(manquantes) + '\n',
+                             compress_type=zipfile.ZIP_DEFLATED)
+    yield tampon.vider()
+
+
+def cellule_csv(valeur):
+    """Valeur sûre pour un tableur: une formule (=, @, +/- suivi d'autre chose qu'un chiffre) reste du texte"""
+    if valeur is None:
+        return ''
+    valeur = str(valeur)
+    if valeur[:1] in ('=', '@', '\t', '\r') or (valeur[:1] in ('+', '-') and not valeur[1:2].isdigit()):
+        return "'" + valeur
+    return valeur
+
+
+def export_csv(colonnes, **filtres):
+    """Registre en CSV (UTF-8 avec BOM pour Excel), LIGNES_PAR_MORCEAU lignes par morceau"""
+    tampon = io.StringIO()
+    ecrivain = csv.writer(tampon)
+    tampon.write('\ufeff')
+    ecrivain.writerow(colonnes)
+
+    for numero, ligne in enumerate(iter_export_membres(colonnes, **filtres), 1):
+        ecrivain.writerow([cellule_csv(valeur) for valeur in ligne])
+        if numero % LIGNES_PAR_MORCEAU == 0:
+            yield tampon.getvalue().encode('utf-8')
+            tampon.seek(0)
+            tampon.truncate()
+    yield tampon.getvalue().encode('utf-8')
+
+
+# Parties fixes d'un classeur XLSX minimal (une feuille, chaînes en ligne)
+XLSX_PARTIES = {
+    '[Content_Types].xml': (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+        '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+        '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+        '<Default Extension="xml" ContentType="application/xml"/>'
+        '<Override PartName="/xl/workbook.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+        '<Override PartName="/xl/worksheets/sheet1.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+        '</Types>'
+    ),
+    '_rels/.rels': (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" Target="xl/workbook.xml" '
+        'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument"/>'
+        '</Relationships>'
+    ),
+    'xl/workbook.xml': (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+        '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+        'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">'
+        '<sheets><sheet name="Membres" sheetId="1" r:id="rId1"/></sheets>'
+        '</workbook>'
+    ),
+    'xl/_rels/workbook.xml.rels': (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" Target="worksheets/sheet1.xml" '
+        'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet"/>'
+        '</Relationships>'
+    ),
+}
+
+
+def ligne_xlsx(numero, valeurs):
+    """Ligne de feuille XLSX: toutes les valeurs en chaînes en ligne (pas de table partagée à garder)"""
+    cellules = ''.join(
+        '<c t="inlineStr"><is><t xml:space="preserve">'
+        f'{escape(CARACTERES_INTERDITS_XML.sub("", str(valeur)))}</t></is></c>'
+        if valeur is not None else '<c/>'
+        for valeur in valeurs
+    )
+    return f'<row r="{numero}">{cellules}</row>'
+
+
+def export_xlsx(colonnes, **filtres):
+    """
+    Registre en XLSX, écrit en flux
+
+    La feuille est une entrée ZIP écrite au fil des lignes (zipfile, sans
+    positionnement): la mémoire ne dépend pas du nombre de lignes, là où les
+    bibliothèques de tableur gardent la feuille ou un fichier temporaire.
+    """
+    tampon = TamponFlux()
+    date = datetime.now().timetuple()[:6]
+
+    with zipfile.ZipFile(tampon, 'w', compression=zipfile.ZIP_DEFLATED) as archive:
+        for nom, contenu in XLSX_PARTIES.items():
+            archive.writestr(zipfile.ZipInfo(nom, date), contenu, compress_type=zipfile.ZIP_DEFLATED)
+        yield tampon.vider()
+
+        feuille = zipfile.ZipInfo('xl/worksheets/sheet1.xml', date)
+        feuille.compress_type = zipfile.ZIP_DEFLATED
+        with archive.open(feuille, 'w', force_zip64=True) as sortie:
+            sortie.write((
+                '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+                '<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main"><sheetData>'
+                + ligne_xlsx(1, colonnes)
+            ).encode('utf-8'))
+
+            lignes = []
+            for numero, ligne in enumerate(iter_export_membres(colonnes, **filtres), 2):
+                lignes.append(ligne_xlsx(numero, ligne))
+                if len(lignes) == LIGNES_PAR_MORCEAU:
+                    sortie.write(''.join(lignes).encode('utf-8'))
+                    lignes.clear()
+                    yield tampon.vider()
+            sortie.write((''.join(lignes) + '</sheetData></worksheet>').encode('utf-8'))
+    yield tampon.vider()
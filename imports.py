@@ -0,0 +1,170 @@
+"""
+Import en masse des membres historiques depuis un CSV
+
+Le fichier est lu deux fois en flux, ligne par ligne:
+    1. validation complète: rien n'est inséré si une ligne est invalide
+    2. insertion par lots de TAILLE_LOT lignes, un executemany par lot dans
+       sa propre transaction, numéros de membre alloués en bloc
+
+Aucun email n'est envoyé: les membres importés sont déjà connus de
+l'association. Les cartes des membres importés comme approuvés se génèrent
+ensuite avec `flask cards rebuild`.
+"""
+
+from datetime import datetime
+import csv
+import re
+import unicodedata
+
+from database import COLONNES_IMPORT, inserer_membres_lot
+
+TAILLE_LOT = 1000  # lignes par transaction
+ERREURS_MAX = 50  # erreurs rapportées, la validation continue au-delà
+
+COLONNES_OBLIGATOIRES = ('nom', 'prenom')
+# AAAA-MM-JJ ou JJ/MM/AAAA, heure facultative (date_inscription);
+# analysées par expression régulière: strptime coûte plus que l'insertion
+MOTIF_DATE = re.compile(
+    r'^(?:(?P<a>\d{4})-(?P<m>\d{1,2})-(?P<j>\d{1,2})|(?P<j2>\d{1,2})/(?P<m2>\d{1,2})/(?P<a2>\d{4}))'
+    r'(?:[ T](?P<h>\d{1,2}):(?P<mi>\d{2})(?::(?P<s>\d{2}))?)?$'
+)
+MOTIF_EMAIL = re.compile(r'^[^@\s]+@[^@\s]+\.[^@\s]+$')
+
+# Intitulés courants des tableurs -> colonnes du registre
+ALIAS_ENTETES = {
+    'date_de_naissance': 'date_naissance',
+    'date_d_inscription': 'date_inscription',
+    'sexe': 'genre',
+    'mail': 'email',
+    'e_mail': 'email',
+    'tel': 'telephone',
+}
+
+
+def normaliser_entete(entete):
+    """'Prénom ' -> 'prenom', 'Date de naissance' -> 'date_naissance'"""
+    entete = unicodedata.normalize('NFKD', entete or '').encode('ascii', 'ignore').decode()
+    entete = re.sub(r'[^a-z0-9]+', '_', entete.strip().lower()).strip('_')
+    return ALIAS_ENTETES.get(entete, entete)
+
+
+def lire_date(valeur, heure=False):
+    """datetime d'une date AAAA-MM-JJ ou JJ/MM/AAAA (avec heure si `heure`), None si invalide"""
+    correspondance = MOTIF_DATE.match(valeur)
+    if not correspondance or (correspondance['h'] and not heure):
+        return None
+    d = correspondance.groupdict()
+    try:
+        return datetime(int(d['a'] or d['a2']), int(d['m'] or d['m2']), int(d['j'] or d['j2']),
+                        int(d['h'] or 0), int(d['mi'] or 0), int(d['s'] or 0))
+    except ValueError:
+        return None
+
+
+def valider_ligne(ligne):
+    """
+    Valider et normaliser une ligne du CSV (dict colonne -> texte)
+
+    Returns:
+        tuple: (tuple dans l'ordre de COLONNES_IMPORT, liste d'erreurs)
+    """
+    # Champs vides: '' comme le formulaire d'inscription (None casserait le rendu des cartes)
+    valeurs = {colonne: (ligne.get(colonne) or '').strip() for colonne in COLONNES_IMPORT}
+    erreurs = [f"{colonne} manquant" for colonne in COLONNES_OBLIGATOIRES if not valeurs[colonne]]
+
+    if valeurs['email'] and not MOTIF_EMAIL.match(valeurs['email']):
+        erreurs.append(f"email invalide ({valeurs['email']})")
+
+    if valeurs['date_naissance']:
+        date = lire_date(valeurs['date_naissance'])
+        if date:
+            valeurs['date_naissance'] = date.strftime('%Y-%m-%d')
+        else:
+            erreurs.append(f"date_naissance invalide ({valeurs['date_naissance']})")
+
+    if valeurs['date_inscription']:
+        date = lire_date(valeurs['date_inscription'], heure=True)
+        if date:
+            valeurs['date_inscription'] = date.strftime('%Y-%m-%d %H:%M:%S')
+        else:
+            erreurs.append(f"date_inscription invalide ({valeurs['date_inscription']})")
+    else:
+        valeurs['date_inscription'] = None  # inserer_membres_lot: maintenant
+
+    return tuple(valeurs[colonne] for colonne in COLONNES_IMPORT), erreurs
+
+
+def lire_csv(flux):
+    """
+    Lignes d'un CSV texte (séparateur , ; ou tabulation détecté): (numéro de ligne, dict)
+
+    Raises:
+        ValueError: colonne obligatoire absente de l'en-tête
+    """
+    echantillon = flux.read(8192)
+    flux.seek(0)
+    try:
+        dialecte = csv.Sniffer().sniff(echantillon, delimiters=',;\t')
+    except csv.Error:
+        dialecte = csv.excel
+
+    lecteur = csv.reader(flux, dialecte)
+    entetes = [normaliser_entete(entete) for entete in next(lecteur, [])]
+    absentes = [colonne for colonne in COLONNES_OBLIGATOIRES if colonne not in entetes]
+    if absentes:
+        raise ValueError(f"Colonnes obligatoires absentes de l'en-tête: {', '.join(absentes)}")
+
+    for ligne in lecteur:
+        if any(champ.strip() for champ in ligne):
+            yield lecteur.line_num, dict(zip(entetes, ligne))
+
+
+def valider_csv(flux):
+    """
+    Passe de validation (en flux, rien n'est gardé en mémoire que les erreurs)
+
+    Returns:
+        dict: lignes (valides ou non), erreurs [(numéro de ligne, message)]
+        limitées à ERREURS_MAX, nombre total d'erreurs
+    """
+    rapport = {'lignes': 0, 'erreurs': [], 'nb_erreurs': 0}
+    for numero, ligne in lire_csv(flux):
+        rapport['lignes'] += 1
+        _, erreurs = valider_ligne(ligne)
+        if erreurs:
+            rapport['nb_erreurs'] += 1
+            if len(rapport['erreurs']) < ERREURS_MAX:
+                rapport['erreurs'].append((numero, ', '.join(erreurs)))
+    return rapport
+
+
+def importer_csv(flux, approuves=False, simulation=False, taille_lot=TAILLE_LOT):
+    """
+    Valider puis importer un CSV de membres
+
+    Args:
+        flux: fichier texte positionnable (relu après la validation)
+        approuves: importer les membres au statut approuve
+        simulation: valider seulement
+
+    Returns:
+        dict: le rapport de valider_csv, plus 'importes'
+
+    Raises:
+        ValueError: en-tête invalide
+    """
+    rapport = valider_csv(flux)
+    rapport['importes'] = 0
+    if rapport['nb_erreurs'] or simulation:
+        return rapport
+
+    flux.seek(0)
+    lot = []
+    for _, ligne in lire_csv(flux):
+        lot.append(valider_ligne(ligne)[0])
+        if len(lot) == taille_lot:
+            rapport['importes'] += inserer_membres_lot(lot, approuves)
+            lot = []
+    if lot:
+        rapport['importes'] += inserer_membres_lot(lot, approuves)
+    return rapport
@@ -0,0 +1,273 @@
+"""
+Métriques de performance au format d'exposition Prometheus
+
+Chaque processus (workers gunicorn, processus de rendu des cartes,
+expéditeur d'emails) accumule ses compteurs et histogrammes en mémoire; un
+thread les écrit toutes les INTERVALLE_ECRITURE secondes dans
+METRIQUES_DOSSIER/<pid>-<jeton>.json (écriture atomique). /admin/metrics
+additionne les fichiers de tous les processus: le résultat est le même quel
+que soit le worker qui répond.
+
+Les fichiers des processus terminés sont repliés dans termines.json, pour
+que les compteurs restent monotones quand un worker est remplacé.
+"""
+
+from bisect import bisect_left
+import json
+import os
+import tempfile
+import threading
+import time
+import uuid
+
+try:
+    import fcntl
+except ImportError:  # Windows: pas de repli des processus terminés
+    fcntl = None
+
+METRIQUES_DOSSIER = os.getenv('METRIQUES_DOSSIER', 'cache/metriques')
+INTERVALLE_ECRITURE = 1.0  # secondes
+
+BORNES_DUREE = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+BORNES_TAILLE = (10_000, 50_000, 100_000, 500_000, 1_000_000, 5_000_000, 16_000_000)
+
+# nom -> (type, aide, bornes des histogrammes)
+DEFINITIONS = {
+    'alubilles_http_requete_duree_secondes': (
+        'histogram', "Durée des requêtes HTTP par route, méthode et code", BORNES_DUREE),
+    'alubilles_sql_requetes_total': (
+        'counter', "Requêtes SQL exécutées, par route (hors_requete: workers, CLI)", None),
+    'alubilles_sql_duree_secondes_total': (
+        'counter', "Temps passé dans SQLite (exécution et lecture), par route", None),
+    'alubilles_carte_rendu_duree_secondes': (
+        'histogram', "Durée du rendu d'une carte de membre", BORNES_DUREE),
+    'alubilles_smtp_envoi_duree_secondes': (
+        'histogram', "Durée d'envoi d'un email par SMTP, par résultat", BORNES_DUREE),
+    'alubilles_smtp_connexion_echecs_total': (
+        'counter', "Sessions SMTP impossibles à ouvrir", None),
+    'alubilles_upload_octets': (
+        'histogram', "Taille des fichiers reçus, par type", BORNES_TAILLE),
+}
+
+# Route de la requête HTTP en cours dans ce thread (étiquette des métriques SQL)
+contexte = threading.local()
+
+_verrou = threading.Lock()
+_verrou_ecriture = threading.Lock()  # un instantané plus ancien ne remplace jamais un plus récent
+_valeurs = {}
+_processus = None  # (pid, jeton, thread d'écriture)
+_modifie = False
+
+
+def _cle(nom, etiquettes):
+    return json.dumps([nom, sorted(etiquettes.items())])
+
+
+def _demarrer():
+    """Valeurs et thread d'écriture propres au processus (recréés après un fork)"""
+    global _processus, _valeurs
+    if _processus is None or _processus[0] != os.getpid():
+        _valeurs = {}
+        ecrivain = threading.Thread(target=_ecrire_en_continu, name='metriques', daemon=True)
+        _processus = (os.getpid(), uuid.uuid4().hex[:8], ecrivain)
+        ecrivain.start()
+
+
+def incrementer(nom, valeur=1, **etiquettes):
+    """Ajouter `valeur` à un compteur"""
+    global _modifie
+    cle = _cle(nom, etiquettes)
+    with _verrou:
+        _demarrer()
+        _valeurs[cle] = _valeurs.get(cle, 0) + valeur
+        _modifie = True
+
+
+def observer(nom, valeur, **etiquettes):
+    """Enregistrer une observation dans un histogramme"""
+    global _modifie
+    bornes = DEFINITIONS[nom][2]
+    cle = _cle(nom, etiquettes)
+    with _verrou:
+        _demarrer()
+        histogramme = _valeurs.get(cle)
+        if histogramme is None:
+            # [effectif par intervalle (dernier: au-delà de la dernière borne), somme]
+            histogramme = _valeurs[cle] = [[0] * (len(bornes) + 1), 0.0]
+        histogramme[0][bisect_left(bornes, valeur)] += 1
+        histogramme[1] += valeur
+        _modifie = True
+
+
+def observer_sql(duree, requetes=1):
+    """Compter une requête SQL (requetes=0: lecture de résultats) et son temps, pour la route en cours"""
+    global _modifie
+    route = getattr(contexte, 'route', None) or 'hors_requete'
+    nombre, temps = _cle('alubilles_sql_requetes_total', {'route': route}), \
+        _cle('alubilles_sql_duree_secondes_total', {'route': route})
+    with _verrou:
+        _demarrer()
+        _valeurs[nombre] = _valeurs.get(nombre, 0) + requetes
+        _valeurs[temps] = _valeurs.get(temps, 0) + duree
+        _modifie = True
+
+
+def flux_de_la_route(corps):
+    """
+    Corps de réponse en flux dont les requêtes SQL restent rattachées à la route en cours
+
+    Un corps en flux est lu après la fin de la requête (contexte.route déjà
+    remis à None): sans ce relais, ses requêtes seraient comptées hors_requete.
+    La route n'est posée que le temps de produire chaque morceau.
+    """
+    # Lue maintenant, pendant la requête: le générateur ne démarre qu'après
+    route = getattr(contexte, 'route', None)
+
+    def generer():
+        iterateur = iter(corps)
+        try:
+            while True:
+                precedente, contexte.route = getattr(contexte, 'route', None), route
+                try:
+                    morceau = next(iterateur)
+                except StopIteration:
+                    return
+                finally:
+                    contexte.route = precedente
+                yield morceau
+        finally:
+            if hasattr(iterateur, 'close'):
+                iterateur.close()
+
+    return generer()
+
+
+def _ecrire_atomique(chemin, texte):
+    descripteur, temporaire = tempfile.mkstemp(dir=METRIQUES_DOSSIER, suffix='.tmp')
+    try:
+        with os.fdopen(descripteur, 'w') as f:
+            f.write(texte)
+        os.replace(temporaire, chemin)
+    except BaseException:
+        os.unlink(temporaire)
+        raise
+
+
+def ecrire():
+    """Écrire les valeurs de ce processus dans son fichier"""
+    global _modifie
+    with _verrou_ecriture:
+        with _verrou:
+            if _processus is None or _processus[0] != os.getpid() or not _modifie:
+                return
+            instantane = json.dumps(_valeurs)
+            _modifie = False
+        os.makedirs(METRIQUES_DOSSIER, exist_ok=True)
+        _ecrire_atomique(os.path.join(METRIQUES_DOSSIER, f'{_processus[0]}-{_processus[1]}.json'), instantane)
+
+
+def _ecrire_en_continu():
+    while True:
+        time.sleep(INTERVALLE_ECRITURE)
+        try:
+            ecrire()
+        except OSError as e:
+            print(f"⚠ Écriture des métriques impossible: {e}")
+
+
+def _additionner(total, valeurs):
+    for cle, valeur in valeurs.items():
+        if isinstance(valeur, list):
+            existant = total.setdefault(cle, [[0] * len(valeur[0]), 0.0])
+            existant[0] = [a + b for a, b in zip(existant[0], valeur[0])]
+            existant[1] += valeur[1]
+        else:
+            total[cle] = total.get(cle, 0) + valeur
+
+
+def _processus_vivant(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def collecter():
+    """Valeurs additionnées de tous les processus (vivants et terminés)"""
+    ecrire()
+    if not os.path.isdir(METRIQUES_DOSSIER):
+        return {}
+
+    total = {}
+    termines = os.path.join(METRIQUES_DOSSIER, 'termines.json')
+    with open(os.path.join(METRIQUES_DOSSIER, 'verrou'), 'a') as verrou:
+        if fcntl:
+            fcntl.flock(verrou, fcntl.LOCK_EX)
+        try:
+            with open(termines) as f:
+                replies = json.load(f)
+        except FileNotFoundError:
+            replies = {}
+
+        morts = []
+        for nom in os.listdir(METRIQUES_DOSSIER):
+            if not nom.endswith('.json') or nom == 'termines.json':
+                continue
+            try:
+                with open(os.path.join(METRIQUES_DOSSIER, nom)) as f:
+                    valeurs = json.load(f)
+            except (FileNotFoundError, ValueError):
+                continue
+            if fcntl and not _processus_vivant(int(nom.split('-')[0])):
+                _additionner(replies, valeurs)
+                morts.append(nom)
+            else:
+                _additionner(total, valeurs)
+
+        if morts:
+            _ecrire_atomique(termines, json.dumps(replies))
+            for nom in morts:
+                os.remove(os.path.join(METRIQUES_DOSSIER, nom))
+
+    _additionner(total, replies)
+    return total
+
+
+def _etiquettes(paires):
+    """{cle="valeur",...} avec l'échappement du format texte (\\, \", \\n)"""
+    if not paires:
+        return ''
+    echappees = (
+        cle + '="' + str(valeur).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') + '"'
+        for cle, valeur in paires
+    )
+    return '{' + ','.join(echappees) + '}'
+
+
+def exposition():
+    """Texte au format d'exposition Prometheus 0.0.4"""
+    series = {}
+    for cle, valeur in collecter().items():
+        nom, paires = json.loads(cle)
+        if nom in DEFINITIONS:
+            series.setdefault(nom, []).append((paires, valeur))
+
+    lignes = []
+    for nom, (type_metrique, aide, bornes) in DEFINITIONS.items():
+        lignes.append(f'# HELP {nom} {aide}')
+        lignes.append(f'# TYPE {nom} {type_metrique}')
+        for paires, valeur in sorted(series.get(nom, [])):
+            if type_metrique == 'counter':
+                lignes.append(f'{nom}{_etiquettes(paires)} {valeur}')
+                continue
+            effectifs, somme = valeur
+            cumul = 0
+            for borne, effectif in zip((*bornes, '+Inf'), effectifs):
+                cumul += effectif
+                lignes.append(f'{nom}_bucket{_etiquettes(paires + [["le", borne]])} {cumul}')
+            lignes.append(f'{nom}_sum{_etiquettes(paires)} {somme}')
+            lignes.append(f'{nom}_count{_etiquettes(paires)} {cumul}')
+    return '\n'.join(lignes) + '\n'
@@ -0,0 +1,126 @@
+"""
+Miniatures des photos et des cartes de membre, formats dérivés des cartes
+
+Les dérivés (miniatures WebP ou JPEG, cartes en WebP ou PDF) sont générés
+avec Pillow à la première demande puis gardés sur disque, rangés par
+empreinte sha256 du fichier source: une photo remplacée donne de nouveaux
+dérivés, jamais un dérivé périmé.
+"""
+
+from functools import lru_cache
+from PIL import Image, ImageOps
+import hashlib
+import os
+import tempfile
+
+from card_generator import encoder_carte
+from profilage import etape
+from stockage import empreinte_cle, get_stockage
+
+CACHE_MINIATURES = 'cache/miniatures'
+CACHE_CARTES = 'cache/cartes'
+
+# Tailles servies (côté le plus long, en pixels): avatars 50px en 2x, photo
+# de la fiche admin, aperçu de carte. Toute autre taille est refusée.
+TAILLES_MINIATURES = (100, 400, 800)
+
+FORMATS = {
+    'webp': ('WEBP', 'image/webp', {'quality': 80, 'method': 4}),
+    'jpeg': ('JPEG', 'image/jpeg', {'quality': 85, 'optimize': True, 'progressive': True}),
+}
+
+
+@lru_cache(maxsize=4096)
+def _hash_fichier(chemin, taille, mtime):
+    """sha256 du contenu d'un fichier (mis en cache par taille et mtime)"""
+    with open(chemin, 'rb') as f:
+        return hashlib.file_digest(f, 'sha256').hexdigest()
+
+
+def empreinte_source(chemin):
+    """Empreinte sha256 d'une source (clé du stockage ou ancien chemin), None si absente"""
+    empreinte = empreinte_cle(chemin)
+    if empreinte:
+        return empreinte
+    try:
+        stat = os.stat(chemin)
+    except OSError:
+        return None
+    return _hash_fichier(chemin, stat.st_size, stat.st_mtime_ns)
+
+
+def format_accepte(accept):
+    """'webp' si le navigateur l'annonce dans Accept, sinon 'jpeg'"""
+    return 'webp' if accept and 'image/webp' in accept else 'jpeg'
+
+
+def chemin_miniature(empreinte, taille, fmt):
+    """Chemin du dérivé dans le cache (répertoires par préfixe d'empreinte)"""
+    return os.path.join(CACHE_MINIATURES, empreinte[:2], f"{empreinte}_{taille}.{fmt}")
+
+
+def _ecrire_atomique(destination, ecrire):
+    """Écrire `destination` via un fichier temporaire: ecrire(f) reçoit le fichier ouvert"""
+    os.makedirs(os.path.dirname(destination), exist_ok=True)
+    descripteur, temporaire = tempfile.mkstemp(dir=os.path.dirname(destination), suffix='.tmp')
+    try:
+        with os.fdopen(descripteur, 'wb') as f:
+            ecrire(f)
+        os.replace(temporaire, destination)
+    except BaseException:
+        os.unlink(temporaire)
+        raise
+
+
+@etape('rendu')
+def generer_miniature(source, destination, taille, fmt):
+    """Redimensionner `source` dans `destination` (écriture atomique)"""
+    nom_pillow, _, options = FORMATS[fmt]
+    with get_stockage().ouvrir(source) as f, Image.open(f) as image:
+        # JPEG: décoder directement à une échelle réduite (bien plus rapide)
+        image.draft('RGB', (taille, taille))
+        image = ImageOps.exif_transpose(image)
+        image.thumbnail((taille, taille), Image.Resampling.LANCZOS)
+        image = image.convert('RGB')
+        _ecrire_atomique(destination, lambda sortie: image.save(sortie, nom_pillow, **options))
+
+
+def obtenir_miniature(source, taille, fmt):
+    """
+    Dérivé d'un fichier source, généré au besoin
+
+    Returns:
+        tuple: (chemin du dérivé, empreinte de la source), ou None si la source n'existe pas
+    """
+    empreinte = empreinte_source(source)
+    if empreinte is None:
+        return None
+    destination = chemin_miniature(empreinte, taille, fmt)
+    if not os.path.exists(destination):
+        try:
+            generer_miniature(source, destination, taille, fmt)
+        except FileNotFoundError:
+            return None
+    return destination, empreinte
+
+
+def obtenir_format_carte(source, fmt, dpi):
+    """
+    Carte convertie en `fmt` ('webp', 'pdf') depuis le PNG de référence, générée au besoin
+
+    Returns:
+        tuple: (chemin du dérivé, empreinte du PNG), ou None si la carte n'existe pas
+    """
+    empreinte = empreinte_source(source)
+    if empreinte is None:
+        return None
+    suffixe = f"_{dpi}dpi" if fmt == 'pdf' else ''
+    destination = os.path.join(CACHE_CARTES, empreinte[:2], f"{empreinte}{suffixe}.{fmt}")
+    if not os.path.exists(destination):
+        try:
+            with get_stockage().ouvrir(source) as f, Image.open(f) as carte:
+                donnees = encoder_carte(carte, fmt, dpi)
+        except FileNotFoundError:
+            return None
+        _ecrire_atomique(destination, lambda sortie: sortie.write(donnees))
+    return destination, empreinte
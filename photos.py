@@ -0,0 +1,84 @@
+"""
+Normalisation des photos de membre à l'envoi
+
+Chaque photo reçue est vérifiée par Pillow, refusée au-delà d'un nombre de
+pixels (bombe de décompression), redressée selon son orientation EXIF et
+réduite à PHOTO_TAILLE_MAX avant d'être stockée en JPEG compact: le
+rendu des cartes et les miniatures ne lisent plus que de petits fichiers.
+"""
+
+from PIL import Image, ImageOps
+import io
+
+from profilage import etape
+
+# 720 px: deux fois le cercle de 360 px de la carte
+PHOTO_TAILLE_MAX = 720
+
+# Refus avant décodage au-delà de 40 mégapixels (un appareil photo récent
+# en produit 12 à 24); bien en dessous de la limite de Pillow (89 Mpx)
+PHOTO_PIXELS_MAX = 40_000_000
+
+FORMATS_PHOTO = {'JPEG', 'PNG', 'GIF', 'WEBP', 'MPO'}
+EXTENSION_PHOTO = '.jpg'
+OPTIONS_JPEG = {'quality': 85, 'optimize': True, 'progressive': True}
+
+
+def ouvrir_photo(flux):
+    """
+    Ouvrir et vérifier une image envoyée
+
+    Raises:
+        ValueError: fichier illisible, format non accepté ou image trop grande
+    """
+    try:
+        image = Image.open(flux)
+        if image.format not in FORMATS_PHOTO:
+            raise ValueError(f"format {image.format} non accepté")
+        largeur, hauteur = image.size
+        if largeur * hauteur > PHOTO_PIXELS_MAX:
+            raise ValueError(f"image trop grande ({largeur}x{hauteur})")
+        # verify() contrôle la structure du fichier mais rend l'image inutilisable
+        image.verify()
+        flux.seek(0)
+        return Image.open(flux)
+    except Image.DecompressionBombError as e:
+        raise ValueError("image trop grande") from e
+    except ValueError:
+        raise
+    except Exception as e:
+        raise ValueError("fichier illisible ou endommagé") from e
+
+
+@etape('rendu')
+def normaliser_photo(flux):
+    """
+    Vérifier, redresser et réduire une photo, puis l'encoder en JPEG
+
+    Args:
+        flux: fichier binaire de l'image reçue (ex: FileStorage.stream)
+
+    Returns:
+        bytes: le JPEG, à confier au stockage (voir stockage.py)
+
+    Raises:
+        ValueError: si l'image est refusée
+    """
+    with ouvrir_photo(flux) as image:
+        # JPEG: décoder directement à une échelle proche de la taille cible
+        image.draft('RGB', (PHOTO_TAILLE_MAX, PHOTO_TAILLE_MAX))
+        image = ImageOps.exif_transpose(image)
+        image.thumbnail((PHOTO_TAILLE_MAX, PHOTO_TAILLE_MAX), Image.Resampling.LANCZOS)
+
+        # Transparence: aplatir sur fond blanc plutôt que noir
+        if image.mode in ('RGBA', 'LA') or (image.mode == 'P' and 'transparency' in image.info):
+            image = image.convert('RGBA')
+            fond = Image.new('RGB', image.size, 'white')
+            fond.paste(image, mask=image.getchannel('A'))
+            image = fond
+        else:
+            image = image.convert('RGB')
+
+    tampon = io.BytesIO()
+    image.save(tampon, 'JPEG', **OPTIONS_JPEG)
+    return tampon.getvalue()
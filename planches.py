@@ -0,0 +1,281 @@
+"""
+Planches d'impression des cartes de membre
+
+Les cartes sélectionnées sont imposées N par page (A4 ou Letter, à leur
+taille réelle CR80) avec des traits de coupe, dans un PDF écrit page par
+page: seules les cartes de la page en cours sont en mémoire, quel que soit
+leur nombre.
+
+Les cartes déjà rendues sont reprises telles quelles (les données
+compressées du PNG passent directement dans le PDF); seules les cartes
+manquantes sont rendues, puis enregistrées. Une carte impossible à rendre
+ou à relire est sautée (la réponse est déjà commencée): les numéros
+concernés sont listés sur une dernière page « Cartes manquantes ».
+"""
+
+import io
+import struct
+import zlib
+
+from PIL import Image
+
+from card_generator import CARTE_LARGEUR_MM, CARTE_HAUTEUR_MM, version_template
+from database import iter_membres_approuves, enregistrer_cartes
+from stockage import get_stockage
+from taches_cartes import TEMPLATE_PATH, donnees_carte, empreinte_carte, rendre_carte
+
+POINTS_PAR_MM = 72 / 25.4
+
+# Formats de papier en points (portrait)
+PAPIERS = {
+    'a4': (595.28, 841.89),
+    'letter': (612.0, 792.0),
+}
+
+MARGE_MM = 10          # place des traits de coupe autour de la grille
+TRAIT_DECALAGE_MM = 1.5
+TRAIT_LONGUEUR_MM = 5
+
+# Page de texte (liste des cartes manquantes)
+TEXTE_TAILLE = 10
+TEXTE_INTERLIGNE = 14
+TEXTE_MARGE = 50
+
+
+def disposition(papier):
+    """
+    Grille des cartes sur une page: cartes jointives (coupes communes), grille centrée
+
+    Returns:
+        tuple: (largeur, hauteur) de la page et liste des coins bas-gauche (x, y)
+        des cartes, de haut en bas et de gauche à droite
+    """
+    largeur, hauteur = PAPIERS[papier]
+    carte_l = CARTE_LARGEUR_MM * POINTS_PAR_MM
+    carte_h = CARTE_HAUTEUR_MM * POINTS_PAR_MM
+    marge = MARGE_MM * POINTS_PAR_MM
+
+    colonnes = int((largeur - 2 * marge) // carte_l)
+    lignes = int((hauteur - 2 * marge) // carte_h)
+    x0 = (largeur - colonnes * carte_l) / 2
+    y0 = (hauteur - lignes * carte_h) / 2
+
+    positions = [
+        (x0 + c * carte_l, y0 + (lignes - 1 - l) * carte_h)
+        for l in range(lignes) for c in range(colonnes)
+    ]
+    return (largeur, hauteur), positions
+
+
+def traits_de_coupe(positions):
+    """Opérateurs PDF des traits de coupe, dans les marges, au droit de chaque bord de carte"""
+    carte_l = CARTE_LARGEUR_MM * POINTS_PAR_MM
+    carte_h = CARTE_HAUTEUR_MM * POINTS_PAR_MM
+    decalage = TRAIT_DECALAGE_MM * POINTS_PAR_MM
+    longueur = TRAIT_LONGUEUR_MM * POINTS_PAR_MM
+
+    xs = sorted({round(x, 2) for x, _ in positions} | {round(x + carte_l, 2) for x, _ in positions})
+    ys = sorted({round(y, 2) for _, y in positions} | {round(y + carte_h, 2) for _, y in positions})
+    gauche, droite, bas, haut = xs[0], xs[-1], ys[0], ys[-1]
+
+    operateurs = ['0.25 w 0 G']
+    for x in xs:
+        operateurs.append(f'{x} {haut + decalage} m {x} {haut + decalage + longueur} l S')
+        operateurs.append(f'{x} {bas - decalage} m {x} {bas - decalage - longueur} l S')
+    for y in ys:
+        operateurs.append(f'{gauche - decalage} {y} m {gauche - decalage - longueur} {y} l S')
+        operateurs.append(f'{droite + decalage} {y} m {droite + decalage + longueur} {y} l S')
+    return '\n'.join(operateurs)
+
+
+def image_pdf(donnees_png):
+    """
+    XObject image d'un PNG: (dictionnaire, flux)
+
+    Un PNG RGB ou gris 8 bits non entrelacé (cas des cartes rendues) est repris
+    sans décompression: ses IDAT sont déjà du Flate avec prédicteurs PNG, que le
+    PDF sait lire. Tout autre PNG est d'abord réencodé par Pillow.
+    """
+    if donnees_png[:8] == b'\x89PNG\r\n\x1a\n':
+        position, idat, entete = 8, [], None
+        while position < len(donnees_png):
+            longueur, type_bloc = struct.unpack('>I4s', donnees_png[position:position + 8])
+            bloc = donnees_png[position + 8:position + 8 + longueur]
+            if type_bloc == b'IHDR':
+                entete = struct.unpack('>IIBBBBB', bloc)
+            elif type_bloc == b'IDAT':
+                idat.append(bloc)
+            position += 12 + longueur
+
+        if entete:
+            largeur, hauteur, profondeur, couleur, _, _, entrelace = entete
+            if profondeur == 8 and couleur in (0, 2) and not entrelace:
+                couleurs, espace = (3, '/DeviceRGB') if couleur == 2 else (1, '/DeviceGray')
+                dictionnaire = (
+                    f'/Type /XObject /Subtype /Image /Width {largeur} /Height {hauteur} '
+                    f'/ColorSpace {espace} /BitsPerComponent 8 /Filter /FlateDecode '
+                    f'/DecodeParms << /Predictor 15 /Colors {couleurs} /Columns {largeur} >>'
+                )
+                return dictionnaire, b''.join(idat)
+
+    with Image.open(io.BytesIO(donnees_png)) as image:
+        tampon = io.BytesIO()
+        image.convert('RGB').save(tampon, 'PNG')
+    return image_pdf(tampon.getvalue())
+
+
+class PDFEnFlux:
+    """
+    Écriture incrémentale d'un PDF: chaque méthode retourne les octets à envoyer
+
+    Seules les positions des objets (pour la table xref) restent en mémoire.
+    Objets 1 (catalogue) et 2 (arbre des pages, écrit à la fin) réservés.
+    """
+
+    def __init__(self):
+        self.positions = {}
+        self.taille = 0
+        self.prochain = 3
+        self.pages = []
+        self.police = None  # objet de la police des pages de texte, écrit au premier usage
+
+    def _ecrire(self, donnees):
+        self.taille += len(donnees)
+        return donnees
+
+    def _objet(self, numero, dictionnaire, flux=None):
+        self.positions[numero] = self.taille
+        if flux is None:
+            return self._ecrire(f'{numero} 0 obj\n<< {dictionnaire} >>\nendobj\n'.encode('latin-1'))
+        return self._ecrire(
+            f'{numero} 0 obj\n<< {dictionnaire} /Length {len(flux)} >>\nstream\n'.encode('latin-1')
+            + flux + b'\nendstream\nendobj\n'
+        )
+
+    def _numero(self):
+        self.prochain += 1
+        return self.prochain - 1
+
+    def debut(self):
+        return self._ecrire(b'%PDF-1.4\n%\xe2\xe3\xcf\xd3\n') + self._objet(1, '/Type /Catalog /Pages 2 0 R')
+
+    def page(self, taille_page, images, operateurs):
+        """Une page: images = [(dictionnaire, flux, x, y, largeur, hauteur)], operateurs en plus"""
+        morceaux, ressources, contenu = [], [], []
+        for indice, (dictionnaire, flux, x, y, largeur, hauteur) in enumerate(images):
+            numero = self._numero()
+            morceaux.append(self._objet(numero, dictionnaire, flux))
+            ressources.append(f'/C{indice} {numero} 0 R')
+            contenu.append(f'q {largeur:.2f} 0 0 {hauteur:.2f} {x:.2f} {y:.2f} cm /C{indice} Do Q')
+        contenu.append(operateurs)
+
+        numero_contenu = self._numero()
+        morceaux.append(self._objet(numero_contenu, '/Filter /FlateDecode',
+                                    zlib.compress('\n'.join(contenu).encode('latin-1'))))
+        numero_page = self._numero()
+        morceaux.append(self._objet(
+            numero_page,
+            f'/Type /Page /Parent 2 0 R /MediaBox [0 0 {taille_page[0]} {taille_page[1]}] '
+            f'/Resources << /XObject << {" ".join(ressources)} >> >> /Contents {numero_contenu} 0 R'
+        ))
+        self.pages.append(numero_page)
+        return b''.join(morceaux)
+
+    def pages_texte(self, taille_page, lignes):
+        """Pages de texte simple (Helvetica), autant que nécessaire pour toutes les lignes"""
+        morceaux = []
+        if self.police is None:
+            self.police = self._numero()
+            morceaux.append(self._objet(self.police, '/Type /Font /Subtype /Type1 /BaseFont /Helvetica '
+                                                     '/Encoding /WinAnsiEncoding'))
+
+        par_page = int((taille_page[1] - 2 * TEXTE_MARGE) // TEXTE_INTERLIGNE)
+        for debut in range(0, len(lignes), par_page):
+            echappees = (
+                ligne.encode('cp1252', 'replace').decode('latin-1')
+                .replace('\\', '\\\\').replace('(', '\\(').replace(')', '\\)')
+                for ligne in lignes[debut:debut + par_page]
+            )
+            contenu = (
+                f'BT /F1 {TEXTE_TAILLE} Tf {TEXTE_INTERLIGNE} TL '
+                f'{TEXTE_MARGE} {taille_page[1] - TEXTE_MARGE} Td '
+                + ' '.join(f'({ligne}) Tj T*' for ligne in echappees) + ' ET'
+            )
+            numero_contenu = self._numero()
+            morceaux.append(self._objet(numero_contenu, '/Filter /FlateDecode',
+                                        zlib.compress(contenu.encode('latin-1'))))
+            numero_page = self._numero()
+            morceaux.append(self._objet(
+                numero_page,
+                f'/Type /Page /Parent 2 0 R /MediaBox [0 0 {taille_page[0]} {taille_page[1]}] '
+                f'/Resources << /Font << /F1 {self.police} 0 R >> >> /Contents {numero_contenu} 0 R'
+            ))
+            self.pages.append(numero_page)
+        return b''.join(morceaux)
+
+    def fin(self):
+        kids = ' '.join(f'{numero} 0 R' for numero in self.pages)
+        morceaux = [self._objet(2, f'/Type /Pages /Kids [{kids}] /Count {len(self.pages)}')]
+        debut_xref = self.taille
+        lignes = [f'xref\n0 {self.prochain}\n', '0000000000 65535 f \n']
+        lignes += [f'{self.positions.get(numero, 0):010d} 00000 n \n' for numero in range(1, self.prochain)]
+        lignes.append(f'trailer\n<< /Size {self.prochain} /Root 1 0 R >>\nstartxref\n{debut_xref}\n%%EOF\n')
+        morceaux.append(self._ecrire(''.join(lignes).encode('latin-1')))
+        return b''.join(morceaux)
+
+
+def generer_planches(papier='a4', **selection):
+    """
+    Générer le PDF des planches, morceau par morceau (pour une réponse en flux)
+
+    Args:
+        papier: 'a4' ou 'letter'
+        selection: filtres de iter_membres_approuves (promotion, valide_du, valide_au, ids)
+    """
+    taille_page, positions = disposition(papier)
+    operateurs = traits_de_coupe(positions)
+    carte_l = CARTE_LARGEUR_MM * POINTS_PAR_MM
+    carte_h = CARTE_HAUTEUR_MM * POINTS_PAR_MM
+    stockage = get_stockage()
+    version = version_template(TEMPLATE_PATH)
+
+    pdf = PDFEnFlux()
+    yield pdf.debut()
+
+    def image_carte(membre):
+        """XObject de la carte du membre (rendue ici si absente), None si impossible"""
+        try:
+            carte_path = membre['carte_path']
+            if not carte_path or not stockage.existe(carte_path):
+                # Carte manquante: rendue ici et enregistrée pour la prochaine fois
+                carte_path = rendre_carte(donnees_carte(membre))
+                rendues.append((membre['id'], carte_path, empreinte_carte(membre, version)))
+            return image_pdf(stockage.lire(carte_path))
+        except Exception as e:
+            print(f"⚠ Carte {membre['numero_membre']} sautée dans les planches: {e}")
+            manquantes.append(f"{membre['numero_membre']} {membre['prenom']} {membre['nom']}")
+            return None
+
+    def page(images):
+        if rendues:
+            enregistrer_cartes(rendues)
+            rendues.clear()
+        return pdf.page(taille_page, [(*image, x, y, carte_l, carte_h)
+                                      for image, (x, y) in zip(images, positions)], operateurs)
+
+    images, rendues, manquantes = [], [], []
+    for membre in iter_membres_approuves(**selection):
+        image = image_carte(membre)
+        if image is None:
+            continue
+        images.append(image)
+        if len(images) == len(positions):
+            yield page(images)
+            images = []
+    if images or not (pdf.pages or manquantes):
+        yield page(images)
+
+    if manquantes:
+        yield pdf.pages_texte(taille_page, [f"Cartes manquantes ({len(manquantes)}):", ''] + manquantes)
+
+    yield pdf.fin()
@@ -0,0 +1,256 @@
+"""
+Profilage des requêtes lentes par échantillonnage de pile (optionnel)
+
+Activé par PROFILAGE=1. Un thread par processus relève toutes les
+PROFILAGE_INTERVALLE_MS la pile des threads qui servent une requête
+(sys._current_frames): le coût est assez faible pour suivre toutes les
+requêtes, et décider à la fin seulement lesquelles garder. Un profil
+déterministe (cProfile) devrait être actif dès le début de la requête, sans
+savoir si elle sera lente, et la ralentirait plusieurs fois.
+
+Sont gardées les requêtes plus longues que PROFILAGE_SEUIL_MS, et une
+fraction PROFILAGE_TAUX des autres. Pour chacune, PROFILAGE_DOSSIER reçoit:
+    <id>.json              route, durée et temps par étape (db, rendu, mail, template)
+    <id>.speedscope.json   le profil, à ouvrir sur https://www.speedscope.app
+Seuls les PROFILAGE_MAX derniers profils sont conservés.
+
+Les étapes sont exclusives: une requête SQL faite pendant l'envoi d'un email
+compte dans db, pas dans mail; le reste du temps est « autre ».
+"""
+
+from collections import Counter
+from contextlib import contextmanager
+from datetime import datetime
+import json
+import os
+import random
+import re
+import sys
+import tempfile
+import threading
+import time
+
+PROFILAGE = os.getenv('PROFILAGE', '0') == '1'
+PROFILAGE_TAUX = float(os.getenv('PROFILAGE_TAUX', '0.01'))
+PROFILAGE_SEUIL_MS = float(os.getenv('PROFILAGE_SEUIL_MS', '1000'))
+PROFILAGE_INTERVALLE_MS = float(os.getenv('PROFILAGE_INTERVALLE_MS', '5'))
+PROFILAGE_DOSSIER = os.getenv('PROFILAGE_DOSSIER', 'cache/profils')
+PROFILAGE_MAX = int(os.getenv('PROFILAGE_MAX', '200'))
+
+ETAPES = ('db', 'rendu', 'mail', 'template')
+MOTIF_ID = re.compile(r'^\d+-\d+$')
+
+# Requête profilée de ce thread: temps par étape et pile des étapes ouvertes
+contexte = threading.local()
+
+_piles = {}           # ident du thread -> (Counter pile -> millisecondes, [nombre d'échantillons])
+_echantillonneur = None  # (pid, thread)
+_verrou = threading.Lock()
+
+
+# ==================== ÉTAPES ====================
+
+def compter_etape(nom, duree):
+    """Ajouter `duree` à une étape (mesure déjà faite, sans étape imbriquée)"""
+    etapes = getattr(contexte, 'etapes', None)
+    if etapes is None:
+        return
+    etapes[nom] += duree
+    if contexte.ouvertes:
+        contexte.ouvertes[-1] += duree
+
+
+def ouvrir_etape():
+    """Début d'une étape (à passer à fermer_etape), None hors requête profilée"""
+    if getattr(contexte, 'etapes', None) is None:
+        return None
+    contexte.ouvertes.append(0.0)  # temps des étapes imbriquées, à déduire
+    return time.perf_counter()
+
+
+def fermer_etape(nom, debut):
+    """Fin d'une étape ouverte par ouvrir_etape(): son temps propre va à `nom`"""
+    if debut is None or getattr(contexte, 'etapes', None) is None:
+        return
+    duree = time.perf_counter() - debut
+    imbriquees = contexte.ouvertes.pop()
+    contexte.etapes[nom] += duree - imbriquees
+    if contexte.ouvertes:
+        contexte.ouvertes[-1] += duree
+
+
+@contextmanager
+def etape(nom):
+    """Chronométrer un bloc (ou une fonction, en décorateur) comme étape `nom`"""
+    debut = ouvrir_etape()
+    try:
+        yield
+    finally:
+        fermer_etape(nom, debut)
+
+
+# ==================== ÉCHANTILLONNAGE ====================
+
+def _nom_cadre(code):
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+def _echantillonner():
+    intervalle = PROFILAGE_INTERVALLE_MS / 1000
+    precedent = time.perf_counter()
+    while True:
+        time.sleep(intervalle)
+        # Poids = temps réel écoulé: le réveil est retardé quand le GIL est pris
+        maintenant = time.perf_counter()
+        ecart_ms, precedent = (maintenant - precedent) * 1000, maintenant
+        cadres = sys._current_frames()
+        for ident, (piles, nombre) in list(_piles.items()):
+            cadre = cadres.get(ident)
+            pile = []
+            while cadre is not None:
+                pile.append(_nom_cadre(cadre.f_code))
+                cadre = cadre.f_back
+            if pile:
+                piles[tuple(reversed(pile))] += ecart_ms
+                nombre[0] += 1
+
+
+def debut_requete():
+    """Suivre la requête du thread courant (étapes et échantillons de pile)"""
+    global _echantillonneur
+    if not PROFILAGE:
+        return
+    with _verrou:
+        if _echantillonneur is None or _echantillonneur[0] != os.getpid():
+            thread = threading.Thread(target=_echantillonner, name='profilage', daemon=True)
+            _echantillonneur = (os.getpid(), thread)
+            thread.start()
+    contexte.etapes = dict.fromkeys(ETAPES, 0.0)
+    contexte.ouvertes = []
+    _piles[threading.get_ident()] = (Counter(), [0])
+
+
+def fin_requete(route, methode, code, duree):
+    """Arrêter le suivi; garder le profil si la requête est lente ou tirée au sort"""
+    etapes = getattr(contexte, 'etapes', None)
+    if etapes is None:
+        return
+    contexte.etapes = None
+    piles, nombre = _piles.pop(threading.get_ident(), (Counter(), [0]))
+
+    if duree * 1000 < PROFILAGE_SEUIL_MS and random.random() >= PROFILAGE_TAUX:
+        return
+    try:
+        enregistrer_profil({
+            'date': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+            'route': route,
+            'methode': methode,
+            'code': code,
+            'duree': duree,
+            'etapes': etapes,
+            'autre': max(0.0, duree - sum(etapes.values())),
+            'echantillons': nombre[0],
+        }, piles)
+    except OSError as e:
+        print(f"⚠ Profil non enregistré: {e}")
+
+
+# ==================== PROFILS ====================
+
+def speedscope(nom, piles):
+    """Profil échantillonné au format speedscope (`piles`: pile -> millisecondes)"""
+    cadres, indices = [], {}
+    echantillons, poids = [], []
+    for pile, millisecondes in piles.items():
+        ligne = []
+        for cadre in pile:
+            if cadre not in indices:
+                indices[cadre] = len(cadres)
+                cadres.append({'name': cadre})
+            ligne.append(indices[cadre])
+        echantillons.append(ligne)
+        poids.append(round(millisecondes, 3))
+    return {
+        '$schema': 'https://www.speedscope.app/file-format-schema.json',
+        'shared': {'frames': cadres},
+        'profiles': [{
+            'type': 'sampled', 'name': nom, 'unit': 'milliseconds',
+            'startValue': 0, 'endValue': sum(poids),
+            'samples': echantillons, 'weights': poids,
+        }],
+        'name': nom,
+        'exporter': 'alubilles',
+    }
+
+
+def piles_repliees(profil):
+    """Le même profil en piles repliées (une ligne 'a;b;c millisecondes', format flamegraph.pl)"""
+    cadres = [cadre['name'] for cadre in profil['shared']['frames']]
+    donnees = profil['profiles'][0]
+    return ''.join(
+        ';'.join(cadres[i] for i in pile) + f' {max(1, round(poids))}\n'
+        for pile, poids in zip(donnees['samples'], donnees['weights'])
+    )
+
+
+def _ecrire_atomique(chemin, donnees):
+    descripteur, temporaire = tempfile.mkstemp(dir=PROFILAGE_DOSSIER, suffix='.tmp')
+    try:
+        with os.fdopen(descripteur, 'w') as f:
+            json.dump(donnees, f)
+        os.replace(temporaire, chemin)
+    except BaseException:
+        os.unlink(temporaire)
+        raise
+
+
+def enregistrer_profil(resume, piles):
+    """Écrire le résumé et le profil d'une requête, puis supprimer les plus anciens"""
+    os.makedirs(PROFILAGE_DOSSIER, exist_ok=True)
+    ident = f"{time.time_ns()}-{os.getpid()}"
+    nom = f"{resume['methode']} {resume['route']} ({resume['duree'] * 1000:.0f} ms, {resume['date']})"
+    _ecrire_atomique(os.path.join(PROFILAGE_DOSSIER, f'{ident}.speedscope.json'), speedscope(nom, piles))
+    _ecrire_atomique(os.path.join(PROFILAGE_DOSSIER, f'{ident}.json'), resume)
+
+    # Rotation: les identifiants commencent par l'heure en nanosecondes
+    idents = sorted((nom[:-5] for nom in os.listdir(PROFILAGE_DOSSIER)
+                     if nom.endswith('.json') and MOTIF_ID.match(nom[:-5])),
+                    key=lambda i: int(i.split('-')[0]))
+    for ancien in idents[:-PROFILAGE_MAX]:
+        for suffixe in ('.json', '.speedscope.json'):
+            try:
+                os.remove(os.path.join(PROFILAGE_DOSSIER, ancien + suffixe))
+            except FileNotFoundError:
+                pass
+    return ident
+
+
+def lister_profils(limite=50):
+    """Résumés des profils conservés, des plus lents aux plus rapides"""
+    if not os.path.isdir(PROFILAGE_DOSSIER):
+        return []
+    resumes = []
+    for nom in os.listdir(PROFILAGE_DOSSIER):
+        ident = nom[:-5]
+        if not nom.endswith('.json') or not MOTIF_ID.match(ident):
+            continue
+        try:
+            with open(os.path.join(PROFILAGE_DOSSIER, nom)) as f:
+                resume = json.load(f)
+        except (FileNotFoundError, ValueError):
+            continue
+        resume['id'] = ident
+        resumes.append(resume)
+    resumes.sort(key=lambda resume: resume['duree'], reverse=True)
+    return resumes[:limite]
+
+
+def lire_profil(ident):
+    """Profil speedscope d'une requête, None si inconnu"""
+    if not MOTIF_ID.match(ident):
+        return None
+    try:
+        with open(os.path.join(PROFILAGE_DOSSIER, f'{ident}.speedscope.json')) as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return None
@@ -61,6 +61,16 @@ document.addEventListener('DOMContentLoaded', function() {
         });
     });
 
+    // Sélection de toutes les lignes pour les actions groupées
+    const selectionTout = document.querySelector('.selection-tout');
+    if (selectionTout) {
+        selectionTout.addEventListener('change', function() {
+            document.querySelectorAll('input[name="membre_ids"]').forEach(function(caseACocher) {
+                caseACocher.checked = selectionTout.checked;
+            });
+        });
+    }
+
     // Charger les statistiques
     loadStats();
 });
@@ -0,0 +1,186 @@
+"""
+Stockage des fichiers (photos, cartes) adressé par contenu
+
+Chaque fichier est rangé sous la clé ab/cd/<sha256>.<ext>: deux contenus
+identiques partagent un seul fichier, un nom ne peut plus en écraser un
+autre et aucun répertoire ne grossit au-delà de quelques entrées.
+
+Deux implémentations de la même interface:
+    StockageLocal  répertoire local (défaut, et remplaçant de S3 en développement)
+    StockageS3     bucket S3 ou compatible (MinIO, R2...), nécessite boto3
+
+Configuration: STOCKAGE=local|s3, STOCKAGE_RACINE (local, défaut: media),
+S3_BUCKET, S3_PREFIXE, S3_ENDPOINT_URL (s3).
+
+Les anciennes valeurs de photo_path / carte_path (chemins de fichiers
+d'avant ce stockage) restent lisibles telles quelles.
+"""
+
+from datetime import datetime
+import hashlib
+import io
+import mimetypes
+import os
+import re
+import tempfile
+
+MOTIF_CLE = re.compile(r'^([0-9a-f]{2})/([0-9a-f]{2})/([0-9a-f]{64})(\.[a-z0-9]+)?$')
+
+_stockage = None
+
+
+def cle_pour(empreinte, extension=''):
+    """Clé d'un contenu: ab/cd/<sha256><extension>"""
+    return f"{empreinte[:2]}/{empreinte[2:4]}/{empreinte}{extension}"
+
+
+def empreinte_cle(cle):
+    """sha256 contenu dans une clé, ou None pour un ancien chemin de fichier"""
+    correspondance = MOTIF_CLE.match(cle or '')
+    return correspondance.group(3) if correspondance else None
+
+
+class Stockage:
+    """Interface commune: écrire (dédupliqué), ouvrir, lire, supprimer, lister"""
+
+    def enregistrer(self, donnees, extension=''):
+        """Stocker un contenu (une seule fois) et retourner sa clé"""
+        cle = cle_pour(hashlib.sha256(donnees).hexdigest(), extension)
+        if not self.existe(cle):
+            self._ecrire(cle, donnees, mimetypes.guess_type(f"x{extension}")[0] or 'application/octet-stream')
+        return cle
+
+    def existe(self, cle):
+        if empreinte_cle(cle) is None:
+            return os.path.exists(cle)
+        return self._existe(cle)
+
+    def ouvrir(self, cle):
+        """Fichier binaire lisible et positionnable (FileNotFoundError si absent)"""
+        if empreinte_cle(cle) is None:
+            return open(cle, 'rb')
+        return self._ouvrir(cle)
+
+    def lire(self, cle):
+        with self.ouvrir(cle) as f:
+            return f.read()
+
+    def supprimer(self, cle):
+        if empreinte_cle(cle) is None:
+            if os.path.exists(cle):
+                os.remove(cle)
+        else:
+            self._supprimer(cle)
+
+    def chemin_local(self, cle):
+        """Chemin sur disque du fichier si le stockage est local, sinon None"""
+        if empreinte_cle(cle) is None:
+            return cle
+        return None
+
+
+class StockageLocal(Stockage):
+    """Répertoire local: <racine>/ab/cd/<sha256>.<ext>"""
+
+    def __init__(self, racine):
+        self.racine = racine
+
+    def chemin_local(self, cle):
+        if empreinte_cle(cle) is None:
+            return cle
+        return os.path.join(self.racine, *cle.split('/'))
+
+    def _existe(self, cle):
+        return os.path.exists(self.chemin_local(cle))
+
+    def _ouvrir(self, cle):
+        return open(self.chemin_local(cle), 'rb')
+
+    def _ecrire(self, cle, donnees, type_contenu):
+        chemin = self.chemin_local(cle)
+        dossier = os.path.dirname(chemin)
+        os.makedirs(dossier, exist_ok=True)
+        # Écriture atomique: un lecteur ne voit jamais un fichier partiel
+        descripteur, temporaire = tempfile.mkstemp(dir=dossier, suffix='.tmp')
+        try:
+            with os.fdopen(descripteur, 'wb') as f:
+                f.write(donnees)
+            os.replace(temporaire, chemin)
+        except BaseException:
+            os.unlink(temporaire)
+            raise
+
+    def _supprimer(self, cle):
+        try:
+            os.remove(self.chemin_local(cle))
+        except FileNotFoundError:
+            pass
+
+    def lister(self):
+        """(clé, date de modification) de tous les fichiers stockés"""
+        for dossier, _, fichiers in os.walk(self.racine):
+            for nom in fichiers:
+                chemin = os.path.join(dossier, nom)
+                cle = os.path.relpath(chemin, self.racine).replace(os.sep, '/')
+                if empreinte_cle(cle):
+                    yield cle, datetime.fromtimestamp(os.path.getmtime(chemin))
+
+
+class StockageS3(Stockage):
+    """Bucket S3 ou compatible: s3://<bucket>/<prefixe>ab/cd/<sha256>.<ext>"""
+
+    def __init__(self, bucket, prefixe='', endpoint_url=None):
+        try:
+            import boto3
+        except ImportError as e:
+            raise RuntimeError("STOCKAGE=s3 nécessite boto3 (pip install boto3)") from e
+        self.client = boto3.client('s3', endpoint_url=endpoint_url)
+        self.bucket = bucket
+        self.prefixe = prefixe
+
+    def _existe(self, cle):
+        try:
+            self.client.head_object(Bucket=self.bucket, Key=self.prefixe + cle)
+            return True
+        except self.client.exceptions.ClientError as e:
+            if e.response['Error']['Code'] in ('404', 'NoSuchKey', 'NotFound'):
+                return False
+            raise
+
+    def _ouvrir(self, cle):
+        try:
+            objet = self.client.get_object(Bucket=self.bucket, Key=self.prefixe + cle)
+        except self.client.exceptions.NoSuchKey as e:
+            raise FileNotFoundError(cle) from e
+        return io.BytesIO(objet['Body'].read())
+
+    def _ecrire(self, cle, donnees, type_contenu):
+        self.client.put_object(Bucket=self.bucket, Key=self.prefixe + cle, Body=donnees, ContentType=type_contenu)
+
+    def _supprimer(self, cle):
+        self.client.delete_object(Bucket=self.bucket, Key=self.prefixe + cle)
+
+    def lister(self):
+        pages = self.client.get_paginator('list_objects_v2').paginate(Bucket=self.bucket, Prefix=self.prefixe)
+        for page in pages:
+            for objet in page.get('Contents', []):
+                cle = objet['Key'][len(self.prefixe):]
+                if empreinte_cle(cle):
+                    yield cle, objet['LastModified'].astimezone().replace(tzinfo=None)
+
+
+def get_stockage():
+    """Stockage configuré par l'environnement (une instance par processus)"""
+    global _stockage
+    if _stockage is None:
+        if os.getenv('STOCKAGE', 'local') == 's3':
+            _stockage = StockageS3(os.environ['S3_BUCKET'], os.getenv('S3_PREFIXE', ''),
+                                   os.getenv('S3_ENDPOINT_URL'))
+        else:
+            _stockage = StockageLocal(os.getenv('STOCKAGE_RACINE', 'media'))
+    return _stockage
+
+
+def enregistrer(donnees, extension=''):
+    """Stocker un contenu dans le stockage configuré et retourner sa clé"""
+    return get_stockage().enregistrer(donnees, extension)
@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+"""
+Test de charge de l'attribution des numéros de membre
+
+Lance des centaines d'inscriptions concurrentes (plusieurs processus, comme
+des workers gunicorn, et plusieurs threads par processus) sur une base
+temporaire, puis vérifie qu'il n'y a ni doublon ni trou dans les numéros.
+
+Usage: python stress_numeros.py [--processus 8] [--threads 4] [--inscriptions 400]
+"""
+
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from datetime import datetime
+import argparse
+import os
+import sys
+import tempfile
+
+import database
+
+
+def inscrire_lot(chemin_db, debut, nombre, threads):
+    """Inscrire `nombre` membres depuis un processus, répartis sur plusieurs threads"""
+    database.DATABASE_PATH = chemin_db
+
+    def inscrire(i):
+        return database.add_membre(
+            f'Nom{i}', f'Prenom{i}', '2000-01-01', '2018', 'Sciences', 'M',
+            f'membre{i}@exemple.org', '000-000-0000', '', None
+        )[1]
+
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        return list(pool.map(inscrire, range(debut, debut + nombre)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--processus', type=int, default=8)
+    parser.add_argument('--threads', type=int, default=4)
+    parser.add_argument('--inscriptions', type=int, default=400)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as dossier:
+        chemin_db = os.path.join(dossier, 'stress.db')
+        database.DATABASE_PATH = chemin_db
+        database.init_db()
+
+        print("=" * 50)
+        print(f"{args.inscriptions} inscriptions, {args.processus} processus x {args.threads} threads")
+        print("=" * 50)
+
+        par_processus = -(-args.inscriptions // args.processus)
+        numeros = []
+        with ProcessPoolExecutor(max_workers=args.processus) as pool:
+            lots = [
+                pool.submit(inscrire_lot, chemin_db, debut,
+                            min(par_processus, args.inscriptions - debut), args.threads)
+                for debut in range(0, args.inscriptions, par_processus)
+            ]
+            for lot in lots:
+                numeros.extend(lot.result())
+
+        annee = datetime.now().year
+        attendus = {f"ALU-{annee}-{i:04d}" for i in range(1, args.inscriptions + 1)}
+        doublons = len(numeros) - len(set(numeros))
+        manquants = sorted(attendus - set(numeros))
+        en_base = database.get_stats()['total']
+
+        print(f"Numéros attribués: {len(numeros)} (en base: {en_base})")
+        print(f"Doublons: {doublons}")
+        print(f"Trous: {len(manquants)} {manquants[:10] if manquants else ''}")
+
+        if doublons or manquants or en_base != args.inscriptions:
+            print("❌ Échec: attribution des numéros incorrecte")
+            sys.exit(1)
+
+        print("✅ Aucun doublon, aucun trou")
+
+
+if __name__ == '__main__':
+    main()
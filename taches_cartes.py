@@ -0,0 +1,246 @@
+#!/usr/bin/env python3
+"""
+Worker de rendu des cartes de membre
+
+Les tâches sont enregistrées dans la table taches_cartes (voir database.py)
+et rendues dans un ProcessPoolExecutor, hors du chemin des requêtes HTTP.
+
+Usage:
+    python taches_cartes.py [--processus N]   # worker dédié (Procfile: worker)
+    flask cards rebuild [--processus N] [--force]   # re-rendre les cartes périmées
+
+En production, le worker est le processus dédié du Procfile. Le démarrage
+intégré dans un processus web (demarrer_worker_integre(), activé par
+CARTES_WORKER_INTEGRE=1) est réservé à un déploiement à un seul processus.
+"""
+
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import redirect_stdout
+import argparse
+import hashlib
+import io
+import json
+import multiprocessing
+import os
+import socket
+import threading
+import time
+import uuid
+
+from card_generator import create_alumni_member_card, version_template
+from stockage import empreinte_cle
+from database import (
+    init_db, get_membre, get_stats, reclamer_taches_cartes, terminer_tache_carte, echouer_tache_carte,
+    iter_membres_approuves, enregistrer_cartes
+)
+
+TEMPLATE_PATH = 'static/images/Carte_membre_base.png'
+
+INTERVALLE_SCRUTATION = 1.0  # secondes entre deux recherches de tâches
+DUREE_BAIL = 300             # au-delà, une tâche 'running' est considérée abandonnée
+
+_worker_integre = None
+
+
+def donnees_carte(membre):
+    """Champs du membre imprimés sur la carte"""
+    return {
+        'numero_membre': membre['numero_membre'],
+        'nom': membre['nom'],
+        'prenom': membre['prenom'],
+        'email': membre['email'],
+        'telephone': membre['telephone'],
+        'photo_path': membre['photo_path']
+    }
+
+
+def empreinte_carte(membre, version):
+    """
+    Empreinte du contenu d'une carte: champs imprimés, photo et version du template
+
+    Une clé du stockage identifie déjà le contenu de la photo; un ancien
+    chemin de fichier est identifié par sa taille et son mtime (un stat, pas
+    une relecture du fichier).
+    """
+    donnees = donnees_carte(membre)
+    photo_path = donnees['photo_path']
+    if photo_path and empreinte_cle(photo_path) is None and os.path.exists(photo_path):
+        stat = os.stat(photo_path)
+        donnees['photo'] = [stat.st_size, stat.st_mtime_ns]
+    donnees['template'] = version
+    return hashlib.sha256(json.dumps(donnees, sort_keys=True).encode()).hexdigest()
+
+
+def rendre_carte(membre_data):
+    """Rendu d'une carte (exécuté dans un processus du pool), retourne sa clé de stockage"""
+    return create_alumni_member_card(membre_data, TEMPLATE_PATH)
+
+
+def _rendre_carte_silencieux(membre_data):
+    """Rendu sans le message par carte (reconstruction de milliers de cartes)"""
+    with redirect_stdout(io.StringIO()):
+        return rendre_carte(membre_data)
+
+
+def executer_worker(processus=None, arret=None):
+    """
+    Boucle du worker: réclamer des tâches, les rendre dans le pool, enregistrer le résultat
+
+    Args:
+        processus: taille du pool (par défaut CARTES_PROCESSUS ou nombre de cœurs)
+        arret: threading.Event pour arrêter proprement la boucle
+    """
+    processus = processus or int(os.getenv('CARTES_PROCESSUS', os.cpu_count() or 1))
+    arret = arret or threading.Event()
+    worker = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+    # spawn: pas de fork d'un processus web multi-threadé
+    contexte = multiprocessing.get_context('spawn')
+    while not arret.is_set():
+        with ProcessPoolExecutor(max_workers=processus, mp_context=contexte) as pool:
+            try:
+                _traiter_taches(pool, processus, worker, arret)
+            except BrokenProcessPool as e:
+                # Un processus de rendu est mort: ses tâches seront reprises à l'expiration du bail
+                print(f"⚠ Pool de rendu interrompu, redémarrage: {e}")
+
+
+def _traiter_taches(pool, processus, worker, arret):
+    """Alimenter le pool en tâches et enregistrer les résultats jusqu'à l'arrêt"""
+    en_cours = {}
+    while not arret.is_set():
+        places = processus - len(en_cours)
+        if places > 0:
+            version = version_template(TEMPLATE_PATH)
+            for tache in reclamer_taches_cartes(worker, places, DUREE_BAIL):
+                membre = get_membre(tache['membre_id'])
+                if membre is None:
+                    echouer_tache_carte(tache['id'], worker, 'Membre supprimé')
+                    continue
+                future = pool.submit(rendre_carte, donnees_carte(membre))
+                en_cours[future] = (tache, empreinte_carte(membre, version))
+
+        if not en_cours:
+            arret.wait(INTERVALLE_SCRUTATION)
+            continue
+
+        terminees, _ = wait(en_cours, timeout=INTERVALLE_SCRUTATION, return_when=FIRST_COMPLETED)
+        for future in terminees:
+            tache, empreinte = en_cours.pop(future)
+            try:
+                carte_path = future.result()
+            except BrokenProcessPool:
+                raise
+            except Exception as e:
+                print(f"⚠ Échec du rendu de la carte (tâche {tache['id']}, essai {tache['tentatives']}): {e}")
+                echouer_tache_carte(tache['id'], worker, e)
+            else:
+                terminer_tache_carte(tache['id'], worker, carte_path, empreinte)
+
+
+def reconstruire_cartes(processus=None, forcer=False, taille_lot=200, intervalle_progression=2.0):
+    """
+    Re-rendre les cartes des membres approuvés dont le contenu a changé
+
+    Les membres sont lus par lots, les cartes rendues sur un pool de processus
+    (un par cœur par défaut) et enregistrées par lots. Une carte dont
+    l'empreinte n'a pas changé est ignorée: son fichier, adressé par son
+    contenu, n'a pas pu être remplacé.
+
+    Returns:
+        dict: compteurs 'rendues', 'inchangees', 'echecs' et 'duree' (secondes)
+    """
+    processus = processus or os.cpu_count() or 1
+    version = version_template(TEMPLATE_PATH)
+    total = get_stats()['approuves']
+    compteurs = {'rendues': 0, 'inchangees': 0, 'echecs': 0}
+    a_enregistrer = []
+    en_cours = {}
+
+    debut = time.monotonic()
+    prochain_affichage = debut + intervalle_progression
+
+    def recolter(return_when):
+        """Enregistrer les rendus terminés (par lots de taille_lot)"""
+        terminees, _ = wait(en_cours, return_when=return_when)
+        for future in terminees:
+            membre_id, numero, empreinte = en_cours.pop(future)
+            try:
+                a_enregistrer.append((membre_id, future.result(), empreinte))
+                compteurs['rendues'] += 1
+            except Exception as e:
+                print(f"⚠ Échec du rendu de la carte {numero}: {e}")
+                compteurs['echecs'] += 1
+        if len(a_enregistrer) >= taille_lot or (a_enregistrer and not en_cours):
+            enregistrer_cartes(a_enregistrer)
+            a_enregistrer.clear()
+
+    def afficher_progression(fin=False):
+        nonlocal prochain_affichage
+        maintenant = time.monotonic()
+        if not fin and maintenant < prochain_affichage:
+            return
+        prochain_affichage = maintenant + intervalle_progression
+        traitees = compteurs['rendues'] + compteurs['inchangees'] + compteurs['echecs']
+        duree = maintenant - debut
+        debit = compteurs['rendues'] / duree if duree > 0 else 0
+        print(f"{traitees}/{total} cartes: {compteurs['rendues']} rendues, "
+              f"{compteurs['inchangees']} inchangées, {compteurs['echecs']} échecs "
+              f"({debit:.1f} rendus/s)")
+
+    contexte = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(max_workers=processus, mp_context=contexte) as pool:
+        for membre in iter_membres_approuves(taille_lot):
+            empreinte = empreinte_carte(membre, version)
+            if not forcer and membre['carte_path'] and membre['carte_empreinte'] == empreinte:
+                compteurs['inchangees'] += 1
+            else:
+                # Nombre borné de rendus en vol: la lecture avance au rythme du pool
+                if len(en_cours) >= processus * 4:
+                    recolter(FIRST_COMPLETED)
+                future = pool.submit(_rendre_carte_silencieux, donnees_carte(membre))
+                en_cours[future] = (membre['id'], membre['numero_membre'], empreinte)
+            afficher_progression()
+
+        while en_cours:
+            recolter(FIRST_COMPLETED)
+            afficher_progression()
+
+    if a_enregistrer:
+        enregistrer_cartes(a_enregistrer)
+    compteurs['duree'] = time.monotonic() - debut
+    afficher_progression(fin=True)
+    return compteurs
+
+
+def demarrer_worker_integre(processus=None):
+    """
+    Démarrer (une fois par processus) le worker dans un thread d'arrière-plan
+
+    Chaque worker web a alors son propre pool: 1 processus de rendu par défaut.
+    """
+    global _worker_integre
+    if _worker_integre is not None and _worker_integre.is_alive():
+        return _worker_integre
+
+    processus = processus or int(os.getenv('CARTES_PROCESSUS', 1))
+    _worker_integre = threading.Thread(
+        target=executer_worker, kwargs={'processus': processus},
+        name='worker-cartes', daemon=True
+    )
+    _worker_integre.start()
+    return _worker_integre
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Worker de rendu des cartes de membre")
+    parser.add_argument('--processus', type=int, default=None)
+    args = parser.parse_args()
+
+    init_db()
+    print(f"✓ Worker de cartes démarré (pid {os.getpid()})")
+    try:
+        executer_worker(args.processus)
+    except KeyboardInterrupt:
+        print("Arrêt du worker")
@@ -0,0 +1,62 @@
+"""
+Tests des actions groupées de l'administration (python -m pytest test_actions_lot.py)
+"""
+
+import database
+
+
+def inscrire(nom):
+    """Inscription en attente avec email; renvoie l'id du membre"""
+    membre_id, _ = database.add_membre(nom=nom, prenom='Test', date_naissance='', genre='', promotion='2016',
+                                       programme='Sciences', email=f'{nom.lower()}@exemple.org', telephone='',
+                                       adresse='', photo_path=None)
+    return membre_id
+
+
+def etat():
+    """Statut, tâches de carte et destinataires d'emails, par nom de membre"""
+    with database.transaction() as conn:
+        statuts = {ligne['nom']: ligne['statut'] for ligne in conn.execute('SELECT nom, statut FROM membres')}
+        cartes = {ligne['nom'] for ligne in conn.execute(
+            'SELECT m.nom FROM taches_cartes t JOIN membres m ON m.id = t.membre_id')}
+        emails = [ligne['destinataire'] for ligne in conn.execute('SELECT destinataire FROM email_outbox ORDER BY id')]
+    return statuts, cartes, emails
+
+
+def test_lots_ne_touchent_que_les_membres_dans_le_bon_statut(base):
+    """Une sélection mêlant inscriptions en attente et membres approuvés: seules les premières changent"""
+    from app import app
+
+    ids = {nom: inscrire(nom) for nom in ('Attente1', 'Attente2', 'Approuve1', 'Approuve2')}
+    database.approuver_membres([ids['Approuve1'], ids['Approuve2']])
+    with database.transaction(immediate=True) as conn:
+        conn.execute('DELETE FROM email_outbox')
+    validations = {nom: database.get_membre(ids[nom])['date_validation'] for nom in ('Approuve1', 'Approuve2')}
+
+    client = app.test_client()
+    client.post('/admin/login', data={'username': 'admin', 'password': 'admin123'})
+    selection = [ids['Attente1'], ids['Approuve1'], ids['Attente2'], ids['Approuve2'], 9999]
+
+    reponse = client.post('/admin/approuver-lot', data={'membre_ids': selection}, follow_redirects=True)
+    assert '2 inscription(s) approuvée(s)' in reponse.get_data(as_text=True)
+    statuts, cartes, emails = etat()
+    assert set(statuts.values()) == {'approuve'}
+    assert cartes == {'Attente1', 'Attente2'}
+    assert emails == ['attente1@exemple.org', 'attente2@exemple.org']
+    for nom, date_validation in validations.items():
+        assert database.get_membre(ids[nom])['date_validation'] == date_validation
+
+    # Refus: un membre déjà approuvé reste approuvé
+    ids['Attente3'] = inscrire('Attente3')
+    client.post('/admin/refuser-lot', data={'membre_ids': [ids['Attente3'], ids['Approuve1']], 'motif': 'Doublon'})
+    statuts, _, emails = etat()
+    assert (statuts['Attente3'], statuts['Approuve1']) == ('refuse', 'approuve')
+    assert emails[-1] == 'attente3@exemple.org'
+
+    # Suspension: une inscription en attente n'est pas suspendue
+    ids['Attente4'] = inscrire('Attente4')
+    client.post('/admin/suspendre-lot', data={'membre_ids': [ids['Attente4'], ids['Approuve2']]})
+    statuts, cartes, emails = etat()
+    assert (statuts['Attente4'], statuts['Approuve2']) == ('en_attente', 'suspendu')
+    assert emails[-1] == 'approuve2@exemple.org'
+    assert cartes == {'Attente1', 'Attente2'}
@@ -3,10 +3,16 @@
 Script de test pour vérifier la configuration des emails
 """
 
-from email_service import init_mail, envoyer_email_inscription, envoyer_notification_admin
+from email_service import init_mail, envoyer_email_inscription, envoyer_notification_admin, expedier_lot, mail
 from flask import Flask
 from dotenv import load_dotenv
 import os
+import socketserver
+import sys
+import tempfile
+import threading
+
+import database
 
 # Charger les variables d'environnement
 load_dotenv()
@@ -115,6 +121,113 @@ def test_notification_admin():
             return False
 
 
+class ServeurSMTPLocal(socketserver.ThreadingTCPServer):
+    """Serveur SMTP minimal qui accepte tout et garde les messages en mémoire"""
+    allow_reuse_address = True
+    daemon_threads = True
+
+    def __init__(self):
+        super().__init__(('127.0.0.1', 0), GestionnaireSMTP)
+        self.messages = []
+        self.connexions = 0
+
+
+class GestionnaireSMTP(socketserver.StreamRequestHandler):
+    """Dialogue SMTP juste suffisant pour smtplib (EHLO, MAIL, RCPT, DATA, QUIT)"""
+
+    def repondre(self, ligne):
+        self.wfile.write(f"{ligne}\r\n".encode())
+
+    def handle(self):
+        self.server.connexions += 1
+        self.repondre('220 localhost SMTP local')
+        while True:
+            ligne = self.rfile.readline()
+            if not ligne:
+                break
+            commande = ligne.decode(errors='replace').strip().upper()
+            if commande.startswith('DATA'):
+                self.repondre('354 Terminer par <CRLF>.<CRLF>')
+                contenu = []
+                for ligne_data in iter(self.rfile.readline, b''):
+                    if ligne_data.rstrip(b'\r\n') == b'.':
+                        break
+                    contenu.append(ligne_data)
+                self.server.messages.append(b''.join(contenu))
+                self.repondre('250 Message accepté')
+            elif commande.startswith('QUIT'):
+                self.repondre('221 Au revoir')
+                break
+            else:
+                self.repondre('250 OK')
+
+
+def test_boite_envoi_locale(base):
+    """Tester la boîte d'envoi et l'expéditeur contre un serveur SMTP local"""
+    print("\n" + "=" * 50)
+    print("TEST DE LA BOÎTE D'ENVOI (SMTP LOCAL)")
+    print("=" * 50)
+
+    serveur = ServeurSMTPLocal()
+    threading.Thread(target=serveur.serve_forever, daemon=True).start()
+    port = serveur.server_address[1]
+
+    app_locale = Flask('test_local')
+    init_mail(app_locale)
+    app_locale.config.update(
+        MAIL_SERVER='127.0.0.1', MAIL_PORT=port, MAIL_USE_TLS=False, MAIL_USE_SSL=False,
+        MAIL_USERNAME=None, MAIL_PASSWORD=None, MAIL_DEFAULT_SENDER='test@alubilles.org'
+    )
+    mail.init_app(app_locale)
+
+    try:
+        with app_locale.app_context():
+            envoyer_email_inscription('membre1@exemple.org', 'Test', 'Un', 'ALU-2024-0001')
+            envoyer_email_inscription('membre2@exemple.org', 'Test', 'Deux', 'ALU-2024-0002')
+            envoyer_notification_admin('admin@exemple.org', 'Test', 'Deux', 'ALU-2024-0002')
+
+            expedier_lot('test')
+            statuts = [r['statut'] for r in database.get_db_connection().execute('SELECT statut FROM email_outbox')]
+            print(f"📬 Messages reçus: {len(serveur.messages)} en {serveur.connexions} connexion(s)")
+            assert len(serveur.messages) == 3
+            assert serveur.connexions == 1
+            assert statuts == ['done'] * 3
+
+            # Serveur arrêté: l'email doit être reprogrammé, pas perdu
+            serveur.shutdown()
+            serveur.server_close()
+            envoyer_email_inscription('membre3@exemple.org', 'Test', 'Trois', 'ALU-2024-0003')
+            expedier_lot('test')
+            echec = database.get_db_connection().execute(
+                'SELECT statut, tentatives, erreur FROM email_outbox ORDER BY id DESC LIMIT 1'
+            ).fetchone()
+            print(f"📭 Serveur indisponible: statut={echec['statut']}, tentatives={echec['tentatives']}")
+            assert echec['statut'] == 'queued' and echec['tentatives'] == 1
+            assert echec['erreur']
+    finally:
+        serveur.shutdown()
+        serveur.server_close()
+
+
+def boite_envoi_locale():
+    """Même test hors pytest (python test_email.py --local): True s'il réussit"""
+    ancien_chemin = database.DATABASE_PATH
+    with tempfile.TemporaryDirectory() as dossier:
+        database.DATABASE_PATH = os.path.join(dossier, 'test_emails.db')
+        try:
+            database.init_db()
+            test_boite_envoi_locale(None)
+        except AssertionError:
+            print("❌ Boîte d'envoi: résultat inattendu")
+            return False
+        finally:
+            database.fermer_connexion()
+            database.DATABASE_PATH = ancien_chemin
+
+    print("✅ Boîte d'envoi OK")
+    return True
+
+
 def main():
     """Fonction principale"""
     print("\n🔧 OUTIL DE TEST EMAIL - ALUBILLES")
@@ -139,4 +252,7 @@ def main():
 
 
 if __name__ == '__main__':
+    # python test_email.py --local: test non interactif contre un serveur SMTP local
+    if '--local' in sys.argv:
+        sys.exit(0 if boite_envoi_locale() else 1)
     main()
\ No newline at end of file
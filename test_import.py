@@ -0,0 +1,44 @@
+"""
+Tests de l'import CSV des membres historiques (python -m pytest test_import.py)
+"""
+
+import io
+import os
+
+from PIL import Image
+
+from card_generator import create_alumni_member_card
+from conftest import RACINE
+from imports import importer_csv
+from taches_cartes import TEMPLATE_PATH, donnees_carte
+import database
+
+
+def test_champs_facultatifs_vides_puis_rendu_de_carte(base, tmp_path):
+    """Un membre importé sans téléphone ni email garde des champs '' et sa carte se rend"""
+    flux = io.StringIO(
+        'nom;prenom;email;telephone;adresse;date_naissance;promotion\n'
+        'Diallo;Thierno;;;;;2010\n'
+    )
+    rapport = importer_csv(flux, approuves=True)
+    assert rapport['nb_erreurs'] == 0
+    assert rapport['importes'] == 1
+
+    membre = database.get_membres_approuves()[0]
+    for colonne in ('email', 'telephone', 'adresse', 'date_naissance', 'genre', 'programme'):
+        assert membre[colonne] == ''
+    assert membre['date_inscription']
+
+    sortie = tmp_path / 'carte.png'
+    create_alumni_member_card(donnees_carte(membre), os.path.join(RACINE, TEMPLATE_PATH), str(sortie))
+    with Image.open(sortie) as carte:
+        assert carte.format == 'PNG'
+
+
+def test_rendu_tolere_les_champs_null(tmp_path):
+    """Les membres importés avant la correction ont des NULL: le rendu affiche N/A"""
+    membre = {'numero_membre': 'ALU-2010-0001', 'nom': 'Diallo', 'prenom': 'Thierno',
+              'email': None, 'telephone': None, 'photo_path': None}
+    sortie = tmp_path / 'carte.png'
+    create_alumni_member_card(membre, os.path.join(RACINE, TEMPLATE_PATH), str(sortie))
+    assert sortie.exists()
@@ -0,0 +1,60 @@
+"""
+Tests de l'inscription en ligne (python -m pytest test_inscription.py)
+"""
+
+import io
+import os
+import zipfile
+
+from card_generator import create_alumni_member_card
+from conftest import RACINE
+from taches_cartes import TEMPLATE_PATH, donnees_carte
+import database
+
+
+def test_inscription_puis_zip_de_la_promotion(base):
+    """Un membre inscrit par le site se retrouve dans le ZIP des cartes de sa promotion"""
+    from app import app
+
+    client = app.test_client()
+    reponse = client.post('/inscription', data={
+        'nom': 'Diallo', 'prenom': 'Thierno', 'date_naissance': '1992-05-01', 'genre': 'Masculin',
+        'promotion': '2015', 'programme': 'Sciences', 'email': '', 'consent': '1',
+    })
+    assert reponse.status_code == 302
+
+    membre = database.get_all_membres()[0]
+    assert (membre['promotion'], membre['programme'], membre['genre']) == ('2015', 'Sciences', 'Masculin')
+
+    client.post('/admin/login', data={'username': 'admin', 'password': 'admin123'})
+    client.post(f"/admin/approuver/{membre['id']}")
+    membre = database.get_membre(membre['id'])
+    carte = create_alumni_member_card(donnees_carte(membre), os.path.join(RACINE, TEMPLATE_PATH))
+    database.update_carte_path(membre['id'], carte)
+
+    reponse = client.get('/admin/cartes-promotion.zip?promotion=2015')
+    assert reponse.status_code == 200
+    with zipfile.ZipFile(io.BytesIO(reponse.get_data())) as archive:
+        assert archive.namelist() == [f"{membre['numero_membre']}_Diallo_Thierno.png"]
+
+
+def test_approbation_d_une_inscription_deja_refusee(base):
+    """Une inscription refusée entre-temps n'est ni approuvée, ni mise en carte, ni notifiée"""
+    from app import app
+
+    membre_id, _ = database.add_membre(nom='Sow', prenom='Fatou', date_naissance='', genre='', promotion='2014',
+                                       programme='Droit', email='fatou@exemple.org', telephone='', adresse='',
+                                       photo_path=None)
+    database.refuser_membres([membre_id], 'Doublon')
+
+    client = app.test_client()
+    client.post('/admin/login', data={'username': 'admin', 'password': 'admin123'})
+    with database.transaction() as conn:
+        emails_avant = conn.execute('SELECT COUNT(*) FROM email_outbox').fetchone()[0]
+
+    reponse = client.post(f'/admin/approuver/{membre_id}', follow_redirects=True)
+    assert "plus en attente" in reponse.get_data(as_text=True)
+    assert database.get_membre(membre_id)['statut'] == 'refuse'
+    assert database.get_tache_carte(membre_id) is None
+    with database.transaction() as conn:
+        assert conn.execute('SELECT COUNT(*) FROM email_outbox').fetchone()[0] == emails_avant
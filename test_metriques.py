@@ -0,0 +1,31 @@
+"""
+Tests de l'attribution des métriques SQL (python -m pytest test_metriques.py)
+"""
+
+import io
+
+from imports import importer_csv
+import metriques
+
+
+def requetes_sql(route):
+    """Nombre de requêtes SQL comptées pour une route dans ce processus"""
+    return metriques._valeurs.get(metriques._cle('alubilles_sql_requetes_total', {'route': route}), 0)
+
+
+def test_export_en_flux_compte_pour_sa_route(base):
+    """Les requêtes lues pendant l'envoi d'un export restent rattachées à sa route"""
+    from app import app
+
+    importer_csv(io.StringIO('nom;prenom;promotion\nDiallo;Thierno;2010\n'), approuves=True)
+    client = app.test_client()
+    client.post('/admin/login', data={'username': 'admin', 'password': 'admin123'})
+
+    route = '/admin/export.<any(csv, xlsx):fmt>'
+    avant, avant_hors_requete = requetes_sql(route), requetes_sql('hors_requete')
+    reponse = client.get('/admin/export.csv')
+    assert 'Diallo' in reponse.get_data(as_text=True)
+
+    assert requetes_sql(route) > avant + 1
+    assert requetes_sql('hors_requete') == avant_hors_requete
+    assert getattr(metriques.contexte, 'route', None) is None
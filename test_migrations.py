@@ -0,0 +1,35 @@
+"""
+Tests des migrations qui réécrivent des données (python -m pytest test_migrations.py)
+"""
+
+import database
+
+
+def test_champs_inscription_reecrit_seulement_les_lignes_decalees(base):
+    """Migration 11: seule une année rangée dans programme, sans promotion, est déplacée"""
+    lignes = [
+        # (nom, promotion, programme): état avant migration
+        ('Barry', '', '2012'),         # inscription en ligne décalée
+        ('Camara', None, '1998'),      # idem, promotion NULL
+        ('Bah', '2010', 'Droit'),      # membre importé
+        ('Sow', '', 'Lettres'),        # promotion absente, vrai programme
+        ('Keita', '2011', '2015'),     # promotion déjà renseignée
+        ('Touré', '', '2012 bis'),     # pas une année
+    ]
+    with database.transaction(immediate=True) as conn:
+        for numero, (nom, promotion, programme) in enumerate(lignes, 1):
+            conn.execute('''
+                INSERT INTO membres (numero_membre, nom, prenom, promotion, programme, date_inscription, statut)
+                VALUES (?, ?, 'Test', ?, ?, '2024-01-15 10:00:00', 'approuve')
+            ''', (f'ALU-2024-{numero:04d}', nom, promotion, programme))
+        database._migration_champs_inscription(conn.cursor())
+
+    apres = {membre['nom']: (membre['promotion'], membre['programme']) for membre in database.get_all_membres()}
+    assert apres == {
+        'Barry': ('2012', ''),
+        'Camara': ('1998', ''),
+        'Bah': ('2010', 'Droit'),
+        'Sow': ('', 'Lettres'),
+        'Keita': ('2011', '2015'),
+        'Touré': ('', '2012 bis'),
+    }
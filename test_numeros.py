@@ -0,0 +1,31 @@
+"""
+Tests de l'attribution des numéros de membre (python -m pytest test_numeros.py)
+"""
+
+from datetime import datetime
+
+import database
+
+
+def inscrire(nom):
+    """Inscrire un membre minimal et renvoyer (id, numéro)"""
+    return database.add_membre(nom=nom, prenom='Test', date_naissance='', genre='', promotion='2018',
+                               programme='Sciences', email='', telephone='', adresse='', photo_path=None)
+
+
+def test_numero_supprime_jamais_reattribue(base):
+    """Supprimer le plus grand numéro ne le remet pas en circulation, même quand la séquence est recalculée"""
+    annee = datetime.now().year
+    inscrits = [inscrire(f'Membre{i}') for i in range(3)]
+    database.delete_membre(inscrits[-1][0])
+    inscrits.append(inscrire('Membre3'))
+
+    # Séquence recalculée depuis l'existant (migrations 5 et 12) après une autre suppression
+    database.delete_membre(inscrits[-1][0])
+    with database.transaction(immediate=True) as conn:
+        conn.execute('DELETE FROM sequences_numeros')
+        database._migration_sequences_numeros(conn.cursor())
+    inscrits.append(inscrire('Membre4'))
+
+    # Ni réutilisation ni trou
+    assert [numero for _, numero in inscrits] == [f'ALU-{annee}-{n:04d}' for n in range(1, 6)]
@@ -0,0 +1,85 @@
+"""
+Tests de la pagination keyset des listes de membres (python -m pytest test_pagination.py)
+"""
+
+import base64
+import json
+
+import database
+
+NOMBRE = database.TAILLE_PAGE_MAX * 2 + 37
+
+
+def inserer_ex_aequo(nombre=NOMBRE):
+    """Inscriptions en attente toutes datées de la même seconde: seul l'id départage le tri"""
+    with database.transaction(immediate=True) as conn:
+        conn.executemany('''
+            INSERT INTO membres (numero_membre, nom, prenom, date_inscription, statut)
+            VALUES (?, ?, 'Test', '2024-01-15 10:00:00', 'en_attente')
+        ''', [(f'ALU-2024-{i:04d}', f'Nom{i}') for i in range(1, nombre + 1)])
+
+
+def parcourir(liste, sens):
+    """Suivre les curseurs `sens` ('suivant' ou 'precedent') et renvoyer les ids vus, page par page"""
+    page = database.get_page_membres(liste, taille=database.TAILLE_PAGE_MAX)
+    if sens == 'precedent':
+        # Aller à la dernière page avant de remonter
+        while page['suivant']:
+            page = database.get_page_membres(liste, apres=page['suivant'], taille=database.TAILLE_PAGE_MAX)
+    pages = [[membre['id'] for membre in page['membres']]]
+    while page[sens]:
+        curseur = {'apres': page[sens]} if sens == 'suivant' else {'avant': page[sens]}
+        page = database.get_page_membres(liste, taille=database.TAILLE_PAGE_MAX, **curseur)
+        pages.append([membre['id'] for membre in page['membres']])
+    return pages
+
+
+def test_pages_sans_doublon_ni_trou_a_date_egale(base):
+    """Plus de TAILLE_PAGE_MAX lignes ex aequo: chaque ligne apparaît une fois, dans les deux sens"""
+    inserer_ex_aequo()
+
+    for liste in ('en_attente', 'tous'):
+        pages = parcourir(liste, 'suivant')
+        ids = [i for page in pages for i in page]
+        assert len(pages) == 3
+        assert len(ids) == NOMBRE and len(set(ids)) == NOMBRE
+
+        pages_inverses = parcourir(liste, 'precedent')
+        assert [i for page in reversed(pages_inverses) for i in page] == ids
+
+
+def curseur(valeur):
+    """Encoder une valeur quelconque comme le ferait encoder_curseur()"""
+    return base64.urlsafe_b64encode(json.dumps(valeur).encode()).decode().rstrip('=')
+
+
+CURSEURS_INVALIDES = [
+    'pas-du-base64!',
+    curseur({'date': '2024-01-15'}),
+    curseur(['2024-01-15 10:00:00']),
+    curseur(['2024-01-15 10:00:00', '12']),
+    curseur(['2024-01-15 10:00:00', 1.5]),
+    curseur(['2024-01-15 10:00:00', True]),
+    curseur([12, 3]),
+    curseur(['2024-01-15 10:00:00', 2 ** 70]),
+]
+
+
+def test_curseur_altere_ramene_a_la_premiere_page(base):
+    """Un ?apres= malformé donne la première page (vues admin) ou un 400 (API), jamais un 500"""
+    from app import app
+
+    inserer_ex_aequo(30)
+    premiere = [membre['numero_membre'] for membre in database.get_page_membres('en_attente')['membres']]
+
+    client = app.test_client()
+    client.post('/admin/login', data={'username': 'admin', 'password': 'admin123'})
+    for invalide in CURSEURS_INVALIDES:
+        reponse = client.get('/admin/inscriptions', query_string={'apres': invalide})
+        assert reponse.status_code == 200
+        page = reponse.get_data(as_text=True)
+        assert 'Lien de pagination invalide' in page
+        assert all(numero in page for numero in premiere)
+
+        reponse = client.get('/api/membres', query_string={'liste': 'en_attente', 'apres': invalide})
+        assert reponse.status_code == 400
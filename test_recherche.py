@@ -0,0 +1,42 @@
+"""
+Tests de la recherche de membres (python -m pytest test_recherche.py)
+"""
+
+import io
+
+from imports import importer_csv
+import database
+
+
+def test_recherche_signale_les_resultats_omis(base):
+    """Au-delà de la limite, la recherche le signale au lieu de tronquer en silence"""
+    flux = io.StringIO(
+        'nom;prenom;promotion\n'
+        'Diallo;Thierno;2010\n'
+        'Diallo;Mariama;2011\n'
+        'Diallo;Ousmane;2012\n'
+    )
+    assert importer_csv(flux, approuves=True)['importes'] == 3
+
+    resultat = database.search_membres('Diallo', 'approuve', limite=2)
+    assert len(resultat['membres']) == 2
+    assert resultat['tronque']
+
+    resultat = database.search_membres('Diallo', 'approuve', limite=3)
+    assert len(resultat['membres']) == 3
+    assert not resultat['tronque']
+
+
+def test_page_admin_affiche_la_troncature(base, monkeypatch):
+    """La liste des membres indique que la recherche a été limitée"""
+    import app as application
+
+    monkeypatch.setattr(application, 'search_membres',
+                        lambda query, statut: database.search_membres(query, statut, limite=1))
+    importer_csv(io.StringIO('nom;prenom;promotion\nBah;Alpha;2010\nBah;Oumou;2011\n'), approuves=True)
+
+    client = application.app.test_client()
+    client.post('/admin/login', data={'username': 'admin', 'password': 'admin123'})
+    page = client.get('/admin/membres?search=Bah').get_data(as_text=True)
+    assert 'Membres Approuves (1+)' in page
+    assert 'precisez la recherche' in page